@@ -0,0 +1,127 @@
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import redis
+
+from app.cache import BucketLayout, CacheRecord
+
+# keys written by a benchmark live under this prefix and are removed after it.
+_PREFIX = "benchmark"
+
+
+def _used_memory(client: redis.Redis) -> int:
+    return client.info("memory")["used_memory"]
+
+
+def _write(client: redis.Redis, values: dict[str, str], batch_size: int) -> int:
+    """Writes values and returns the memory they added, in bytes."""
+    before = _used_memory(client)
+    items = list(values.items())
+    for start in range(0, len(items), batch_size):
+        pipeline = client.pipeline(transaction=False)
+        for key, value in items[start : start + batch_size]:
+            pipeline.set(key, value)
+        pipeline.execute()
+
+    return _used_memory(client) - before
+
+
+def _delete(client: redis.Redis, keys: list[str], batch_size: int) -> None:
+    for start in range(0, len(keys), batch_size):
+        client.delete(*keys[start : start + batch_size])
+
+
+def _sample_records(count: int) -> list[CacheRecord]:
+    expires_at = datetime.now() + timedelta(days=30)
+    return [
+        CacheRecord.of(
+            f"https://example.com/campaigns/2026/landing-page?id={index}",
+            expires_at=expires_at if index % 2 else None,
+            owner_id=uuid.uuid4(),
+        )
+        for index in range(count)
+    ]
+
+
+def cache_record_benchmark(
+    client: redis.Redis, *, keys: int, batch_size: int = 1000
+) -> dict:
+    """Compares plain url values with encoded CacheRecords.
+
+    Reports redis memory per key and decode time per value of both layouts.
+    """
+    records = _sample_records(keys)
+    plain = {f"{_PREFIX}:plain:{i}": r.original_url for i, r in enumerate(records)}
+    encoded = {f"{_PREFIX}:record:{i}": r.encode() for i, r in enumerate(records)}
+
+    try:
+        plain_bytes = _write(client, plain, batch_size)
+        record_bytes = _write(client, encoded, batch_size)
+    finally:
+        _delete(client, [*plain, *encoded], batch_size)
+
+    timings = {}
+    for name, values in (("plain", plain), ("record", encoded)):
+        start = time.perf_counter()
+        for value in values.values():
+            CacheRecord.decode(value)
+        timings[name] = (time.perf_counter() - start) / keys * 1e9
+
+    return {
+        "keys": keys,
+        "plain_bytes_per_key": round(plain_bytes / keys, 1),
+        "record_bytes_per_key": round(record_bytes / keys, 1),
+        "plain_decode_ns": round(timings["plain"], 1),
+        "record_decode_ns": round(timings["record"], 1),
+    }
+
+
+def cache_layout_benchmark(
+    client: redis.Redis,
+    *,
+    keys: int,
+    buckets: int | None = None,
+    batch_size: int = 1000,
+) -> dict:
+    """Compares memory of one key per code with hash-bucketed codes.
+
+    Values above hash-max-listpack-value turn buckets into real hash tables,
+    the configured limits are reported next to the results.
+    """
+    buckets = buckets or max(1, keys // 100)
+    layout = BucketLayout(buckets=buckets)
+
+    encoded = [record.encode() for record in _sample_records(keys)]
+    codes = [f"code{index:07d}" for index in range(keys)]
+
+    try:
+        key_bytes = _write(
+            client, dict(zip((f"{_PREFIX}:{c}" for c in codes), encoded)), batch_size
+        )
+    finally:
+        _delete(client, [f"{_PREFIX}:{code}" for code in codes], batch_size)
+
+    # benchmark buckets live apart from the real ones.
+    bucket_names = [f"{_PREFIX}:{layout.bucket(code)}" for code in codes]
+    before = _used_memory(client)
+    try:
+        for start in range(0, keys, batch_size):
+            pipeline = client.pipeline(transaction=False)
+            for index in range(start, min(start + batch_size, keys)):
+                pipeline.hset(bucket_names[index], codes[index], encoded[index])
+            pipeline.execute()
+        bucket_bytes = _used_memory(client) - before
+    finally:
+        _delete(client, sorted(set(bucket_names)), batch_size)
+
+    config = client.config_get("hash-max-listpack-*")
+    return {
+        "keys": keys,
+        "buckets": buckets,
+        "key_bytes_per_key": round(key_bytes / keys, 1),
+        "bucket_bytes_per_key": round(bucket_bytes / keys, 1),
+        "key_mb_per_million": round(key_bytes / keys * 1e6 / 2**20, 1),
+        "bucket_mb_per_million": round(bucket_bytes / keys * 1e6 / 2**20, 1),
+        "hash_max_listpack": config,
+    }
@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import math
+import threading
+from typing import Callable, Iterable, Optional
+
+LOG = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed-size bloom filter sized for a target capacity and false-positive rate.
+
+    Membership tests can return false positives but never false negatives, so a
+    miss is proof that the key was never added.
+    """
+
+    def __init__(self, *, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        self.num_bits = max(
+            8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        )
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+
+        # writers take the lock so concurrent adds on the same byte can't lose bits.
+        self._lock = threading.Lock()
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._count = 0
+        # set while rebuilding, adds go to both bit arrays.
+        self._next_bits: Optional[bytearray] = None
+        self._next_count = 0
+
+    def add(self, key: str) -> None:
+        positions = self._positions(key)
+        with self._lock:
+            _set_bits(self._bits, positions)
+            self._count += 1
+            if self._next_bits is not None:
+                _set_bits(self._next_bits, positions)
+                self._next_count += 1
+
+    def rebuild(self, keys: Iterable[str]) -> int:
+        """Replaces the contents with keys, returns how many were loaded.
+
+        Lookups keep using the current bits until the new ones are complete.
+        Keys added while rebuilding land in both, so none of them is lost.
+        """
+        with self._lock:
+            self._next_bits = bytearray(len(self._bits))
+            self._next_count = 0
+
+        loaded = 0
+        try:
+            for key in keys:
+                positions = self._positions(key)
+                with self._lock:
+                    _set_bits(self._next_bits, positions)
+                loaded += 1
+        except BaseException:
+            with self._lock:
+                self._next_bits = None
+            raise
+
+        with self._lock:
+            self._bits, self._next_bits = self._next_bits, None
+            self._count = loaded + self._next_count
+
+        return loaded
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _positions(self, key: str) -> list[int]:
+        # double hashing (Kirsch-Mitzenmacher) from a single 128 bit digest.
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def stats(self) -> dict:
+        return {
+            "keys": self._count,
+            "capacity": self.capacity,
+            "num_bits": self.num_bits,
+            "num_hashes": self.num_hashes,
+        }
+
+
+def _set_bits(bits: bytearray, positions: list[int]) -> None:
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+
+
+class BloomFilterRefresher:
+    """Rebuilds the bloom filter from postgres every `interval_seconds`.
+
+    The filter is only kept current by invalidation messages, and pub/sub
+    drops the ones published while a worker is disconnected. A periodic
+    rebuild bounds how long a missed code is rejected, `request` asks for an
+    early one, e.g. once the invalidation listener has reconnected.
+    """
+
+    def __init__(
+        self,
+        *,
+        load: Callable[[], int],
+        interval_seconds: float = 3600,
+        settle_seconds: float = 5,
+    ):
+        self.load = load
+        self.interval_seconds = interval_seconds
+        self.settle_seconds = settle_seconds
+
+        self._requested = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        # counters, exported through the metrics endpoint.
+        self.runs = 0
+        self.requested = 0
+        self.failed = 0
+
+    def request(self) -> None:
+        self.requested += 1
+        self._requested.set()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="bloom-filter-refresher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        self._stopping.set()
+        self._requested.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            if self._requested.wait(self.interval_seconds):
+                # lets the listener re-subscribe first, repeated requests (a
+                # listener that keeps failing) push the rebuild further out.
+                while self._requested.is_set() and not self._stopping.is_set():
+                    self._requested.clear()
+                    self._stopping.wait(self.settle_seconds)
+
+            if self._stopping.is_set():
+                break
+
+            try:
+                self.load()
+                self.runs += 1
+            except Exception:
+                self.failed += 1
+                LOG.exception("bloom filter refresh failed.")
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "requested": self.requested,
+            "failed": self.failed,
+        }
@@ -1,30 +1,561 @@
-from typing import Optional
+import logging
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from itertools import islice
+from typing import Any, Callable, NamedTuple, Optional
 
 import redis
+import redis.asyncio
+import redis.asyncio.lock
+import redis.lock
 
 from app.config import Settings
+from app.dto import ALIAS_PATTERN
+
+LOG = logging.getLogger(__name__)
 
 _redis_client: redis.Redis = None
+_async_redis_client: redis.asyncio.Redis = None
+
+# leading byte of an encoded CacheRecord, a url never starts with it.
+_RECORD_V1 = "\x01"
+_RECORD_SEPARATOR = "\x1f"
+
+
+class CacheRecord(NamedTuple):
+    """Everything a redirect needs, stored as one redis value.
+
+    Encoded as "\\x01expires_at\\x1factive\\x1fstatus\\x1fowner\\x1furl". The
+    url goes last so it can contain anything, and values without the version
+    byte are read as plain urls written by older releases.
+    """
+
+    original_url: str
+    # unix timestamp, 0 for urls that never expire.
+    expires_at: int = 0
+    is_active: bool = True
+    status_code: int = 302
+    owner_id: str = ""
+
+    @classmethod
+    def of(
+        cls,
+        original_url: str,
+        *,
+        expires_at: Optional[datetime] = None,
+        is_active: bool = True,
+        owner_id: Optional[uuid.UUID] = None,
+        status_code: int = 302,
+    ) -> "CacheRecord":
+        return cls(
+            original_url,
+            int(expires_at.timestamp()) if expires_at else 0,
+            is_active,
+            status_code,
+            owner_id.hex if owner_id else "",
+        )
+
+    def is_live(self) -> bool:
+        return self.is_active and (not self.expires_at or self.expires_at > time.time())
+
+    def ttl(self, default_ttl: int) -> int:
+        """Seconds the record may stay cached, 0 if it must not be cached."""
+        if not self.is_active:
+            return 0
+        if not self.expires_at:
+            return default_ttl
+        return max(0, min(default_ttl, int(self.expires_at - time.time())))
+
+    def encode(self) -> str:
+        return (
+            f"{_RECORD_V1}{self.expires_at}{_RECORD_SEPARATOR}{int(self.is_active)}"
+            f"{_RECORD_SEPARATOR}{self.status_code}{_RECORD_SEPARATOR}"
+            f"{self.owner_id}{_RECORD_SEPARATOR}{self.original_url}"
+        )
+
+    @classmethod
+    def decode(cls, value: str) -> "CacheRecord":
+        if value[:1] != _RECORD_V1:
+            return cls(value)
+
+        expires_at, is_active, status_code, owner_id, original_url = value[1:].split(
+            _RECORD_SEPARATOR, 4
+        )
+        return cls(
+            original_url,
+            int(expires_at),
+            is_active == "1",
+            int(status_code),
+            owner_id,
+        )
+
+
+class LocalCache:
+    """Bounded, thread-safe in-process LRU cache with a per-entry TTL."""
+
+    def __init__(self, *, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+        # counters, exported through the metrics endpoint.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds
+        if ttl_seconds is not None:
+            ttl = min(ttl, ttl_seconds)
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class CacheInvalidator:
+    """Fans cache invalidations out to every worker through redis pub/sub.
+
+    Each process subscribes its handlers once at startup; a publish on a channel
+    reaches all of them, including the publisher itself. Messages published while
+    a subscriber is disconnected are lost, so local entries must always carry a TTL.
+    """
+
+    def __init__(self, *, client: redis.Redis):
+        self._client = client
+        self._handlers: dict[str, list[Callable[[str], None]]] = defaultdict(list)
+        self._error_handlers: list[Callable[[], None]] = []
+        self._pubsub = None
+        self._thread = None
+
+    def subscribe(self, channel: str, handler: Callable[[str], None]) -> None:
+        self._handlers[channel].append(handler)
+
+    def on_error(self, handler: Callable[[], None]) -> None:
+        """Registers a handler run whenever the listener lost its connection.
+
+        Messages may have been missed, state kept current by them (unlike TTL
+        bound entries) should be resynced.
+        """
+        self._error_handlers.append(handler)
+
+    def publish(self, channel: str, key: str) -> None:
+        self._client.publish(channel, key)
+
+    def publish_many(self, channel: str, keys: list[str]) -> None:
+        pipeline = self._client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.publish(channel, key)
+        pipeline.execute()
+
+    def start(self) -> None:
+        if not self._handlers:
+            return
+
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(
+            **{channel: self._dispatch for channel in self._handlers},
+        )
+        self._thread = self._pubsub.run_in_thread(
+            sleep_time=1,
+            daemon=True,
+            exception_handler=self._on_error,
+        )
+
+    def stop(self) -> None:
+        if self._thread:
+            self._thread.stop()
+            self._thread.join(timeout=5)
+            self._thread = None
+
+        if self._pubsub:
+            self._pubsub.close()
+            self._pubsub = None
+
+    def _dispatch(self, message: dict) -> None:
+        for handler in self._handlers[message["channel"]]:
+            handler(message["data"])
+
+    def _on_error(self, exc: Exception, pubsub, thread) -> None:
+        # the pubsub object reconnects and re-subscribes on the next read, so
+        # just log and keep the worker thread alive.
+        LOG.warning(f"cache invalidation listener error: {exc}")
+        for handler in self._error_handlers:
+            handler()
+        time.sleep(1)
+
+
+class BucketLayout:
+    """Stores codes as fields of small redis hashes instead of top-level keys.
+
+    bucket = crc32(code) mod `buckets`. Hashes below redis'
+    hash-max-listpack-entries/-value limits are listpack encoded, which saves
+    most of the per-key overhead. Records carry their own expiry, TTLs only
+    keep stale entries from piling up: per field (HEXPIRE, redis >= 7.4) by
+    default, else on the whole bucket, extended by every write to it.
+    """
+
+    PREFIX = "url-bucket:"
+
+    def __init__(self, *, buckets: int, field_ttl: bool = True):
+        self.buckets = buckets
+        self.field_ttl = field_ttl
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> Optional["BucketLayout"]:
+        if not settings.redirect_cache_buckets:
+            return None
+        return cls(
+            buckets=settings.redirect_cache_buckets,
+            field_ttl=settings.redirect_cache_bucket_field_ttl,
+        )
+
+    def check_server(self, client: redis.Redis) -> None:
+        """Fails early when field TTLs are on but the server can't expire fields."""
+        if not self.field_ttl:
+            return
+
+        version = client.info("server")["redis_version"]
+        if tuple(int(part) for part in version.split(".")[:2]) < (7, 4):
+            raise RuntimeError(
+                f"redirect_cache_bucket_field_ttl needs redis >= 7.4, found "
+                f"{version}. disable it to expire whole buckets instead."
+            )
+
+    def bucket(self, key: str) -> str:
+        return f"{self.PREFIX}{zlib.crc32(key.encode()) % self.buckets}"
+
+
+def _write_record(
+    pipeline, layout: Optional[BucketLayout], key: str, value: str, ttl: Optional[int]
+) -> None:
+    # queues the write on a sync or async pipeline.
+    if layout is None:
+        if ttl:
+            pipeline.set(key, value, ex=ttl)
+        else:
+            pipeline.set(key, value)
+        return
+
+    bucket = layout.bucket(key)
+    pipeline.hset(bucket, key, value)
+    if not ttl:
+        return
+
+    if layout.field_ttl:
+        pipeline.hexpire(bucket, ttl, key)
+    else:
+        # the bucket lives as long as its longest lived write. NX sets a ttl
+        # on a new bucket, GT only ever extends it.
+        pipeline.expire(bucket, ttl, nx=True)
+        pipeline.expire(bucket, ttl, gt=True)
 
 
 class RedisCache:
-    def __init__(self, client: redis.Redis):
+    def __init__(
+        self,
+        client: redis.Redis,
+        *,
+        local_cache: Optional[LocalCache] = None,
+        invalidator: Optional[CacheInvalidator] = None,
+        invalidation_channel: Optional[str] = None,
+        layout: Optional[BucketLayout] = None,
+    ):
         self._client = client
+        # top-level keys when None.
+        self._layout = layout
+
+        # optional in-process tier in front of redis.
+        self._local = local_cache
+        self._invalidator = invalidator
+        self._invalidation_channel = invalidation_channel
+
+        self._invalidation_handlers: list[Callable[[str], None]] = [self._drop_local]
+        if self._invalidator and self._invalidation_channel:
+            self._invalidator.subscribe(
+                self._invalidation_channel, self._on_invalidation
+            )
+
+    def get(self, key: str) -> Optional[CacheRecord]:
+        # the local tier holds decoded records, hits skip decoding entirely.
+        if self._local and (record := self._local.get(key)) is not None:
+            return record
+
+        if self._layout:
+            value: str = self._client.hget(self._layout.bucket(key), key)
+        else:
+            value: str = self._client.get(key)
+        if value is None:
+            return None
+
+        record = CacheRecord.decode(value)
+        if self._local:
+            self._local.set(key, record)
+
+        return record
+
+    def prefetch(self, keys: list[str]) -> list[str]:
+        """Reads keys from redis into the local tier, returns the missing ones."""
+        if not keys:
+            return []
+
+        pipeline = self._client.pipeline(transaction=False)
+        for key in keys:
+            if self._layout:
+                pipeline.hget(self._layout.bucket(key), key)
+            else:
+                pipeline.get(key)
+
+        missing = []
+        for key, value in zip(keys, pipeline.execute()):
+            if value is None:
+                missing.append(key)
+            elif self._local:
+                self._local.set(key, CacheRecord.decode(value))
+
+        return missing
+
+    def set(
+        self, key: str, record: CacheRecord, expire_seconds: Optional[int] = None
+    ) -> None:
+        pipeline = self._client.pipeline(transaction=False)
+        _write_record(pipeline, self._layout, key, record.encode(), expire_seconds)
+        pipeline.execute()
+
+        if self._local:
+            self._local.set(key, record, ttl_seconds=expire_seconds)
 
-    def get(self, key: str) -> Optional[str]:
-        value: str = self._client.get(key)
-        return value
+    def set_many(self, mapping: dict[str, CacheRecord], expire_seconds: int) -> int:
+        """Pipelined SETs, one round trip for the whole mapping.
 
-    def set(self, key: str, value: str, expire_seconds: Optional[int] = None) -> None:
-        if expire_seconds:
-            self._client.set(key, value, ex=expire_seconds)
+        Each TTL is capped by the record's own expiry and records that are no
+        longer live are skipped. Returns the number of keys written.
+        """
+        pipeline = self._client.pipeline(transaction=False)
+        written = 0
+        for key, record in mapping.items():
+            if ttl := record.ttl(expire_seconds):
+                _write_record(pipeline, self._layout, key, record.encode(), ttl)
+                written += 1
+
+        if written:
+            pipeline.execute()
+
+        return written
+
+    def delete(self, key: str) -> None:
+        self.delete_many([key])
+
+    def delete_many(self, keys: list[str]) -> None:
+        if not keys:
+            return
+
+        if self._layout:
+            pipeline = self._client.pipeline(transaction=False)
+            for key in keys:
+                pipeline.hdel(self._layout.bucket(key), key)
+            pipeline.execute()
         else:
-            self._client.set(key, value)
+            self._client.delete(*keys)
+
+        self.invalidate_many(keys)
+
+    def invalidate(self, key: str) -> None:
+        """Drops the key from the in-process state of every worker."""
+        self._on_invalidation(key)
+        if self._invalidator and self._invalidation_channel:
+            self._invalidator.publish(self._invalidation_channel, key)
+
+    def invalidate_many(self, keys: list[str]) -> None:
+        for key in keys:
+            self._on_invalidation(key)
+        if keys and self._invalidator and self._invalidation_channel:
+            self._invalidator.publish_many(self._invalidation_channel, keys)
+
+    def add_invalidation_handler(self, handler: Callable[[str], None]) -> None:
+        """Registers a callback that runs in every worker when a key changes."""
+        self._invalidation_handlers.append(handler)
+
+    def _on_invalidation(self, key: str) -> None:
+        for handler in self._invalidation_handlers:
+            handler(key)
+
+    def _drop_local(self, key: str) -> None:
+        if self._local:
+            self._local.pop(key)
+
+    def fill_lock(self, key: str, timeout_seconds: float) -> redis.lock.Lock:
+        """Non-blocking lock that lets one worker at a time fill `key`."""
+        return self._client.lock(
+            f"fill-lock:{key}", timeout=timeout_seconds, blocking=False
+        )
 
     def produce_to_topic(self, topic: str, message: dict) -> None:
         self._client.xadd(name=topic, fields=message)
 
 
+class AsyncRedisCache:
+    """Async counterpart of RedisCache used by the async redirect path.
+
+    Shares the local tier with the sync cache, so invalidations received by the
+    sync side are visible here as well.
+    """
+
+    def __init__(
+        self,
+        client: redis.asyncio.Redis,
+        *,
+        local_cache: Optional[LocalCache] = None,
+        layout: Optional[BucketLayout] = None,
+    ):
+        self._client = client
+        self._local = local_cache
+        self._layout = layout
+
+    async def get(self, key: str) -> Optional[CacheRecord]:
+        if self._local and (record := self._local.get(key)) is not None:
+            return record
+
+        if self._layout:
+            value: str = await self._client.hget(self._layout.bucket(key), key)
+        else:
+            value: str = await self._client.get(key)
+        if value is None:
+            return None
+
+        record = CacheRecord.decode(value)
+        if self._local:
+            self._local.set(key, record)
+
+        return record
+
+    async def set(
+        self, key: str, record: CacheRecord, expire_seconds: Optional[int] = None
+    ) -> None:
+        pipeline = self._client.pipeline(transaction=False)
+        _write_record(pipeline, self._layout, key, record.encode(), expire_seconds)
+        await pipeline.execute()
+
+        if self._local:
+            self._local.set(key, record, ttl_seconds=expire_seconds)
+
+    def fill_lock(self, key: str, timeout_seconds: float) -> redis.asyncio.lock.Lock:
+        return self._client.lock(
+            f"fill-lock:{key}", timeout=timeout_seconds, blocking=False
+        )
+
+
+def migrate_cache_layout(
+    client: redis.Redis,
+    *,
+    layout: Optional[BucketLayout],
+    default_ttl: int,
+    batch_size: int = 1000,
+) -> int:
+    """Moves cached redirects into `layout`, top-level keys when None.
+
+    Entries read and re-written concurrently with a migration may be lost,
+    which only costs a cache miss. Returns the number of entries moved.
+    """
+    if layout is None:
+        return _buckets_to_keys(client, default_ttl, batch_size)
+    return _keys_to_buckets(client, layout, default_ttl, batch_size)
+
+
+def _keys_to_buckets(
+    client: redis.Redis, layout: BucketLayout, default_ttl: int, batch_size: int
+) -> int:
+    moved = 0
+    # redirect keys are the bare codes, every other key we own has a prefix.
+    keys = (
+        key
+        for key in client.scan_iter(count=batch_size, _type="STRING")
+        if ALIAS_PATTERN.match(key)
+    )
+    while batch := list(islice(keys, batch_size)):
+        values = client.mget(batch)
+
+        pipeline = client.pipeline(transaction=False)
+        for key, value in zip(batch, values):
+            # plain values of older releases are read as urls, moved like
+            # records so that no top-level key is left behind without a ttl.
+            if value is None:
+                continue
+
+            record = CacheRecord.decode(value)
+            if ttl := record.ttl(default_ttl):
+                _write_record(pipeline, layout, key, record.encode(), ttl)
+            pipeline.delete(key)
+            moved += 1
+        pipeline.execute()
+
+    return moved
+
+
+def _buckets_to_keys(client: redis.Redis, default_ttl: int, batch_size: int) -> int:
+    moved = 0
+    for bucket in client.scan_iter(
+        match=f"{BucketLayout.PREFIX}*", count=batch_size, _type="HASH"
+    ):
+        pipeline = client.pipeline(transaction=False)
+        for key, value in client.hgetall(bucket).items():
+            record = CacheRecord.decode(value)
+            if ttl := record.ttl(default_ttl):
+                _write_record(pipeline, None, key, record.encode(), ttl)
+            moved += 1
+        pipeline.delete(bucket)
+        pipeline.execute()
+
+    return moved
+
+
 def setup_redis(settings: Settings) -> redis.Redis:
     global _redis_client
 
@@ -39,3 +570,17 @@ def close_redis_connections():
 def get_redis_client():
     """Helper method to return redis client object"""
     return _redis_client
+
+
+def setup_async_redis(settings: Settings) -> redis.asyncio.Redis:
+    global _async_redis_client
+
+    _async_redis_client = redis.asyncio.Redis.from_url(
+        settings.redis_url, decode_responses=True
+    )
+    return _async_redis_client
+
+
+async def close_async_redis_connections():
+    if _async_redis_client:
+        await _async_redis_client.aclose()
@@ -0,0 +1,248 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+import redis
+
+from app.geoip import GeoIPResolver
+
+LOG = logging.getLogger(__name__)
+
+
+# decrements the fields of KEYS[1] by ARGV pairs (field, count), never below
+# zero. not idempotent, see PendingClicks on settling a batch twice.
+_SETTLE_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HINCRBY', KEYS[1], ARGV[i], -ARGV[i + 1]) <= 0 then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+"""
+
+
+class PendingClicks:
+    """Per code, per country clicks that are in the stream but not in postgres.
+
+    The click buffer increments them in the same pipeline as its XADDs and the
+    consumer decrements them once its batch is committed, so postgres totals
+    plus these deltas are the real-time counts. Each hash expires `ttl_seconds`
+    after it was created (EXPIRE NX, redis >= 7), whatever it still holds, so
+    deltas that are never settled can't inflate counts for longer than that.
+
+    Settling is at least once, like the postgres increments. A consumer that
+    dies between its commit and its XACK has the batch redelivered, added to
+    postgres and settled a second time. The second settle then takes up to the
+    batch size out of the deltas of newer clicks, which offsets the duplicate
+    in postgres while they are pending: real-time counts never drop below the
+    real ones, and are over by at most the redelivered batch, as the postgres
+    totals are, once the newer clicks settle (clamped at zero).
+    """
+
+    PREFIX = "clicks-pending:"
+
+    def __init__(self, client: redis.Redis, *, ttl_seconds: int = 86400):
+        self._client = client
+        self.ttl_seconds = ttl_seconds
+        self._settle = client.register_script(_SETTLE_SCRIPT)
+
+    def key(self, short_url: str) -> str:
+        return f"{self.PREFIX}{short_url}"
+
+    def increment(self, pipeline, counts: dict[tuple[str, str], int]) -> None:
+        """Queues the increments on the caller's pipeline."""
+        for (short_url, country_code), count in counts.items():
+            pipeline.hincrby(self.key(short_url), country_code, count)
+            # only a new hash gets a ttl, clicks don't keep extending it.
+            pipeline.expire(self.key(short_url), self.ttl_seconds, nx=True)
+
+    def settle(self, counts: dict[tuple[str, str], int]) -> None:
+        if not counts:
+            return
+
+        per_key: dict[str, list] = {}
+        for (short_url, country_code), count in counts.items():
+            per_key.setdefault(self.key(short_url), []).extend((country_code, count))
+
+        pipeline = self._client.pipeline(transaction=False)
+        for key, args in per_key.items():
+            self._settle(keys=[key], args=args, client=pipeline)
+        pipeline.execute()
+
+    def clear(self, short_urls: list[str]) -> None:
+        if short_urls:
+            self._client.delete(*[self.key(short_url) for short_url in short_urls])
+
+    def get(self, short_url: str) -> dict[str, int]:
+        return {
+            country_code: max(int(count), 0)
+            for country_code, count in self._client.hgetall(self.key(short_url)).items()
+        }
+
+
+class ClickBuffer:
+    """Bounded in-process buffer of click events, flushed to the redis stream.
+
+    Producers never block: when the buffer is full the event is dropped and
+    counted. A background thread drains it with pipelined XADDs every
+    flush_interval_ms, or as soon as flush_batch_size events are waiting.
+    A batch that fails goes back into the buffer and is retried with
+    exponential backoff, up to `max_backoff_seconds` apart.
+
+    With a geoip resolver and pending clicks, events are tagged with their
+    country and counted as pending in the same MULTI/EXEC as their XADDs.
+    """
+
+    def __init__(
+        self,
+        *,
+        client: redis.Redis,
+        topic: str,
+        max_size: int = 10000,
+        flush_interval_ms: int = 50,
+        flush_batch_size: int = 500,
+        max_backoff_seconds: float = 5,
+        geoip: Optional[GeoIPResolver] = None,
+        pending_clicks: Optional[PendingClicks] = None,
+    ):
+        self._client = client
+        self._geoip = geoip
+        self._pending = pending_clicks
+        self.topic = topic
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_batch_size = flush_batch_size
+        self.max_backoff_seconds = max_backoff_seconds
+        self._backoff = 0.0
+        self._retry_at = 0.0
+
+        self._queue: queue.Queue[dict] = queue.Queue(maxsize=max_size)
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        # counters, exported through the metrics endpoint.
+        self.enqueued = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.failed = 0
+
+    def put(self, message: dict) -> bool:
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        self.enqueued += 1
+        if self._queue.qsize() >= self.flush_batch_size:
+            self._wakeup.set()
+
+        return True
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="click-buffer-flusher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        """Stops the flusher after it has drained whatever is still buffered."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def flush(self, force: bool = False) -> int:
+        """Writes buffered clicks to the stream, returns how many were written.
+
+        Waits out the backoff of a failed flush unless `force` is set.
+        """
+        if not force and time.monotonic() < self._retry_at:
+            return 0
+
+        flushed = 0
+        while batch := self._take(self.flush_batch_size):
+            # a transaction, pending increments only ever apply with their XADDs.
+            pipeline = self._client.pipeline(transaction=True)
+            if self._geoip and self._pending:
+                self._count_pending(pipeline, batch)
+
+            for message in batch:
+                pipeline.xadd(name=self.topic, fields=message)
+
+            try:
+                pipeline.execute()
+            except redis.RedisError as exc:
+                self.failed += len(batch)
+                self._retry_later(batch)
+                LOG.warning(
+                    f"failed to flush {len(batch)} clicks, retrying in "
+                    f"{self._backoff:.2f}s: {exc}"
+                )
+                break
+
+            self._backoff = 0.0
+            flushed += len(batch)
+            self.flushed += len(batch)
+
+        return flushed
+
+    def _retry_later(self, batch: list[dict]) -> None:
+        # back into the bounded buffer, only what no longer fits is dropped.
+        for message in batch:
+            try:
+                self._queue.put_nowait(message)
+            except queue.Full:
+                self.dropped += 1
+
+        self._backoff = min(
+            max(self._backoff * 2, self.flush_interval), self.max_backoff_seconds
+        )
+        self._retry_at = time.monotonic() + self._backoff
+
+    def _count_pending(self, pipeline, batch: list[dict]) -> None:
+        # retried batches are tagged already.
+        untagged = [message for message in batch if "country_code" not in message]
+        country_codes = self._geoip.resolve_many(
+            message["request_ip"] for message in untagged
+        )
+        for message, country_code in zip(untagged, country_codes):
+            message["country_code"] = country_code
+
+        self._pending.increment(
+            pipeline,
+            Counter(
+                (message["short_url"], message["country_code"]) for message in batch
+            ),
+        )
+
+    def _take(self, count: int) -> list[dict]:
+        batch = []
+        while len(batch) < count:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+        # final drain on shutdown.
+        self.flush(force=True)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "flushed": self.flushed,
+            "failed": self.failed,
+        }
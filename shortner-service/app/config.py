@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from typing import Any
+from typing import Any, Literal
 
 import yaml
 from pydantic.fields import FieldInfo
@@ -36,13 +36,26 @@ class Settings(BaseSettings):
     postgres_user: str
     postgres_password: str
 
+    # connection pool per process, pgbouncer mode leaves pooling to pgbouncer.
+    db_pool_size: int = 5
+    db_pool_max_overflow: int = 10
+    db_pool_timeout_seconds: float = 30
+    db_pool_recycle_seconds: int = 1800
+    db_pool_pre_ping: bool = True
+    db_pgbouncer_mode: bool = False
+
     # jwt specific
     jwt_secret: str
     jwt_algorithm: str
     jwt_expire_duration_minutes: int
+    # users allowed on operational endpoints, the metrics one.
+    admin_usernames: list[str] = []
 
     id_counter_key: str
     id_counter_batch_size: int
+    id_counter_max_batch_size: int = 100000
+    id_counter_prefetch_ratio: float = 0.8
+    id_counter_target_block_seconds: int = 30
     hash_id_counter_secret: str
 
     redis_host: str
@@ -51,6 +64,105 @@ class Settings(BaseSettings):
     click_analytics_topic: str
     click_analytics_consumer_group: str
     click_analytics_batch_count: int
+    click_analytics_max_batch_count: int = 5000
+    click_analytics_block_ms: int = 5000
+    click_analytics_metrics_interval_seconds: int = 30
+    click_analytics_metrics_key: str = "click-consumer-metrics"
+    click_analytics_workers: int = 1
+    click_analytics_consumer_name: str | None = None
+    click_analytics_maintenance_interval_seconds: int = 30
+    click_analytics_claim_min_idle_ms: int = 60000
+
+    # time bucketed clicks. the consumers run the rollup, it compacts hourly
+    # partitions older than the retention into daily ones. 0 keeps daily
+    # partitions forever.
+    click_rollup_interval_seconds: int = 3600
+    click_hourly_retention_days: int = 7
+    click_daily_retention_days: int = 0
+    click_partition_precreate_days: int = 2
+    # sliding window top-k of clicked codes, counted by the consumers. the
+    # api keeps the top codes in redis and in its local tier.
+    trending_capacity: int = 1000
+    trending_slot_seconds: int = 60
+    trending_window_seconds: int = 900
+    trending_flush_seconds: int = 10
+    hot_key_refresh_enabled: bool = True
+    hot_key_refresh_top_n: int = 100
+    hot_key_refresh_interval_seconds: int = 30
+
+    # per link, per day hyperloglogs of visitor ips in redis.
+    unique_visitors_retention_days: int = 90
+
+    # csv of ip ranges to country codes, used by the click consumer.
+    geoip_database_path: str | None = None
+    geoip_memo_size: int = 100000
+
+    # redirects buffer clicks locally and flush them with pipelined XADDs.
+    click_buffer_max_size: int = 10000
+    click_buffer_flush_interval_ms: int = 50
+    click_buffer_flush_batch_size: int = 500
+    # failed flushes are retried with exponential backoff, at most this far apart.
+    click_buffer_max_backoff_seconds: float = 5
+
+    # real-time click counts, the buffer tags clicks with their country and
+    # counts them in redis until a consumer has committed them.
+    realtime_click_counts_enabled: bool = True
+    pending_clicks_ttl_seconds: int = 86400
+
+    # in-process cache tier in front of redis.
+    local_cache_enabled: bool = True
+    local_cache_max_size: int = 10000
+    local_cache_ttl_seconds: int = 60
+    cache_invalidation_channel: str = "cache-invalidation"
+
+    # negative caching of unknown short codes.
+    negative_cache_enabled: bool = True
+    negative_cache_max_size: int = 100000
+    negative_cache_ttl_seconds: int = 30
+    bloom_filter_enabled: bool = False
+    bloom_filter_capacity: int = 1000000
+    bloom_filter_error_rate: float = 0.001
+    # rebuilt from postgres this often and after pub/sub reconnects, 0 disables.
+    bloom_filter_refresh_seconds: int = 3600
+
+    # authenticated users, cached per process and invalidated on change.
+    user_cache_enabled: bool = True
+    user_cache_max_size: int = 10000
+    user_cache_ttl_seconds: int = 60
+    user_invalidation_channel: str = "user-invalidation"
+
+    # redirects are cached for at most this long, or until the url expires.
+    redirect_cache_ttl_seconds: int = 86400
+
+    # > 0 stores redirects in that many redis hashes instead of one key per
+    # code. field TTLs need redis >= 7.4 (checked at startup), without them
+    # whole buckets expire.
+    redirect_cache_buckets: int = 0
+    redirect_cache_bucket_field_ttl: bool = True
+
+    # removal of expired urls, "archive" moves them to urlarchive.
+    url_reaper_enabled: bool = False
+    url_reaper_mode: Literal["archive", "delete"] = "archive"
+    url_reaper_batch_size: int = 1000
+    url_reaper_interval_seconds: int = 60
+
+    # coalescing of concurrent cache misses. the fill lock extends it across
+    # workers through a short lived redis lock.
+    single_flight_enabled: bool = True
+    cache_fill_lock_enabled: bool = False
+    cache_fill_lock_timeout_ms: int = 2000
+    cache_fill_lock_wait_ms: int = 200
+
+    # preloading of the most clicked urls into redis.
+    cache_warmup_on_startup: bool = False
+    cache_warmup_top_n: int = 10000
+    cache_warmup_batch_size: int = 1000
+
+    # rows per COPY batch when importing existing links.
+    url_import_batch_size: int = 10000
+
+    # serve redirects through asyncpg and redis.asyncio instead of the threadpool.
+    async_mode: bool = False
 
     base_url: str = "http://localhost"
     API_V1: str = "/api/v1"
@@ -82,6 +194,14 @@ class Settings(BaseSettings):
             f"{self.postgres_port}/{self.postgres_db}"
         )
 
+    @property
+    def sqlalchemy_async_database_uri(self):
+        return (
+            f"postgresql+asyncpg://"
+            f"{self.postgres_user}:{self.postgres_password}@{self.postgres_host}:"
+            f"{self.postgres_port}/{self.postgres_db}"
+        )
+
     @property
     def redis_url(self):
         return f"redis://{self.redis_user}:{self.redis_password}@{self.redis_host}"
@@ -1,32 +1,181 @@
+import argparse
+import json
 import logging
+import multiprocessing
+import signal
+import socket
+import sys
 import time
-import uuid
-from collections import defaultdict
+from collections import Counter, defaultdict
+from datetime import date, datetime, timezone
+from typing import NamedTuple, Optional
 
 import redis
+from pydantic import ValidationError
+from sqlalchemy import exc
 
 from app.cache import setup_redis
+from app.clicks import PendingClicks
 from app.config import settings
 from app.db import SessionContext, current_ctx, setup_postgresql
-from app.dto import ClickCount, ClickStreamMessage
+from app.dto import ClickBucketCount, ClickCount, ClickStreamMessage
+from app.geoip import get_geoip_resolver, setup_geoip
 from app.log import setup_logging
+from app.partitions import (
+    daily_click_partitions,
+    hourly_click_partitions,
+    is_missing_partition,
+)
+from app.rollup import ClickRollup, hourly_cutoff
 from app.service import URLClickCountService
+from app.trending import TrendingLinks
+from app.visitors import UniqueVisitors
 
 LOG = logging.getLogger()
 
 
+class ConsumerStats:
+    """Tracks throughput, batch latency and stream lag between two reports."""
+
+    def __init__(self, *, interval_seconds: int):
+        self.interval_seconds = interval_seconds
+        self.total = 0
+
+        self._window_count = 0
+        self._window_batches = 0
+        self._window_seconds = 0.0
+        self._window_max_seconds = 0.0
+        self._window_start = time.monotonic()
+
+    def record(self, count: int, seconds: float = 0.0) -> None:
+        """Counts `count` ingested messages, `seconds` is their batch's latency."""
+        self.total += count
+        self._window_count += count
+        if count and seconds:
+            self._window_batches += 1
+            self._window_seconds += seconds
+            self._window_max_seconds = max(self._window_max_seconds, seconds)
+
+    def report_due(self) -> bool:
+        return time.monotonic() - self._window_start >= self.interval_seconds
+
+    def snapshot(self, *, batch_count: int, lag: int | None) -> dict:
+        """Returns the metrics of the current window and starts a new one."""
+        now = time.monotonic()
+        elapsed = max(now - self._window_start, 1e-6)
+        batches = max(self._window_batches, 1)
+        snapshot = {
+            "throughput_per_second": round(self._window_count / elapsed, 2),
+            "ingested_total": self.total,
+            "batch_latency_ms_avg": round(self._window_seconds / batches * 1000, 2),
+            "batch_latency_ms_max": round(self._window_max_seconds * 1000, 2),
+            "batch_count": batch_count,
+            "lag": lag,
+            "reported_at": time.time(),
+        }
+
+        self._window_count = 0
+        self._window_batches = 0
+        self._window_seconds = 0.0
+        self._window_max_seconds = 0.0
+        self._window_start = now
+
+        return snapshot
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Click analytics consumer.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.click_analytics_workers,
+        help="number of worker processes to run in the consumer group.",
+    )
+    args = parser.parse_args()
+
     setup_logging()
 
+    if args.workers > 1:
+        supervise(args.workers)
+    else:
+        run_worker(0)
+
+
+def supervise(workers: int) -> None:
+    """Runs `workers` consumer processes and restarts any that die.
+
+    A restarted worker keeps the index, and therefore the consumer name, of the
+    one it replaces so that it picks up that worker's pending entries first.
+    """
+    mp_context = multiprocessing.get_context("spawn")
+    processes: dict[int, multiprocessing.Process] = {}
+
+    def start(index: int) -> None:
+        process = mp_context.Process(
+            target=_worker_entrypoint,
+            args=(index,),
+            name=f"click-consumer-{index}",
+        )
+        process.start()
+        processes[index] = process
+        LOG.info(f"started worker {index} with pid {process.pid}.")
+
+    def shutdown(signum, frame):
+        LOG.info("stopping workers.")
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(timeout=30)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for index in range(workers):
+        start(index)
+
+    while True:
+        time.sleep(1)
+        for index, process in list(processes.items()):
+            if not process.is_alive():
+                LOG.warning(
+                    f"worker {index} exited with code {process.exitcode}, restarting."
+                )
+                start(index)
+
+
+def _worker_entrypoint(index: int) -> None:
+    setup_logging()
+    run_worker(index)
+
+
+def run_worker(index: int) -> None:
     LOG.info("setting up postgresql client.")
     setup_postgresql(settings)
 
     LOG.info("setting up redis client.")
     redis_client: redis.Redis = setup_redis(settings)
-    url_count_service = URLClickCountService(context=current_ctx)
+    url_count_service = URLClickCountService(
+        context=current_ctx,
+        unique_visitors=UniqueVisitors(
+            redis_client, retention_days=settings.unique_visitors_retention_days
+        ),
+        pending_clicks=PendingClicks(
+            redis_client, ttl_seconds=settings.pending_clicks_ttl_seconds
+        ),
+    )
+    trending = TrendingLinks.from_settings(redis_client, settings)
+    click_rollup = ClickRollup(
+        hourly_retention_days=settings.click_hourly_retention_days,
+        daily_retention_days=settings.click_daily_retention_days,
+        precreate_days=settings.click_partition_precreate_days,
+    )
+
+    LOG.info("loading geoip database.")
+    setup_geoip(settings)
 
-    # consumer group name
-    consumer_name = f"{settings.click_analytics_consumer_group}-{uuid.uuid4()}"
+    # stable consumer name, so a restarted worker owns its old pending entries.
+    consumer_name = _consumer_name(index)
     LOG.info(f"consumer name: {consumer_name}")
 
     # setup stream group for reading purpose.
@@ -43,64 +192,361 @@ def main():
             raise
         LOG.info(f"group: {settings.click_analytics_consumer_group} already exists.")
 
-    # run the consumer forever
+    batch_count = settings.click_analytics_batch_count
+    stats = ConsumerStats(
+        interval_seconds=settings.click_analytics_metrics_interval_seconds
+    )
+
+    # first re-process whatever this consumer read but never acked. a page of
+    # only malformed or trimmed entries parses to nothing but is acked all the
+    # same, so keep paging until the pending list itself is empty.
+    while entries := _read_stream(
+        redis_client, consumer_name, batch_count, start_id="0"
+    ):
+        records = _to_messages(redis_client, entries)
+        _ingest(redis_client, url_count_service, records)
+        stats.record(len(records))
+        LOG.info(f"Re-processed {len(records)} of {len(entries)} pending messages.")
+
+    # run the consumer forever. reads go back to back while there is a backlog
+    # and block inside XREADGROUP while the stream is idle.
     LOG.info("Start reading message...")
+    last_maintenance = time.monotonic()
+    last_rollup = None
     while True:
         # read the records.
-        records = _read_batches(redis_client, consumer_name)
+        records = _read_batches(redis_client, consumer_name, batch_count)
+        ingest_start = time.monotonic()
+        _ingest(redis_client, url_count_service, records)
+        ingest_seconds = time.monotonic() - ingest_start
 
-        if not records:
-            LOG.debug("No messages found in the current read, sleeping for 10 seconds.")
-            time.sleep(10)
-            continue
+        # only fresh reads count towards trending, not redelivered backlog.
+        trending.record(record.short_url for record in records)
+        trending.flush()
 
-        agg_records = _aggregate_records(records)
-        with SessionContext(with_transaction=True):
-            url_count_service.increment_counts(agg_records)
+        stats.record(len(records), ingest_seconds)
+        batch_count = _next_batch_count(batch_count, len(records))
 
-        redis_client.xack(
+        if stats.report_due():
+            _report_stats(
+                redis_client,
+                consumer_name,
+                stats,
+                batch_count,
+                rollup=click_rollup.stats(),
+                geoip=get_geoip_resolver().stats(),
+            )
+
+        if (
+            time.monotonic() - last_maintenance
+            >= settings.click_analytics_maintenance_interval_seconds
+        ):
+            claimed = _claim_stale_entries(redis_client, consumer_name, batch_count)
+            _ingest(redis_client, url_count_service, claimed)
+            stats.record(len(claimed))
+
+            _trim_acknowledged(redis_client)
+            last_maintenance = time.monotonic()
+
+        if (
+            last_rollup is None
+            or time.monotonic() - last_rollup >= settings.click_rollup_interval_seconds
+        ):
+            _run_rollup(click_rollup)
+            last_rollup = time.monotonic()
+
+
+def _consumer_name(index: int) -> str:
+    identity = settings.click_analytics_consumer_name or socket.gethostname()
+    return f"{settings.click_analytics_consumer_group}-{identity}-{index}"
+
+
+def _ingest(
+    redis_client: redis.Redis,
+    url_count_service: URLClickCountService,
+    records: list[ClickStreamMessage],
+) -> None:
+    if not records:
+        return
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    aggregates = _aggregate_records(
+        records,
+        hourly_since=hourly_cutoff(now, settings.click_hourly_retention_days),
+    )
+    _write_aggregates(url_count_service, aggregates)
+
+    # until settled the batch is counted twice by real-time stats, briefly. a
+    # crash before the ack settles it again on redelivery, see PendingClicks.
+    url_count_service.settle_pending_clicks(aggregates.pending)
+    # before the ack, re-adding visitors of a redelivered batch is a no-op.
+    url_count_service.add_unique_visitors(aggregates.visitors)
+
+    redis_client.xack(
+        settings.click_analytics_topic,
+        settings.click_analytics_consumer_group,
+        *[record.message_id for record in records],
+    )
+    LOG.debug(f"Ingested {len(records)} messages.")
+
+
+def _write_aggregates(
+    url_count_service: URLClickCountService, aggregates: "ClickAggregates"
+) -> None:
+    for attempt in range(2):
+        try:
+            with SessionContext(with_transaction=True):
+                url_count_service.increment_counts(aggregates.totals)
+                url_count_service.increment_buckets(
+                    hourly=aggregates.hourly, daily=aggregates.daily
+                )
+            return
+        except exc.DBAPIError as e:
+            if attempt or not is_missing_partition(e):
+                raise
+
+            # the rollup of another consumer dropped a partition this process
+            # still remembers as created, recheck them all.
+            LOG.info("click partition dropped elsewhere, retrying the batch.")
+            hourly_click_partitions.forget()
+            daily_click_partitions.forget()
+
+
+def _run_rollup(click_rollup: ClickRollup) -> None:
+    # a failed rollup is retried on the next interval, ingestion goes on.
+    try:
+        click_rollup.run()
+    except Exception:
+        LOG.exception("click rollup failed.")
+
+
+def _claim_stale_entries(
+    redis_client: redis.Redis, consumer_name: str, batch_count: int
+) -> list[ClickStreamMessage]:
+    """Takes over entries that other consumers left pending for too long."""
+    claimed = []
+    start_id = "0-0"
+    while True:
+        start_id, messages, *_ = redis_client.xautoclaim(
             settings.click_analytics_topic,
             settings.click_analytics_consumer_group,
-            *[record.message_id for record in records],
+            consumer_name,
+            min_idle_time=settings.click_analytics_claim_min_idle_ms,
+            start_id=start_id,
+            count=batch_count,
         )
-        LOG.info(f"Ingested {len(records)} messages.")
+        claimed.extend(_to_messages(redis_client, messages))
+
+        if start_id == "0-0" or len(claimed) >= batch_count:
+            break
+
+    if claimed:
+        LOG.info(f"Claimed {len(claimed)} stale pending messages.")
+
+    return claimed
+
+
+def _trim_acknowledged(redis_client: redis.Redis) -> None:
+    """Trims stream entries that every consumer has already acknowledged."""
+    # last-delivered-id first: entries delivered after this read are above it,
+    # entries delivered before it and still unacked show up in XPENDING.
+    group = next(
+        group
+        for group in redis_client.xinfo_groups(settings.click_analytics_topic)
+        if group["name"] == settings.click_analytics_consumer_group
+    )
+    min_id = group["last-delivered-id"]
+
+    pending = redis_client.xpending(
+        settings.click_analytics_topic, settings.click_analytics_consumer_group
+    )
+    if pending["pending"]:
+        min_id = min(min_id, pending["min"], key=_stream_id)
+
+    trimmed = redis_client.xtrim(
+        settings.click_analytics_topic, minid=min_id, approximate=True
+    )
+    LOG.debug(f"Trimmed {trimmed} acknowledged messages.")
+
+
+def _stream_id(value: str) -> tuple[int, int]:
+    millis, _, sequence = value.partition("-")
+    return int(millis), int(sequence or 0)
+
+
+def _next_batch_count(batch_count: int, read_count: int) -> int:
+    # a full batch means there is a backlog, so grow towards the ceiling.
+    # shrink back once reads come back mostly empty.
+    if read_count >= batch_count:
+        return min(batch_count * 2, settings.click_analytics_max_batch_count)
+
+    if read_count < batch_count // 4:
+        return max(batch_count // 2, settings.click_analytics_batch_count)
+
+    return batch_count
+
+
+def _stream_lag(redis_client: redis.Redis) -> int | None:
+    # lag is the number of entries not yet delivered to the group (redis >= 7).
+    for group in redis_client.xinfo_groups(settings.click_analytics_topic):
+        if group["name"] == settings.click_analytics_consumer_group:
+            return group.get("lag")
+
+    return None
+
+
+def _report_stats(
+    redis_client: redis.Redis,
+    consumer_name: str,
+    stats: ConsumerStats,
+    batch_count: int,
+    *,
+    rollup: dict | None = None,
+    geoip: dict | None = None,
+) -> None:
+    try:
+        lag = _stream_lag(redis_client)
+    except redis.exceptions.RedisError as exc:
+        LOG.warning(f"unable to read stream lag: {exc}")
+        lag = None
 
-        LOG.info("sleeping for 5 second.")
-        time.sleep(5)
+    snapshot = stats.snapshot(batch_count=batch_count, lag=lag)
+    snapshot["rollup"] = rollup
+    snapshot["geoip"] = geoip
+    LOG.info(f"consumer stats: {snapshot}")
+
+    # published for the service's metrics endpoint.
+    redis_client.hset(
+        settings.click_analytics_metrics_key,
+        consumer_name,
+        json.dumps(snapshot),
+    )
+
+
+def read_consumer_stats(redis_client: redis.Redis) -> dict:
+    """Returns the last stats reported by every click consumer."""
+    return {
+        consumer_name: json.loads(snapshot)
+        for consumer_name, snapshot in redis_client.hgetall(
+            settings.click_analytics_metrics_key
+        ).items()
+    }
 
 
 def _read_batches(
-    redis_client: redis.Redis, consumer_name: str
+    redis_client: redis.Redis,
+    consumer_name: str,
+    batch_count: int,
+    start_id: str = ">",
 ) -> list[ClickStreamMessage]:
+    return _to_messages(
+        redis_client, _read_stream(redis_client, consumer_name, batch_count, start_id)
+    )
+
+
+def _read_stream(
+    redis_client: redis.Redis,
+    consumer_name: str,
+    batch_count: int,
+    start_id: str = ">",
+) -> list[tuple[str, dict]]:
+    """Raw (id, fields) entries of one XREADGROUP."""
     stream_messages = redis_client.xreadgroup(
         groupname=settings.click_analytics_consumer_group,
         consumername=consumer_name,
         streams={
-            settings.click_analytics_topic: ">",
+            settings.click_analytics_topic: start_id,
         },
-        count=settings.click_analytics_batch_count,
-        block=1000,
+        count=batch_count,
+        block=settings.click_analytics_block_ms if start_id == ">" else None,
     )
 
-    if not stream_messages:
-        return []
+    entries = []
+    for stream_name, messages in stream_messages or []:
+        entries.extend(messages)
 
+    return entries
+
+
+def _to_messages(
+    redis_client: redis.Redis, messages: list[tuple[str, dict]]
+) -> list[ClickStreamMessage]:
     return_value = []
-    for stream_name, messages in stream_messages:
-        for msg_id, message in messages:
+    malformed = []
+    dropped_pending = Counter()
+    for msg_id, message in messages:
+        # entries trimmed while still pending come back without a body.
+        if not message:
+            malformed.append(msg_id)
+            continue
+
+        try:
             return_value.append(
                 ClickStreamMessage(message_id=msg_id, **message),
             )
+        except ValidationError:
+            malformed.append(msg_id)
+            # the producer counted tagged clicks as pending, they never will be
+            # ingested.
+            if "short_url" in message and "country_code" in message:
+                dropped_pending[(message["short_url"], message["country_code"])] += 1
+
+    # ack malformed entries right away, otherwise they get re-claimed forever.
+    if malformed:
+        LOG.warning(f"Dropping {len(malformed)} malformed messages: {malformed}")
+        PendingClicks(redis_client).settle(dropped_pending)
+        redis_client.xack(
+            settings.click_analytics_topic,
+            settings.click_analytics_consumer_group,
+            *malformed,
+        )
 
     return return_value
 
 
-def _aggregate_records(records: list[ClickStreamMessage]) -> list[ClickCount]:
+class ClickAggregates(NamedTuple):
+    totals: list[ClickCount]
+    hourly: list[ClickBucketCount]
+    daily: list[ClickBucketCount]
+    # visitor ips per (short_url, utc day).
+    visitors: dict[tuple[str, date], set[str]]
+    # clicks the producer counted as pending, per (short_url, country).
+    pending: dict[tuple[str, str], int]
+
+
+def _aggregate_records(
+    records: list[ClickStreamMessage], *, hourly_since: Optional[datetime] = None
+) -> ClickAggregates:
+    """Sums a batch up per url, country and bucket.
+
+    Clicks older than `hourly_since`, late deliveries of hours the rollup has
+    already compacted, are only counted in the day buckets.
+    """
     counts = defaultdict(int)
+    hourly = defaultdict(int)
+    daily = defaultdict(int)
+    visitors = defaultdict(set)
+    pending = defaultdict(int)
 
+    # producers with a geoip database tag clicks with their country already.
+    resolved = iter(
+        get_geoip_resolver().resolve_many(
+            record.request_ip for record in records if record.country_code is None
+        )
+    )
     for record in records:
-        country_code = _ip_to_country(record.request_ip)
+        country_code = record.country_code
+        if country_code is None:
+            country_code = next(resolved)
+        else:
+            pending[(record.short_url, country_code)] += 1
+
+        hour = record.clicked_at.replace(minute=0, second=0, microsecond=0)
         counts[(record.short_url, country_code)] += 1
+        if hourly_since is None or hour >= hourly_since:
+            hourly[(record.short_url, country_code, hour)] += 1
+        daily[(record.short_url, country_code, hour.replace(hour=0))] += 1
+        visitors[(record.short_url, hour.date())].add(record.request_ip)
 
     return_value = []
     for key, counts in counts.items():
@@ -108,11 +554,25 @@ def _aggregate_records(records: list[ClickStreamMessage]) -> list[ClickCount]:
             ClickCount(short_url=key[0], country_code=key[1], counts=counts),
         )
 
-    return return_value
+    return ClickAggregates(
+        totals=return_value,
+        hourly=_buckets(hourly),
+        daily=_buckets(daily),
+        visitors=dict(visitors),
+        pending=dict(pending),
+    )
 
 
-def _ip_to_country(ip: str) -> str:
-    return "TBD"
+def _buckets(counts: dict[tuple, int]) -> list[ClickBucketCount]:
+    return [
+        ClickBucketCount(
+            short_url=short_url,
+            country_code=country_code,
+            bucket_start=bucket_start,
+            counts=count,
+        )
+        for (short_url, country_code, bucket_start), count in counts.items()
+    ]
 
 
 if __name__ == "__main__":
@@ -1,11 +1,151 @@
+import logging
+import time
 from contextvars import ContextVar
+from typing import Callable, Optional
+from uuid import uuid4
 
-from sqlalchemy import Engine
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Engine, event, exc
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 from sqlmodel import Session, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 _sessionmakers: sessionmaker[Session] = None
-_session_ctx: ContextVar[Session] = ContextVar("session_ctx")
+_session_ctx: ContextVar["SessionContext"] = ContextVar("session_ctx")
+
+# async counterparts, only setup when the service runs in async mode.
+_async_sessionmakers: async_sessionmaker[AsyncSession] = None
+_async_session_ctx: ContextVar["AsyncSessionContext"] = ContextVar("async_session_ctx")
+
+LOG = logging.getLogger(__name__)
+
+
+class PoolStats:
+    """Counts connection pool activity of an engine.
+
+    Checkout wait time and overflow connections are only known to the
+    instrumented queue pools below, the other counters come from pool events.
+    """
+
+    def __init__(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.max_checked_out = 0
+        self.overflows = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def attach(self, engine: Engine) -> None:
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+
+        if isinstance(engine.pool, _InstrumentedPoolMixin):
+            engine.pool.pool_stats = self
+
+    def _on_connect(self, *_):
+        self.connects += 1
+
+    def _on_checkout(self, *_):
+        self.checkouts += 1
+        self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def _on_checkin(self, *_):
+        self.checkins += 1
+
+    def record_wait(self, seconds: float) -> None:
+        self.wait_seconds += seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    @property
+    def checked_out(self) -> int:
+        return self.checkouts - self.checkins
+
+    def stats(self) -> dict:
+        return {
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "checked_out": self.checked_out,
+            "max_checked_out": self.max_checked_out,
+            "overflows": self.overflows,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(
+                self.wait_seconds * 1000 / self.checkouts if self.checkouts else 0, 3
+            ),
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+        }
+
+
+class _InstrumentedPoolMixin:
+    """Times checkouts and counts connections opened beyond pool_size."""
+
+    pool_stats: Optional[PoolStats] = None
+
+    def connect(self):
+        stats = self.pool_stats
+        if stats is None:
+            return super().connect()
+
+        overflow = self.overflow()
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            stats.timeouts += 1
+            raise
+        finally:
+            stats.record_wait(time.perf_counter() - start)
+
+        if self.overflow() > max(overflow, 0):
+            stats.overflows += 1
+        return connection
+
+    def recreate(self):
+        # engine.dispose() swaps in a fresh pool, keep counting on it.
+        pool = super().recreate()
+        pool.pool_stats = self.pool_stats
+        return pool
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+pool_stats = PoolStats()
+async_pool_stats = PoolStats()
+
+
+def _pool_options(settings, *, asyncio: bool = False) -> dict:
+    if settings.db_pgbouncer_mode:
+        # pgbouncer does the pooling, connections go back to it after every use.
+        options = {"poolclass": NullPool}
+        if asyncio:
+            # in transaction pooling prepared statements can't outlive a
+            # transaction, so asyncpg must not cache them by name.
+            options["connect_args"] = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+            }
+        return options
+
+    return {
+        "poolclass": InstrumentedAsyncQueuePool if asyncio else InstrumentedQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_pool_max_overflow,
+        "pool_timeout": settings.db_pool_timeout_seconds,
+        "pool_recycle": settings.db_pool_recycle_seconds,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
 
 
 def setup_postgresql(settings):
@@ -13,8 +153,9 @@ def setup_postgresql(settings):
 
     engine = create_engine(
         url=settings.sqlalchemy_database_uri,
-        pool_pre_ping=True,
+        **_pool_options(settings),
     )
+    pool_stats.attach(engine)
 
     # set the global variable.
     _sessionmakers = sessionmaker(
@@ -23,42 +164,148 @@ def setup_postgresql(settings):
         autoflush=True,
         autocommit=False,
     )
+    event.listen(_sessionmakers, "after_commit", _run_after_commit_callbacks)
+    event.listen(_sessionmakers, "after_rollback", _discard_after_commit_callbacks)
 
     return _sessionmakers
 
 
+def new_session() -> Session:
+    """Returns a session that is independent of the one in context."""
+    assert _sessionmakers, "Please setup database before using new_session"
+    return _sessionmakers()
+
+
+def _run_after_commit_callbacks(session: Session):
+    for callback in session.info.pop("after_commit", []):
+        # the transaction is already committed, a failing callback must not
+        # turn the request into an error.
+        try:
+            callback()
+        except Exception:
+            LOG.exception("after commit callback failed.")
+
+
+def _discard_after_commit_callbacks(session: Session):
+    session.info.pop("after_commit", None)
+
+
+def setup_async_postgresql(settings):
+    global _async_sessionmakers
+
+    engine = create_async_engine(
+        url=settings.sqlalchemy_async_database_uri,
+        **_pool_options(settings, asyncio=True),
+    )
+    async_pool_stats.attach(engine.sync_engine)
+
+    _async_sessionmakers = async_sessionmaker(
+        bind=engine,
+        class_=AsyncSession,
+        autoflush=True,
+        expire_on_commit=False,
+    )
+
+    return _async_sessionmakers
+
+
 def close_db_connections():
     engine: Engine = _sessionmakers.kw["bind"]
     engine.dispose()
 
 
+async def close_async_db_connections():
+    if _async_sessionmakers:
+        engine: AsyncEngine = _async_sessionmakers.kw["bind"]
+        await engine.dispose()
+
+
 class SessionContext:
-    def __init__(self, with_transaction: bool = True):
+    """Scopes a session to a block of code, opening it on first use.
+
+    With `lazy` nothing is created until something reads the session, and the
+    transaction always autobegins on the first statement, so the pool is only
+    hit when a query actually runs. With `with_transaction` the transaction is
+    committed, or rolled back on error, at exit if one was started. Used as an
+    async context manager the commit runs in the threadpool.
+    """
+
+    def __init__(self, with_transaction: bool = True, *, lazy: bool = False):
         self.with_transaction = with_transaction
-        self.session: Session | None = None
+        self.lazy = lazy
+        self._session: Session | None = None
         self._token = None
 
-    def __enter__(self) -> Session:
-        assert _sessionmakers, "Please setup database before using SessionContext"
+    @property
+    def session(self) -> Session:
+        if self._session is None:
+            assert _sessionmakers, "Please setup database before using SessionContext"
+            self._session = _sessionmakers()
+        return self._session
+
+    def __enter__(self) -> Optional[Session]:
+        self._token = _session_ctx.set(self)
+        # lazy contexts leave the session to current_ctx.session.
+        return None if self.lazy else self.session
 
-        self.session: Session = _sessionmakers()
-        self._token = _session_ctx.set(self.session)
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._finish(exc_type)
+        _session_ctx.reset(self._token)
 
-        if self.with_transaction:
-            self.session.begin()
+    async def __aenter__(self) -> Optional[Session]:
+        return self.__enter__()
 
-        return self.session
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        # on the event loop, the commit and its after commit callbacks block, so
+        # a session that was opened at all is finished in the threadpool.
+        if self._session:
+            await run_in_threadpool(self._finish, exc_type)
+        _session_ctx.reset(self._token)
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.with_transaction and self.session:
+    def _finish(self, exc_type) -> None:
+        session = self._session
+        if session is None:
+            return
+
+        if self.with_transaction and session.in_transaction():
             if exc_type:
-                self.session.rollback()
+                session.rollback()
             else:
-                self.session.commit()
+                session.commit()
+        session.close()
 
-        _session_ctx.reset(self._token)
-        if self.session:
-            self.session.close()
+
+class AsyncSessionContext:
+    def __init__(self, with_transaction: bool = True, *, lazy: bool = False):
+        self.with_transaction = with_transaction
+        self.lazy = lazy
+        self._session: AsyncSession | None = None
+        self._token = None
+
+    @property
+    def session(self) -> AsyncSession:
+        if self._session is None:
+            assert _async_sessionmakers, (
+                "Please setup async database before using AsyncSessionContext"
+            )
+            self._session = _async_sessionmakers()
+        return self._session
+
+    async def __aenter__(self) -> Optional[AsyncSession]:
+        self._token = _async_session_ctx.set(self)
+        return None if self.lazy else self.session
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        session = self._session
+        if self.with_transaction and session and session.in_transaction():
+            if exc_type:
+                await session.rollback()
+            else:
+                await session.commit()
+
+        _async_session_ctx.reset(self._token)
+        if session:
+            await session.close()
 
 
 # Helper to pull the current session. This will be used by services.
@@ -66,9 +313,25 @@ class CurrentSessionContext:
     @property
     def session(self) -> Session:
         try:
-            return _session_ctx.get()
+            return _session_ctx.get().session
         except LookupError:
             raise RuntimeError("No session found in context")
 
+    def on_commit(self, callback: Callable[[], None]) -> None:
+        """Runs the callback once the current transaction has been committed."""
+        self.session.info.setdefault("after_commit", []).append(callback)
+
 
 current_ctx = CurrentSessionContext()
+
+
+class CurrentAsyncSessionContext:
+    @property
+    def session(self) -> AsyncSession:
+        try:
+            return _async_session_ctx.get().session
+        except LookupError:
+            raise RuntimeError("No async session found in context")
+
+
+current_async_ctx = CurrentAsyncSessionContext()
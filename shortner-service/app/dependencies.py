@@ -5,16 +5,27 @@ from fastapi.security import OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
 
 from app.config import settings
-from app.db import Session, SessionContext
+from app.db import (
+    AsyncSessionContext,
+    CurrentAsyncSessionContext,
+    CurrentSessionContext,
+    SessionContext,
+    current_async_ctx,
+    current_ctx,
+)
+from app.dto import UserPrincipal
 from app.exceptions import NotFound
-from app.models import User
+from app.importer import URLImporter
 from app.security import decode_jwt
 from app.service import URLClickCountService, URLService, UserService
+from app.trending import TrendingLinks
 
 
 async def session_with_transaction():
-    with SessionContext(with_transaction=True) as session:
-        yield session
+    # lazy, requests served from the cache never open a session. the commit and
+    # its after commit callbacks run in the threadpool, not on the event loop.
+    async with SessionContext(with_transaction=True, lazy=True):
+        yield current_ctx
 
 
 async def session_without_transaction():
@@ -23,19 +34,33 @@ async def session_without_transaction():
     return SessionContext(with_transaction=False)
 
 
-# simple utility functions.
-def get_user_service(request: Request) -> UserService:
+async def async_session_with_transaction():
+    async with AsyncSessionContext(with_transaction=True, lazy=True):
+        yield current_async_ctx
+
+
+# simple utility functions, async so fastapi calls them on the event loop rather
+# than through the threadpool.
+async def get_user_service(request: Request) -> UserService:
     return request.app.state.user_service
 
 
-def get_url_service(request: Request) -> URLService:
+async def get_url_service(request: Request) -> URLService:
     return request.app.state.url_service
 
 
-def get_url_click_count_service(request: Request) -> URLClickCountService:
+async def get_url_click_count_service(request: Request) -> URLClickCountService:
     return request.app.state.url_click_count_service
 
 
+async def get_url_importer(request: Request) -> URLImporter:
+    return request.app.state.url_importer
+
+
+async def get_trending(request: Request) -> TrendingLinks:
+    return request.app.state.trending
+
+
 # dependency setup.
 oauth_extractor = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1}/users/access-token",
@@ -43,7 +68,10 @@ oauth_extractor = OAuth2PasswordBearer(
 TokenDep = Annotated[str, Depends(oauth_extractor)]
 
 
-SessionDep = Annotated[Session, Depends(session_with_transaction)]
+SessionDep = Annotated[CurrentSessionContext, Depends(session_with_transaction)]
+AsyncSessionDep = Annotated[
+    CurrentAsyncSessionContext, Depends(async_session_with_transaction)
+]
 
 
 UserServiceDep = Annotated[UserService, Depends(get_user_service)]
@@ -51,11 +79,13 @@ URLServiceDep = Annotated[URLService, Depends(get_url_service)]
 URLClickCountServiceDep = Annotated[
     URLClickCountService, Depends(get_url_click_count_service)
 ]
+URLImporterDep = Annotated[URLImporter, Depends(get_url_importer)]
+TrendingDep = Annotated[TrendingLinks, Depends(get_trending)]
 
 
 def get_current_user(
     user_service: UserServiceDep, _: SessionDep, token: TokenDep
-) -> User:
+) -> UserPrincipal:
     sub: str = ""
     try:
         payload: dict = decode_jwt(token)
@@ -67,7 +97,7 @@ def get_current_user(
         )
 
     try:
-        user: User = user_service.get_user(user_id=sub)
+        user = user_service.get_principal(user_id=sub)
     except NotFound:
         raise HTTPException(status_code=404, detail="user not found.")
 
@@ -77,4 +107,16 @@ def get_current_user(
     return user
 
 
-CurrentUser = Annotated[User, Depends(get_current_user)]
+CurrentUser = Annotated[UserPrincipal, Depends(get_current_user)]
+
+
+async def get_admin_user(user: CurrentUser) -> UserPrincipal:
+    if user.username not in settings.admin_usernames:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="admin access required."
+        )
+
+    return user
+
+
+AdminUser = Annotated[UserPrincipal, Depends(get_admin_user)]
@@ -1,6 +1,19 @@
-from datetime import datetime
+import base64
+import re
+import uuid
+from datetime import date, datetime, timezone
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
+
+# upper bound of items accepted by the batch shortening endpoint.
+MAX_BATCH_URLS = 5000
+
+# page sizes of the url listing endpoint.
+DEFAULT_URL_PAGE_SIZE = 100
+MAX_URL_PAGE_SIZE = 1000
+
+# custom aliases and imported codes, no ':' so they never clash with prefixed keys.
+ALIAS_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
 
 
 class UserLogin(BaseModel):
@@ -18,13 +31,24 @@ class UserOut(BaseModel):
     is_active: bool
 
 
+class UserPrincipal(BaseModel):
+    """The authenticated user as seen by routes, cheap to cache per process."""
+
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
+    id: uuid.UUID
+    username: str
+    display_name: str
+    is_active: bool
+
+
 class Token(BaseModel):
     access_token: str
 
 
 class URLIn(BaseModel):
     original_url: str
-    alias: str | None = None
+    alias: str | None = Field(default=None, pattern=ALIAS_PATTERN.pattern)
     expires_in: datetime | None = None
 
 
@@ -32,6 +56,19 @@ class URLOut(BaseModel):
     short_url: str
 
 
+class URLBatchIn(BaseModel):
+    items: list[URLIn] = Field(min_length=1, max_length=MAX_BATCH_URLS)
+
+
+class URLBatchItemOut(BaseModel):
+    short_url: str | None = None
+    error: str | None = None
+
+
+class URLBatchOut(BaseModel):
+    results: list[URLBatchItemOut]
+
+
 class URLItem(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
@@ -40,13 +77,106 @@ class URLItem(BaseModel):
     short_url: str
 
 
+class _Cursor(BaseModel):
+    def encode(self) -> str:
+        return base64.urlsafe_b64encode(self.model_dump_json().encode()).decode()
+
+    @classmethod
+    def decode(cls, value: str):
+        return cls.model_validate_json(base64.urlsafe_b64decode(value.encode()))
+
+
+class URLCursor(_Cursor):
+    """Position after the last url of a page, in (created_at, id) order."""
+
+    created_at: datetime
+    id: uuid.UUID
+
+
+class URLImportRow(BaseModel):
+    short_url: str
+    original_url: str
+    expires_at: datetime | None = None
+
+
+class URLImportError(BaseModel):
+    line: int
+    short_url: str | None = None
+    error: str
+
+
+class URLImportSummary(BaseModel):
+    imported: int = 0
+    conflicts: int = 0
+    invalid: int = 0
+    errors: list[URLImportError] = []
+
+
 class ClickCount(BaseModel):
     short_url: str
     country_code: str
     counts: int
 
 
+class CountryClicks(BaseModel):
+    country_code: str
+    counts: int
+
+
+class ClickStats(BaseModel):
+    short_url: str
+    total: int
+    # most clicked first.
+    countries: list[CountryClicks]
+
+
+class ClickStatsCursor(_Cursor):
+    """Position after the last country of a page, in (counts desc, code) order."""
+
+    counts: int
+    country_code: str
+
+
+class ClickBucketCount(ClickCount):
+    bucket_start: datetime
+
+
+class ClickSeriesPoint(BaseModel):
+    bucket_start: datetime
+    counts: int
+
+
+class TrendingURL(BaseModel):
+    short_url: str
+    # approximate clicks within the trending window.
+    clicks: int
+
+
+class DailyVisitors(BaseModel):
+    day: date
+    unique_visitors: int
+
+
+class UniqueVisitorStats(BaseModel):
+    short_url: str
+    start: date
+    end: date
+    # approximate, visitors of several days are counted once.
+    unique_visitors: int
+    days: list[DailyVisitors]
+
+
 class ClickStreamMessage(BaseModel):
     message_id: str
     short_url: str
     request_ip: str
+    # set by producers that resolve countries themselves.
+    country_code: str | None = None
+
+    @property
+    def clicked_at(self) -> datetime:
+        # stream ids start with the utc milliseconds the entry was added at.
+        millis = int(self.message_id.split("-", 1)[0])
+        return datetime.fromtimestamp(millis / 1000, tz=timezone.utc).replace(
+            tzinfo=None
+        )
@@ -0,0 +1,234 @@
+import csv
+import ipaddress
+import logging
+import socket
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Optional
+
+from app.config import Settings
+
+LOG = logging.getLogger(__name__)
+
+UNKNOWN_COUNTRY = "ZZ"
+
+# ::ffff:0:0/96, ipv4 addresses embedded in ipv6.
+_V4_MAPPED_PREFIX = b"\x00" * 10 + b"\xff\xff"
+
+
+class _RangeTable:
+    """Sorted, non-overlapping [start, end] ranges with a country index each."""
+
+    def __init__(self, starts, ends):
+        self.starts = starts
+        self.ends = ends
+        self.countries = array("H")
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def find(self, value: int, lo: int = 0) -> int:
+        """Returns the index of the range containing value, or -1."""
+        index = bisect_right(self.starts, value, lo) - 1
+        if index >= 0 and value <= self.ends[index]:
+            return index
+        return -1
+
+
+class GeoIPResolver:
+    """Resolves IPv4 and IPv6 addresses to country codes from a local database.
+
+    The database is a CSV file with a `country_code` column and either a
+    `network` column (CIDR) or `start_ip`/`end_ip` columns. Ranges are kept in
+    compact sorted arrays per address family and looked up with bisect.
+    Resolved addresses are memoized in an LRU of `memo_size` entries, shared
+    by single and batch lookups.
+    """
+
+    def __init__(self, *, memo_size: int = 100000):
+        # ipv4 bounds fit in 32 bit arrays, ipv6 bounds need python ints.
+        self._v4 = _RangeTable(array("I"), array("I"))
+        self._v6 = _RangeTable([], [])
+        self._country_codes: list[str] = []
+
+        self.memo_size = memo_size
+        self._memo: OrderedDict[str, str] = OrderedDict()
+        self._memo_lock = threading.Lock()
+        self.memo_hits = 0
+        self.memo_misses = 0
+
+    def load_csv(self, path: Path) -> int:
+        start = time.monotonic()
+        v4_rows, v6_rows = [], []
+        country_index: dict[str, int] = {}
+
+        with open(path, newline="") as fp:
+            for row in csv.DictReader(fp):
+                version, first, last = _parse_range(row)
+                country = row["country_code"].strip().upper() or UNKNOWN_COUNTRY
+                index = country_index.setdefault(country, len(country_index))
+
+                rows = v4_rows if version == 4 else v6_rows
+                rows.append((first, last, index))
+
+        v4, v6 = _RangeTable(array("I"), array("I")), _RangeTable([], [])
+        for table, rows in ((v4, v4_rows), (v6, v6_rows)):
+            rows.sort()
+            for first, last, index in rows:
+                table.starts.append(first)
+                table.ends.append(last)
+                table.countries.append(index)
+
+        # a reload replaces the previous database instead of extending it.
+        self._v4, self._v6 = v4, v6
+        self._country_codes = list(country_index)
+
+        with self._memo_lock:
+            self._memo.clear()
+        LOG.info(
+            f"loaded {len(v4_rows)} ipv4 and {len(v6_rows)} ipv6 ranges "
+            f"in {time.monotonic() - start:.2f}s."
+        )
+        return len(v4_rows) + len(v6_rows)
+
+    def resolve(self, ip: str) -> str:
+        if memoized := self._memo_get([ip]):
+            return memoized[ip]
+
+        country = self._resolve(ip)
+        self._memo_put({ip: country})
+        return country
+
+    def _resolve(self, ip: str) -> str:
+        parsed = _ip_to_int(ip)
+        if parsed is None:
+            return UNKNOWN_COUNTRY
+
+        version, value = parsed
+        table = self._v4 if version == 4 else self._v6
+        index = table.find(value)
+        if index < 0:
+            return UNKNOWN_COUNTRY
+
+        return self._country_codes[table.countries[index]]
+
+    def resolve_many(self, ips: Iterable[str]) -> list[str]:
+        """Resolves a batch of addresses in one sorted pass over the ranges."""
+        ips = list(ips)
+        unique = set(ips)
+        memoized = self._memo_get(unique)
+        resolved: dict[str, str] = {}
+        by_family: dict[int, list[tuple[int, str]]] = {4: [], 6: []}
+
+        for ip in unique.difference(memoized):
+            parsed = _ip_to_int(ip)
+            if parsed is None:
+                resolved[ip] = UNKNOWN_COUNTRY
+            else:
+                by_family[parsed[0]].append((parsed[1], ip))
+
+        for version, table in ((4, self._v4), (6, self._v6)):
+            # sorted lookups only ever move forward through the ranges.
+            lo = 0
+            for value, ip in sorted(by_family[version]):
+                index = table.find(value, lo)
+                if index < 0:
+                    resolved[ip] = UNKNOWN_COUNTRY
+                    continue
+
+                lo = index
+                resolved[ip] = self._country_codes[table.countries[index]]
+
+        self._memo_put(resolved)
+        resolved.update(memoized)
+        return [resolved[ip] for ip in ips]
+
+    def _memo_get(self, ips: Iterable[str]) -> dict[str, str]:
+        found = {}
+        with self._memo_lock:
+            for ip in ips:
+                if (country := self._memo.get(ip)) is not None:
+                    self._memo.move_to_end(ip)
+                    found[ip] = country
+                    self.memo_hits += 1
+                else:
+                    self.memo_misses += 1
+
+        return found
+
+    def _memo_put(self, resolved: dict[str, str]) -> None:
+        if not self.memo_size:
+            return
+
+        with self._memo_lock:
+            self._memo.update(resolved)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "ipv4_ranges": len(self._v4),
+            "ipv6_ranges": len(self._v6),
+            "memo_size": len(self._memo),
+            "memo_hits": self.memo_hits,
+            "memo_misses": self.memo_misses,
+        }
+
+
+def _parse_range(row: dict) -> tuple[int, int, int]:
+    if network := row.get("network"):
+        network = ipaddress.ip_network(network.strip(), strict=False)
+        return (
+            network.version,
+            int(network.network_address),
+            int(network.broadcast_address),
+        )
+
+    first = _ip_to_int(row["start_ip"].strip())
+    last = _ip_to_int(row["end_ip"].strip())
+    if first is None or last is None or first[0] != last[0]:
+        raise ValueError(f"Invalid ip range: {row['start_ip']} - {row['end_ip']}")
+
+    return first[0], first[1], last[1]
+
+
+def _ip_to_int(ip: str) -> Optional[tuple[int, int]]:
+    # inet_pton is several times faster than the ipaddress module.
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except OSError:
+        pass
+
+    try:
+        packed = socket.inet_pton(socket.AF_INET6, ip)
+    except OSError:
+        return None
+
+    if packed.startswith(_V4_MAPPED_PREFIX):
+        return 4, int.from_bytes(packed[12:], "big")
+
+    return 6, int.from_bytes(packed, "big")
+
+
+_resolver: GeoIPResolver = GeoIPResolver()
+
+
+def setup_geoip(settings: Settings) -> GeoIPResolver:
+    global _resolver
+
+    _resolver = GeoIPResolver(memo_size=settings.geoip_memo_size)
+    if settings.geoip_database_path:
+        _resolver.load_csv(Path(settings.geoip_database_path))
+    else:
+        LOG.warning("no geoip database configured, countries resolve to unknown.")
+
+    return _resolver
+
+
+def get_geoip_resolver() -> GeoIPResolver:
+    """Helper method to return the geoip resolver"""
+    return _resolver
@@ -0,0 +1,242 @@
+import csv
+import io
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional, TextIO
+
+from pydantic import ValidationError
+from sqlalchemy import text
+
+from app.cache import CacheRecord, RedisCache
+from app.db import SessionContext
+from app.dto import ALIAS_PATTERN, URLImportError, URLImportRow, URLImportSummary
+from app.service import URLClickCountService
+
+LOG = logging.getLogger(__name__)
+
+_COLUMNS = (
+    "id",
+    "original_url",
+    "short_url",
+    "created_by",
+    "expires_at",
+    "is_active",
+    "created_at",
+    "updated_at",
+)
+
+
+def _utc(value: datetime) -> datetime:
+    # url.expires_at is naive utc, postgres would drop an offset rather than
+    # convert it. the cache records keep the aware value, its epoch is right.
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def read_rows(fp: TextIO, fmt: str) -> Iterator[tuple[int, dict | None]]:
+    """Yields (line number, raw row) pairs, None for rows that can't be parsed."""
+    if fmt == "csv":
+        for line_no, row in enumerate(csv.DictReader(fp), start=2):
+            # empty csv cells mean "not set".
+            yield line_no, {key: value or None for key, value in row.items()}
+        return
+
+    for line_no, line in enumerate(fp, start=1):
+        if not line.strip():
+            continue
+
+        try:
+            yield line_no, json.loads(line)
+        except json.JSONDecodeError:
+            yield line_no, None
+
+
+def validate_rows(
+    rows: Iterable[tuple[int, dict | None]],
+) -> Iterator[tuple[int, URLImportRow | URLImportError]]:
+    for line_no, row in rows:
+        if not isinstance(row, dict):
+            yield line_no, URLImportError(line=line_no, error="unparsable row.")
+            continue
+
+        try:
+            mapping = URLImportRow(**row)
+        except (ValidationError, TypeError) as exc:
+            yield line_no, URLImportError(line=line_no, error=str(exc))
+            continue
+
+        if not ALIAS_PATTERN.match(mapping.short_url):
+            yield (
+                line_no,
+                URLImportError(
+                    line=line_no,
+                    short_url=mapping.short_url,
+                    error="invalid alias.",
+                ),
+            )
+            continue
+
+        yield line_no, mapping
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class URLImporter:
+    """Loads existing short url mappings into the url table in COPY batches.
+
+    Rows are streamed through a generator pipeline, so memory stays bounded by
+    `batch_size` however large the input is. Every batch is copied into a
+    temporary table and merged into url in its own transaction; short urls
+    that already exist are reported as conflicts instead of failing the batch.
+    """
+
+    def __init__(
+        self,
+        *,
+        redis_cache: Optional[RedisCache] = None,
+        batch_size: int = 10000,
+        cache_ttl_seconds: int = 86400,
+        click_counts: Optional[URLClickCountService] = None,
+    ):
+        self.cache = redis_cache
+        self.click_counts = click_counts
+        self.batch_size = batch_size
+        self.cache_ttl_seconds = cache_ttl_seconds
+
+    def import_file(
+        self,
+        fp: TextIO,
+        *,
+        fmt: str,
+        user_id: uuid.UUID,
+        on_error: Callable[[URLImportError], None],
+        warm_cache: bool = False,
+    ) -> URLImportSummary:
+        start = time.monotonic()
+        summary = URLImportSummary()
+
+        for batch in batched(validate_rows(read_rows(fp, fmt)), self.batch_size):
+            mappings: dict[str, tuple[int, URLImportRow]] = {}
+            for line_no, item in batch:
+                if isinstance(item, URLImportError):
+                    summary.invalid += 1
+                    on_error(item)
+                elif item.short_url in mappings:
+                    summary.conflicts += 1
+                    on_error(
+                        URLImportError(
+                            line=line_no,
+                            short_url=item.short_url,
+                            error="duplicate short url in input.",
+                        )
+                    )
+                else:
+                    mappings[item.short_url] = (line_no, item)
+
+            if not mappings:
+                continue
+
+            created = self._copy_batch(
+                [item for _, item in mappings.values()], user_id=user_id
+            )
+            summary.imported += len(created)
+
+            for short_url, (line_no, _) in mappings.items():
+                if short_url not in created:
+                    summary.conflicts += 1
+                    on_error(
+                        URLImportError(
+                            line=line_no,
+                            short_url=short_url,
+                            error="short url already exists.",
+                        )
+                    )
+
+            self._publish_created(
+                [mappings[short_url][1] for short_url in created],
+                user_id=user_id,
+                warm_cache=warm_cache,
+            )
+
+        LOG.info(
+            f"imported {summary.imported} urls, {summary.conflicts} conflicts, "
+            f"{summary.invalid} invalid rows in {time.monotonic() - start:.2f}s."
+        )
+        return summary
+
+    def _copy_batch(self, rows: list[URLImportRow], *, user_id: uuid.UUID) -> set:
+        now = datetime.now()
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(
+                (
+                    uuid.uuid4(),
+                    row.original_url,
+                    row.short_url,
+                    user_id,
+                    _utc(row.expires_at).isoformat() if row.expires_at else None,
+                    True,
+                    now.isoformat(),
+                    now.isoformat(),
+                )
+            )
+        buffer.seek(0)
+
+        columns = ", ".join(_COLUMNS)
+        with SessionContext(with_transaction=True) as session:
+            session.exec(
+                text(
+                    "CREATE TEMP TABLE url_import "
+                    "(LIKE url INCLUDING DEFAULTS) ON COMMIT DROP"
+                )
+            )
+
+            # COPY needs the raw psycopg2 cursor.
+            cursor = session.connection().connection.cursor()
+            cursor.copy_expert(
+                f"COPY url_import ({columns}) FROM STDIN WITH (FORMAT csv)", buffer
+            )
+
+            result = session.exec(
+                text(
+                    f"INSERT INTO url ({columns}) "
+                    f"SELECT {columns} FROM url_import "
+                    "ON CONFLICT (short_url) DO NOTHING "
+                    "RETURNING short_url"
+                )
+            )
+            created = set(result.scalars())
+            if self.click_counts:
+                self.click_counts.reset_click_history(sorted(created))
+
+            return created
+
+    def _publish_created(
+        self, rows: list[URLImportRow], *, user_id: uuid.UUID, warm_cache: bool
+    ):
+        if not self.cache or not rows:
+            return
+
+        if warm_cache:
+            self.cache.set_many(
+                {
+                    row.short_url: CacheRecord.of(
+                        row.original_url, expires_at=row.expires_at, owner_id=user_id
+                    )
+                    for row in rows
+                },
+                self.cache_ttl_seconds,
+            )
+
+        # lets every worker drop negative entries and extend its bloom filter.
+        self.cache.invalidate_many([row.short_url for row in rows])
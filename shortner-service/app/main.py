@@ -1,54 +1,313 @@
 from contextlib import asynccontextmanager
+from typing import Optional
 
 import redis
 from fastapi import FastAPI
 
-from app.cache import RedisCache, close_redis_connections, setup_redis
+from app.bloom import BloomFilter, BloomFilterRefresher
+from app.cache import (
+    AsyncRedisCache,
+    BucketLayout,
+    CacheInvalidator,
+    LocalCache,
+    RedisCache,
+    close_async_redis_connections,
+    close_redis_connections,
+    setup_async_redis,
+    setup_redis,
+)
+from app.clicks import ClickBuffer, PendingClicks
 from app.config import settings
-from app.db import close_db_connections, current_ctx, setup_postgresql
-from app.routes.url import redirect_route, urls_route
+from app.consumer import read_consumer_stats
+from app.db import (
+    SessionContext,
+    async_pool_stats,
+    close_async_db_connections,
+    close_db_connections,
+    current_async_ctx,
+    current_ctx,
+    pool_stats,
+    setup_async_postgresql,
+    setup_postgresql,
+)
+from app.geoip import GeoIPResolver, setup_geoip
+from app.importer import URLImporter
+from app.metrics import registry
+from app.reaper import URLReaper
+from app.routes.metrics import route as metrics_routes
+from app.routes.url import async_redirect_route, redirect_route, urls_route
 from app.routes.user import route as user_routes
-from app.service import CounterService, URLClickCountService, URLService, UserService
+from app.service import (
+    CacheWarmer,
+    CounterService,
+    URLClickCountService,
+    URLService,
+    UserService,
+)
+from app.singleflight import AsyncSingleFlight, SingleFlight
+from app.trending import HotKeyRefresher, TrendingLinks
+from app.visitors import UniqueVisitors
+
+
+def _local_cache(
+    name: str, *, enabled: bool, max_size: int, ttl_seconds: float
+) -> Optional[LocalCache]:
+    if not enabled:
+        return None
+
+    cache = LocalCache(max_size=max_size, ttl_seconds=ttl_seconds)
+    registry.register(name, cache.stats)
+    return cache
+
+
+def _realtime_clicks(
+    redis_client: redis.Redis,
+) -> tuple[Optional[GeoIPResolver], Optional[PendingClicks]]:
+    if not settings.realtime_click_counts_enabled:
+        return None, None
+
+    # countries are resolved here as well, so pending counts match the
+    # consumer's rows.
+    geoip = setup_geoip(settings)
+    registry.register("geoip", geoip.stats)
+    return geoip, PendingClicks(
+        redis_client, ttl_seconds=settings.pending_clicks_ttl_seconds
+    )
+
+
+def _load_bloom_filter(url_service: URLService) -> int:
+    with SessionContext(with_transaction=False):
+        return url_service.load_bloom_filter()
+
+
+def _background_workers(
+    *,
+    redis_cache: RedisCache,
+    cache_warmer: CacheWarmer,
+    trending: TrendingLinks,
+    url_service: URLService,
+    cache_invalidator: CacheInvalidator,
+) -> list:
+    workers = []
+    if url_service.bloom_filter is not None and settings.bloom_filter_refresh_seconds:
+        bloom_filter_refresher = BloomFilterRefresher(
+            load=lambda: _load_bloom_filter(url_service),
+            interval_seconds=settings.bloom_filter_refresh_seconds,
+        )
+        # invalidations missed while disconnected would otherwise be missing
+        # from the filter until the next rebuild.
+        cache_invalidator.on_error(bloom_filter_refresher.request)
+        registry.register("bloom_filter_refresh", bloom_filter_refresher.stats)
+        workers.append(bloom_filter_refresher)
+
+    if settings.url_reaper_enabled:
+        url_reaper = URLReaper(
+            redis_cache=redis_cache,
+            mode=settings.url_reaper_mode,
+            batch_size=settings.url_reaper_batch_size,
+            interval_seconds=settings.url_reaper_interval_seconds,
+        )
+        registry.register("url_reaper", url_reaper.stats)
+        workers.append(url_reaper)
+
+    if settings.hot_key_refresh_enabled:
+        hot_key_refresher = HotKeyRefresher(
+            trending=trending,
+            redis_cache=redis_cache,
+            cache_warmer=cache_warmer,
+            top_n=settings.hot_key_refresh_top_n,
+            interval_seconds=settings.hot_key_refresh_interval_seconds,
+        )
+        registry.register("hot_keys", hot_key_refresher.stats)
+        workers.append(hot_key_refresher)
+
+    return workers
 
 
 @asynccontextmanager
 async def app_setup(app: FastAPI):
     # setup postgresql database connection.
     setup_postgresql(settings)
+    registry.register("db_pool", pool_stats.stats)
 
     # setup redis client.
     redis_client: redis.Redis = setup_redis(settings)
 
+    # in-process tier in front of redis, invalidated through redis pub/sub.
+    local_cache = _local_cache(
+        "local_cache",
+        enabled=settings.local_cache_enabled,
+        max_size=settings.local_cache_max_size,
+        ttl_seconds=settings.local_cache_ttl_seconds,
+    )
+
+    cache_layout = BucketLayout.from_settings(settings)
+    if cache_layout:
+        cache_layout.check_server(redis_client)
+    cache_invalidator = CacheInvalidator(client=redis_client)
+    redis_cache = RedisCache(
+        client=redis_client,
+        local_cache=local_cache,
+        invalidator=cache_invalidator,
+        invalidation_channel=settings.cache_invalidation_channel,
+        layout=cache_layout,
+    )
+
+    # async clients for the redirect path, sharing the same local tier.
+    async_cache = None
+    if settings.async_mode:
+        setup_async_postgresql(settings)
+        registry.register("async_db_pool", async_pool_stats.stats)
+        async_cache = AsyncRedisCache(
+            client=setup_async_redis(settings),
+            local_cache=local_cache,
+            layout=cache_layout,
+        )
+
+    # negative caching of unknown short codes.
+    negative_cache = _local_cache(
+        "negative_cache",
+        enabled=settings.negative_cache_enabled,
+        max_size=settings.negative_cache_max_size,
+        ttl_seconds=settings.negative_cache_ttl_seconds,
+    )
+
+    bloom_filter = None
+    if settings.bloom_filter_enabled:
+        bloom_filter = BloomFilter(
+            capacity=settings.bloom_filter_capacity,
+            error_rate=settings.bloom_filter_error_rate,
+        )
+        registry.register("bloom_filter", bloom_filter.stats)
+
+    # clicks are buffered in process and flushed to the stream in the background.
+    geoip, pending_clicks = _realtime_clicks(redis_client)
+    click_buffer = ClickBuffer(
+        client=redis_client,
+        topic=settings.click_analytics_topic,
+        max_size=settings.click_buffer_max_size,
+        flush_interval_ms=settings.click_buffer_flush_interval_ms,
+        flush_batch_size=settings.click_buffer_flush_batch_size,
+        max_backoff_seconds=settings.click_buffer_max_backoff_seconds,
+        geoip=geoip,
+        pending_clicks=pending_clicks,
+    )
+    registry.register("click_buffer", click_buffer.stats)
+    registry.register("click_consumers", lambda: read_consumer_stats(redis_client))
+
     # setup services(singleton).
     counter_service = CounterService(
         key=settings.id_counter_key,
         batch_size=settings.id_counter_batch_size,
-        context=current_ctx,
+        max_batch_size=settings.id_counter_max_batch_size,
+        prefetch_ratio=settings.id_counter_prefetch_ratio,
+        target_block_seconds=settings.id_counter_target_block_seconds,
+    )
+    registry.register("id_counter", counter_service.stats)
+    principal_cache = _local_cache(
+        "user_cache",
+        enabled=settings.user_cache_enabled,
+        max_size=settings.user_cache_max_size,
+        ttl_seconds=settings.user_cache_ttl_seconds,
     )
     user_service = UserService(
         context=current_ctx,
+        principal_cache=principal_cache,
+        invalidator=cache_invalidator,
+        invalidation_channel=settings.user_invalidation_channel,
+    )
+    cache_warmer = CacheWarmer(
+        context=current_ctx,
+        redis_cache=redis_cache,
+        batch_size=settings.cache_warmup_batch_size,
+        cache_ttl_seconds=settings.redirect_cache_ttl_seconds,
+    )
+    registry.register("cache_warmer", cache_warmer.stats)
+    url_click_count_service = URLClickCountService(
+        context=current_ctx,
+        unique_visitors=UniqueVisitors(
+            redis_client, retention_days=settings.unique_visitors_retention_days
+        ),
+        pending_clicks=pending_clicks,
     )
     url_service = URLService(
         counter_service=counter_service,
         hash_id_secret=settings.hash_id_counter_secret,
         context=current_ctx,
-        redis_cache=RedisCache(client=redis_client),
-        clicks_topic=settings.click_analytics_topic,
+        redis_cache=redis_cache,
+        click_buffer=click_buffer,
+        negative_cache=negative_cache,
+        bloom_filter=bloom_filter,
+        async_cache=async_cache,
+        async_context=current_async_ctx,
+        cache_warmer=cache_warmer,
+        single_flight=SingleFlight() if settings.single_flight_enabled else None,
+        async_single_flight=(
+            AsyncSingleFlight()
+            if settings.single_flight_enabled and settings.async_mode
+            else None
+        ),
+        fill_lock_timeout_ms=(
+            settings.cache_fill_lock_timeout_ms
+            if settings.cache_fill_lock_enabled
+            else None
+        ),
+        fill_lock_wait_ms=settings.cache_fill_lock_wait_ms,
+        cache_ttl_seconds=settings.redirect_cache_ttl_seconds,
+        click_counts=url_click_count_service,
     )
-    url_click_count_service = URLClickCountService(
-        context=current_ctx,
+    registry.register("cache_fill", url_service.cache_fill_stats)
+
+    url_importer = URLImporter(
+        redis_cache=redis_cache,
+        batch_size=settings.url_import_batch_size,
+        cache_ttl_seconds=settings.redirect_cache_ttl_seconds,
+        click_counts=url_click_count_service,
+    )
+
+    trending = TrendingLinks.from_settings(redis_client, settings)
+    workers = _background_workers(
+        redis_cache=redis_cache,
+        cache_warmer=cache_warmer,
+        trending=trending,
+        url_service=url_service,
+        cache_invalidator=cache_invalidator,
     )
 
     app.state.counter_service = counter_service
     app.state.user_service = user_service
     app.state.url_service = url_service
     app.state.url_click_count_service = url_click_count_service
+    app.state.url_importer = url_importer
+    app.state.trending = trending
+
+    # subscribe before loading the bloom filter so that codes created while it
+    # loads are not missed.
+    cache_invalidator.start()
+    click_buffer.start()
+    if bloom_filter is not None:
+        _load_bloom_filter(url_service)
+
+    # campaign links are hot right after a deploy, serve them from redis.
+    if settings.cache_warmup_on_startup:
+        with SessionContext(with_transaction=False):
+            cache_warmer.warm_top_urls(settings.cache_warmup_top_n)
+
+    for worker in workers:
+        worker.start()
 
     try:
         yield
     finally:
+        # flush pending clicks while redis is still reachable.
+        click_buffer.stop()
+        for worker in workers:
+            worker.stop()
+        cache_invalidator.stop()
         close_db_connections()
         close_redis_connections()
+        await close_async_db_connections()
+        await close_async_redis_connections()
 
 
 def create_app() -> FastAPI:
@@ -56,6 +315,7 @@ def create_app() -> FastAPI:
 
     app.include_router(user_routes, prefix=settings.API_V1)
     app.include_router(urls_route, prefix=settings.API_V1)
-    app.include_router(redirect_route)
+    app.include_router(metrics_routes, prefix=settings.API_V1)
+    app.include_router(async_redirect_route if settings.async_mode else redirect_route)
 
     return app
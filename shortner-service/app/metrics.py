@@ -0,0 +1,17 @@
+from typing import Callable
+
+
+class MetricsRegistry:
+    """Collects point-in-time counters from the components that own them."""
+
+    def __init__(self):
+        self._collectors: dict[str, Callable[[], dict]] = {}
+
+    def register(self, name: str, collector: Callable[[], dict]) -> None:
+        self._collectors[name] = collector
+
+    def collect(self) -> dict[str, dict]:
+        return {name: collector() for name, collector in self._collectors.items()}
+
+
+registry = MetricsRegistry()
@@ -2,7 +2,7 @@ import uuid
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import BigInteger, Column
+from sqlalchemy import BigInteger, Column, Index, text
 from sqlmodel import Field, Relationship, SQLModel
 
 from app.security import encode_jwt, validate_password
@@ -31,6 +31,17 @@ class User(SQLModel, table=True):
 
 
 class URL(SQLModel, table=True):
+    __table_args__ = (
+        # serves the keyset pagination of a user's urls.
+        Index("ix_url_created_by_created_at_id", "created_by", "created_at", "id"),
+        # partial, only urls that can expire are of interest to the reaper.
+        Index(
+            "ix_url_expires_at",
+            "expires_at",
+            postgresql_where=text("expires_at IS NOT NULL"),
+        ),
+    )
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True, index=True)
     original_url: str
     short_url: str = Field(index=True, unique=True)
@@ -44,6 +55,20 @@ class URL(SQLModel, table=True):
     user: User = Relationship(back_populates="urls")
 
 
+class URLArchive(SQLModel, table=True):
+    """Expired urls moved out of the url table by the reaper."""
+
+    id: uuid.UUID = Field(primary_key=True)
+    original_url: str
+    short_url: str = Field(index=True)
+    created_by: uuid.UUID
+    expires_at: Optional[datetime] = Field(default=None, nullable=True)
+    is_active: bool
+    created_at: datetime
+    updated_at: datetime
+    archived_at: datetime = Field(default_factory=datetime.now)
+
+
 class IDCounter(SQLModel, table=True):
     key: str = Field(primary_key=True, index=True)
     next_id: int = Field(
@@ -53,8 +78,18 @@ class IDCounter(SQLModel, table=True):
 
 
 class URLClickCount(SQLModel, table=True):
+    __table_args__ = (
+        # serves a link's countries ordered by clicks, and their keyset pages.
+        Index(
+            "ix_urlclickcount_short_url_counts",
+            "short_url",
+            text("counts DESC"),
+            "country_code",
+        ),
+    )
+
+    # no foreign key, click history outlives urls removed by the reaper.
     short_url: str = Field(
-        foreign_key="url.short_url",
         nullable=False,
         primary_key=True,
     )
@@ -65,3 +100,33 @@ class URLClickCount(SQLModel, table=True):
     )
 
     counts: int = Field(default=0)
+
+
+class URLClickSummary(SQLModel, table=True):
+    """Per link totals, kept next to urlclickcount by the click consumer."""
+
+    short_url: str = Field(primary_key=True)
+    total_clicks: int = Field(
+        default=0,
+        sa_column=Column(BigInteger, nullable=False, default=0),
+    )
+    last_clicked_at: Optional[datetime] = Field(default=None, nullable=True)
+
+
+class _ClickBucket(SQLModel):
+    short_url: str = Field(nullable=False, primary_key=True)
+    # start of the utc hour or day the clicks fall into, also the partition key.
+    bucket_start: datetime = Field(nullable=False, primary_key=True)
+    country_code: str = Field(nullable=False, max_length=3, primary_key=True)
+
+    counts: int = Field(default=0)
+
+
+class URLClickHourly(_ClickBucket, table=True):
+    # one range partition per day, compacted into urlclickdaily by the rollup.
+    __table_args__ = {"postgresql_partition_by": "RANGE (bucket_start)"}
+
+
+class URLClickDaily(_ClickBucket, table=True):
+    # one range partition per month.
+    __table_args__ = {"postgresql_partition_by": "RANGE (bucket_start)"}
@@ -0,0 +1,116 @@
+import logging
+import re
+import threading
+from datetime import datetime, timedelta
+from typing import Iterable, Literal
+
+from sqlalchemy import exc, text
+from sqlmodel import Session
+
+from app.db import new_session
+from app.models import URLClickDaily, URLClickHourly
+
+LOG = logging.getLogger(__name__)
+
+# no partition for the row (check_violation) or one dropped mid statement.
+_MISSING_PARTITION_CODES = {"23514", "42P01"}
+
+
+class RangePartitions:
+    """Day or month range partitions of a table partitioned on bucket_start.
+
+    Partitions are named `<table>_p<YYYYMMDD>` or `<table>_p<YYYYMM>` after the
+    start of their range, so the range is known from the name alone. Created
+    partitions are remembered per process and never re-checked.
+    """
+
+    def __init__(self, table: str, *, interval: Literal["day", "month"]):
+        self.table = table
+        self.interval = interval
+        self._format = "%Y%m%d" if interval == "day" else "%Y%m"
+        self._pattern = re.compile(rf"^{re.escape(table)}_p(\d+)$")
+
+        self._lock = threading.Lock()
+        self._known: set[datetime] = set()
+
+    def bounds(self, moment: datetime) -> tuple[datetime, datetime]:
+        start = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        if self.interval == "day":
+            return start, start + timedelta(days=1)
+
+        start = start.replace(day=1)
+        return start, (start + timedelta(days=32)).replace(day=1)
+
+    def name(self, start: datetime) -> str:
+        return f"{self.table}_p{start.strftime(self._format)}"
+
+    def ensure(self, moments: Iterable[datetime]) -> int:
+        """Creates the missing partitions covering moments, returns how many."""
+        with self._lock:
+            missing = {self.bounds(moment) for moment in moments}
+            missing = sorted(item for item in missing if item[0] not in self._known)
+
+        created = 0
+        for start, end in missing:
+            # own short transaction, creating a partition locks the parent.
+            try:
+                with new_session() as session, session.begin():
+                    session.exec(
+                        text(
+                            f"CREATE TABLE IF NOT EXISTS {self.name(start)} "
+                            f"PARTITION OF {self.table} FOR VALUES "
+                            f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                        )
+                    )
+                created += 1
+            except exc.IntegrityError:
+                # another process created it at the same time.
+                pass
+
+            with self._lock:
+                self._known.add(start)
+
+        if created:
+            LOG.info(f"ensured {created} partitions of {self.table}.")
+
+        return created
+
+    def existing(self, session: Session) -> list[tuple[str, datetime]]:
+        """Returns (name, range start) of the current partitions, oldest first."""
+        names = session.exec(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                "WHERE parent.relname = :table"
+            ),
+            params={"table": self.table},
+        ).scalars()
+
+        partitions = []
+        for name in names:
+            if match := self._pattern.match(name):
+                partitions.append(
+                    (name, datetime.strptime(match.group(1), self._format))
+                )
+
+        return sorted(partitions, key=lambda item: item[1])
+
+    def drop(self, session: Session, name: str, start: datetime) -> None:
+        session.exec(text(f"DROP TABLE IF EXISTS {name}"))
+        with self._lock:
+            self._known.discard(start)
+
+    def forget(self) -> None:
+        """Rechecks every partition on the next ensure, after a drop elsewhere."""
+        with self._lock:
+            self._known.clear()
+
+
+def is_missing_partition(error: exc.DBAPIError) -> bool:
+    """Whether a write failed on a partition another process dropped."""
+    return getattr(error.orig, "pgcode", None) in _MISSING_PARTITION_CODES
+
+
+hourly_click_partitions = RangePartitions(URLClickHourly.__tablename__, interval="day")
+daily_click_partitions = RangePartitions(URLClickDaily.__tablename__, interval="month")
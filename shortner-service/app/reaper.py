@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Literal
+
+from sqlalchemy import delete, insert, literal, select
+
+from app.cache import RedisCache
+from app.db import SessionContext
+from app.models import URL, URLArchive
+
+LOG = logging.getLogger(__name__)
+
+
+class URLReaper:
+    """Removes expired urls from the url table in small batches.
+
+    In "archive" mode rows are moved to urlarchive, in "delete" mode they are
+    dropped. Each batch is its own short transaction and locks its rows with
+    SKIP LOCKED, so several workers can run a reaper side by side. Reaped codes
+    are deleted from redis and invalidated in every worker.
+    """
+
+    def __init__(
+        self,
+        *,
+        redis_cache: RedisCache,
+        mode: Literal["archive", "delete"] = "archive",
+        batch_size: int = 1000,
+        interval_seconds: float = 60,
+    ):
+        self.cache = redis_cache
+        self.mode = mode
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        # counters, exported through the metrics endpoint.
+        self.reaped = 0
+        self.runs = 0
+        self.failed = 0
+        self.last_run_seconds = 0.0
+
+    def reap(self) -> int:
+        """Reaps until no expired url is left, returns the number reaped."""
+        start = time.monotonic()
+        total = 0
+        while not self._stopping.is_set():
+            short_urls = self.reap_batch()
+            total += len(short_urls)
+            if len(short_urls) < self.batch_size:
+                break
+
+        self.runs += 1
+        self.last_run_seconds = time.monotonic() - start
+        if total:
+            LOG.info(f"reaped {total} expired urls in {self.last_run_seconds:.2f}s.")
+
+        return total
+
+    def reap_batch(self) -> list[str]:
+        now = datetime.now()
+        # served by the partial index on url.expires_at.
+        expired = (
+            select(URL.id)
+            .where(URL.expires_at.is_not(None), URL.expires_at <= now)
+            .order_by(URL.expires_at)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+            .cte("expired")
+        )
+        stmt = delete(URL).where(URL.id == expired.c.id)
+
+        if self.mode == "archive":
+            columns = [column.name for column in URL.__table__.columns]
+            reaped = stmt.returning(*URL.__table__.columns).cte("reaped")
+            stmt = (
+                insert(URLArchive)
+                .from_select(
+                    [*columns, "archived_at"],
+                    select(*[reaped.c[name] for name in columns], literal(now)),
+                )
+                .returning(URLArchive.short_url)
+            )
+        else:
+            stmt = stmt.returning(URL.short_url)
+
+        with SessionContext(with_transaction=True) as session:
+            short_urls = list(session.exec(stmt).scalars())
+
+        # after commit, a redirect racing the delete can't re-cache the url.
+        self.cache.delete_many(short_urls)
+        self.reaped += len(short_urls)
+
+        return short_urls
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="url-reaper", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.interval_seconds):
+            try:
+                self.reap()
+            except Exception:
+                self.failed += 1
+                LOG.exception("url reaper run failed.")
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "reaped": self.reaped,
+            "runs": self.runs,
+            "failed": self.failed,
+            "last_run_seconds": round(self.last_run_seconds, 3),
+        }
@@ -0,0 +1,160 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import text
+
+from app.db import SessionContext, new_session
+from app.models import URLClickDaily
+from app.partitions import daily_click_partitions, hourly_click_partitions
+
+LOG = logging.getLogger(__name__)
+
+# pg advisory lock key, one rollup at a time across consumers.
+ROLLUP_LOCK_ID = 7_301_001
+
+
+def hourly_cutoff(now: datetime, hourly_retention_days: int) -> datetime:
+    """Start of the oldest day kept in hourly buckets, older ones are compacted."""
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=hourly_retention_days)
+
+
+class ClickRollup:
+    """Maintains the partitions of the click bucket tables.
+
+    Every run creates the partitions of the next `precreate_days`, folds hourly
+    partitions older than `hourly_retention_days` into urlclickdaily and drops
+    them, and drops daily partitions older than `daily_retention_days` (0
+    keeps them forever). Each partition is handled in its own transaction
+    under an advisory lock, a run that finds the lock taken stops early.
+    """
+
+    def __init__(
+        self,
+        *,
+        hourly_retention_days: int = 7,
+        daily_retention_days: int = 0,
+        precreate_days: int = 2,
+    ):
+        self.hourly_retention_days = hourly_retention_days
+        self.daily_retention_days = daily_retention_days
+        self.precreate_days = precreate_days
+
+        # counters, exported through the metrics endpoint.
+        self.runs = 0
+        self.compacted = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.last_run_seconds = 0.0
+
+    def run(self, now: Optional[datetime] = None) -> dict:
+        start = time.monotonic()
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+
+        upcoming = [
+            now + timedelta(days=days) for days in range(self.precreate_days + 1)
+        ]
+        hourly_click_partitions.ensure(upcoming)
+        daily_click_partitions.ensure(upcoming)
+
+        with new_session() as session:
+            hourly = hourly_click_partitions.existing(session)
+            daily = daily_click_partitions.existing(session)
+
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        cutoff = hourly_cutoff(now, self.hourly_retention_days)
+        expired = [item for item in hourly if item[1] < cutoff]
+
+        # compaction writes into urlclickdaily, its partitions must exist first.
+        daily_click_partitions.ensure(partition_start for _, partition_start in expired)
+
+        compacted = dropped = 0
+        for name, partition_start in expired:
+            if not self._compact(name, partition_start):
+                break
+            compacted += 1
+
+        if self.daily_retention_days > 0:
+            cutoff = today - timedelta(days=self.daily_retention_days)
+            for name, partition_start in daily:
+                if daily_click_partitions.bounds(partition_start)[1] > cutoff:
+                    break
+                if not self._drop_daily(name, partition_start):
+                    break
+                dropped += 1
+
+        self.runs += 1
+        self.compacted += compacted
+        self.dropped += dropped
+        self.last_run_seconds = time.monotonic() - start
+        if compacted or dropped:
+            LOG.info(
+                f"compacted {compacted} hourly and dropped {dropped} daily click "
+                f"partitions in {self.last_run_seconds:.2f}s."
+            )
+
+        return {"compacted": compacted, "dropped": dropped}
+
+    def _compact(self, name: str, partition_start: datetime) -> bool:
+        with SessionContext(with_transaction=True) as session:
+            if not self._lock(session):
+                return False
+
+            exists = session.exec(
+                text("SELECT to_regclass(:name)"), params={"name": name}
+            ).scalar()
+            if exists is None:
+                # compacted by a run that held the lock before us.
+                return True
+
+            # the consumer adds every click to the day totals as well, so they
+            # are only raised to the hourly sums, never lowered. a partition
+            # holding part of a day, recreated around the cutoff, can't
+            # overwrite the clicks counted there directly.
+            daily = URLClickDaily.__tablename__
+            session.exec(
+                text(
+                    f"INSERT INTO {daily} "
+                    "(short_url, bucket_start, country_code, counts) "
+                    "SELECT short_url, date_trunc('day', bucket_start), "
+                    f"country_code, sum(counts) FROM {name} "
+                    "GROUP BY 1, 2, 3 "
+                    "ON CONFLICT (short_url, bucket_start, country_code) "
+                    f"DO UPDATE SET counts = GREATEST({daily}.counts, excluded.counts)"
+                )
+            )
+            hourly_click_partitions.drop(session, name, partition_start)
+
+        return True
+
+    def _drop_daily(self, name: str, partition_start: datetime) -> bool:
+        with SessionContext(with_transaction=True) as session:
+            if not self._lock(session):
+                return False
+
+            daily_click_partitions.drop(session, name, partition_start)
+
+        return True
+
+    def _lock(self, session) -> bool:
+        locked = session.exec(
+            text("SELECT pg_try_advisory_xact_lock(:lock_id)"),
+            params={"lock_id": ROLLUP_LOCK_ID},
+        ).scalar()
+        if locked:
+            return True
+
+        self.skipped += 1
+        LOG.info("click rollup is running elsewhere, skipping.")
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "compacted": self.compacted,
+            "dropped": self.dropped,
+            "skipped": self.skipped,
+            "last_run_seconds": round(self.last_run_seconds, 3),
+        }
@@ -0,0 +1,14 @@
+from fastapi import APIRouter
+
+from app.dependencies import AdminUser
+from app.metrics import registry
+
+route = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"],
+)
+
+
+@route.get("")
+def get_metrics(_: AdminUser) -> dict[str, dict]:
+    return registry.collect()
@@ -1,16 +1,61 @@
-from fastapi import APIRouter, HTTPException, Query, Request, status
-from fastapi.responses import RedirectResponse
+import io
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator, Literal
+
+from fastapi import (
+    APIRouter,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+    status,
+)
+from fastapi.responses import RedirectResponse, StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.exc import IntegrityError
 
 from app.config import settings
 from app.dependencies import (
+    AsyncSessionDep,
     CurrentUser,
     SessionDep,
+    TrendingDep,
     URLClickCountServiceDep,
+    URLImporterDep,
     URLServiceDep,
 )
-from app.dto import ClickCount, URLIn, URLItem, URLOut
+from app.dto import (
+    DEFAULT_URL_PAGE_SIZE,
+    MAX_URL_PAGE_SIZE,
+    ClickSeriesPoint,
+    ClickStats,
+    ClickStatsCursor,
+    TrendingURL,
+    UniqueVisitorStats,
+    URLBatchIn,
+    URLBatchItemOut,
+    URLBatchOut,
+    URLCursor,
+    URLImportError,
+    URLImportSummary,
+    URLIn,
+    URLItem,
+    URLOut,
+)
 from app.exceptions import NotFound
+from app.service import URLClickCountService, URLService
+
+# errors beyond this are counted but left out of the import response.
+MAX_REPORTED_IMPORT_ERRORS = 1000
+
+MAX_TRENDING_URLS = 100
+
+# days covered by the unique visitors endpoint, by default and at most.
+DEFAULT_VISITOR_DAYS = 7
+MAX_VISITOR_DAYS = 366
 
 urls_route = APIRouter(
     prefix="/urls",
@@ -22,22 +67,63 @@ redirect_route = APIRouter(
     tags=["redirect"],
 )
 
+# used instead of redirect_route when the service runs in async mode.
+async_redirect_route = APIRouter(
+    prefix="",
+    tags=["redirect"],
+)
+
 
 @urls_route.get("")
 def list_urls(
-    request: Request, user: CurrentUser, url_service: URLServiceDep
+    response: Response,
+    user: CurrentUser,
+    url_service: URLServiceDep,
+    limit: int = Query(default=DEFAULT_URL_PAGE_SIZE, ge=1, le=MAX_URL_PAGE_SIZE),
+    cursor: str | None = Query(default=None, description="X-Next-Cursor of a page"),
+    stream: bool = Query(default=False, description="Stream every url as NDJSON"),
 ) -> list[URLItem]:
+    if stream:
+        return StreamingResponse(
+            # user.id is read now, the request session is gone once streaming starts.
+            _stream_urls(url_service, user.id),
+            media_type="application/x-ndjson",
+        )
+
+    try:
+        page_cursor = URLCursor.decode(cursor) if cursor else None
+    except (ValueError, ValidationError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor."
+        )
+
+    urls, next_cursor = url_service.list_urls(
+        user=user, limit=limit, cursor=page_cursor
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor.encode()
+
     url_items = [
         URLItem(
             short_url=f"{settings.base_url}{url.short_url}",
             original_url=url.original_url,
             expires_at=url.expires_at,
         )
-        for url in url_service.list_urls(user=user)
+        for url in urls
     ]
     return url_items
 
 
+def _stream_urls(url_service: URLService, user_id: uuid.UUID) -> Iterator[str]:
+    for short_url, original_url, expires_at in url_service.iter_urls(user_id=user_id):
+        item = URLItem(
+            short_url=f"{settings.base_url}{short_url}",
+            original_url=original_url,
+            expires_at=expires_at,
+        )
+        yield item.model_dump_json() + "\n"
+
+
 @urls_route.post("/shorten")
 def shorten_url(
     url_in: URLIn,
@@ -59,22 +145,187 @@ def shorten_url(
         )
 
 
+@urls_route.post("/shorten/batch")
+def shorten_urls(
+    batch_in: URLBatchIn,
+    session: SessionDep,
+    user: CurrentUser,
+    url_service: URLServiceDep,
+) -> URLBatchOut:
+    short_urls = url_service.shorten_urls(url_data=batch_in.items, user=user)
+
+    results = []
+    for url_in, short_url in zip(batch_in.items, short_urls):
+        if short_url:
+            results.append(URLBatchItemOut(short_url=f"{settings.base_url}{short_url}"))
+        elif url_in.alias:
+            results.append(
+                URLBatchItemOut(
+                    error=f"A short url with alias: {url_in.alias} already exist.",
+                )
+            )
+        else:
+            results.append(
+                URLBatchItemOut(
+                    error="Unable to create short-url, please try again later.",
+                )
+            )
+
+    return URLBatchOut(results=results)
+
+
+@urls_route.post("/import")
+def import_urls(
+    file: UploadFile,
+    session: SessionDep,
+    user: CurrentUser,
+    url_importer: URLImporterDep,
+    fmt: Literal["ndjson", "csv"] | None = Query(
+        default=None, alias="format", description="Defaults to the file extension."
+    ),
+    warm_cache: bool = Query(default=False, description="Pre-populate redis"),
+) -> URLImportSummary:
+    fmt = fmt or ("csv" if Path(file.filename or "").suffix == ".csv" else "ndjson")
+
+    errors: list[URLImportError] = []
+
+    def on_error(error: URLImportError):
+        if len(errors) < MAX_REPORTED_IMPORT_ERRORS:
+            errors.append(error)
+
+    # the upload is spooled to disk, so it is read incrementally from there.
+    summary = url_importer.import_file(
+        io.TextIOWrapper(file.file, encoding="utf-8", newline=""),
+        fmt=fmt,
+        user_id=user.id,
+        on_error=on_error,
+        warm_cache=warm_cache,
+    )
+    summary.errors = errors
+    return summary
+
+
+@urls_route.get("/trending")
+def trending_urls(
+    session: SessionDep,
+    user: CurrentUser,
+    trending: TrendingDep,
+    url_service: URLServiceDep,
+    limit: int = Query(default=20, ge=1, le=MAX_TRENDING_URLS),
+) -> list[TrendingURL]:
+    # the window is shared by everyone, only the caller's own links are listed.
+    top = trending.top(trending.capacity)
+    owned = url_service.owned_short_urls(
+        [short_url for short_url, _ in top], user_id=user.id
+    )
+    return [
+        TrendingURL(short_url=short_url, clicks=clicks)
+        for short_url, clicks in top
+        if short_url in owned
+    ][:limit]
+
+
 @urls_route.get("/stats/{short_url}")
 def click_stats(
     short_url: str,
+    response: Response,
     session: SessionDep,
     user: CurrentUser,
     url_click_count_service: URLClickCountServiceDep,
     limit: int = Query(default=50, ge=1, le=100, description="Page size"),
-    offset: int = Query(default=0, ge=0, description="Offset for pagination"),
-) -> list[ClickCount]:
-    return url_click_count_service.get_stats(
+    cursor: str | None = Query(default=None, description="X-Next-Cursor of a page"),
+    start: datetime | None = Query(default=None, description="Range start"),
+    end: datetime | None = Query(default=None, description="Range end, exclusive"),
+    granularity: Literal["hour", "day"] = Query(
+        default="hour", description="Buckets a range is read from"
+    ),
+) -> ClickStats:
+    try:
+        page_cursor = ClickStatsCursor.decode(cursor) if cursor else None
+    except (ValueError, ValidationError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor."
+        )
+
+    _ensure_owner(url_click_count_service, short_url, user.id)
+
+    # without a range the counts are lifetime totals.
+    stats, next_cursor = url_click_count_service.get_stats(
         short_url=short_url,
-        offset=offset,
         limit=limit,
+        cursor=page_cursor,
+        start=_utc(start),
+        end=_utc(end),
+        granularity=granularity,
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor.encode()
+
+    return stats
+
+
+@urls_route.get("/stats/{short_url}/series")
+def click_series(
+    short_url: str,
+    session: SessionDep,
+    user: CurrentUser,
+    url_click_count_service: URLClickCountServiceDep,
+    start: datetime = Query(description="Range start"),
+    end: datetime = Query(description="Range end, exclusive"),
+    granularity: Literal["hour", "day"] = Query(default="hour"),
+) -> list[ClickSeriesPoint]:
+    _ensure_owner(url_click_count_service, short_url, user.id)
+    return url_click_count_service.get_series(
+        short_url=short_url,
+        start=_utc(start),
+        end=_utc(end),
+        granularity=granularity,
     )
 
 
+@urls_route.get("/stats/{short_url}/visitors")
+def unique_visitors(
+    short_url: str,
+    session: SessionDep,
+    user: CurrentUser,
+    url_click_count_service: URLClickCountServiceDep,
+    start: date | None = Query(default=None, description="First utc day"),
+    end: date | None = Query(default=None, description="Last utc day, inclusive"),
+) -> UniqueVisitorStats:
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - timedelta(days=DEFAULT_VISITOR_DAYS - 1)
+    if not 0 <= (end - start).days < MAX_VISITOR_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"range must cover 1 to {MAX_VISITOR_DAYS} days.",
+        )
+
+    _ensure_owner(url_click_count_service, short_url, user.id)
+    try:
+        return url_click_count_service.get_unique_visitors(
+            short_url, start=start, end=end
+        )
+    except NotFound as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+
+
+def _ensure_owner(
+    url_click_count_service: URLClickCountService, short_url: str, user_id: uuid.UUID
+) -> None:
+    # stats of other users' links are reported as missing.
+    try:
+        url_click_count_service.ensure_owner(short_url, user_id=user_id)
+    except NotFound as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+
+
+def _utc(value: datetime | None) -> datetime | None:
+    # click buckets are stored as naive utc.
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
 @redirect_route.get("/{short_url}")
 def redirect_short_url(
     request: Request,
@@ -83,12 +334,33 @@ def redirect_short_url(
     url_service: URLServiceDep,
 ):
     try:
-        original_url = url_service.un_shorten(short_url=short_url)
+        record = url_service.un_shorten(short_url=short_url)
+
+        # add short url and ip to stream.
+        url_service.record_click(short_url, request.client.host)
+
+        return RedirectResponse(url=record.original_url, status_code=record.status_code)
+    except NotFound as exc:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(exc),
+        )
+
+
+@async_redirect_route.get("/{short_url}")
+async def redirect_short_url_async(
+    request: Request,
+    short_url: str,
+    session: AsyncSessionDep,
+    url_service: URLServiceDep,
+):
+    try:
+        record = await url_service.un_shorten_async(short_url=short_url)
 
         # add short url and ip to stream.
         url_service.record_click(short_url, request.client.host)
 
-        return RedirectResponse(url=original_url, status_code=302)
+        return RedirectResponse(url=record.original_url, status_code=record.status_code)
     except NotFound as exc:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
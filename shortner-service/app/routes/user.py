@@ -1,13 +1,12 @@
 import logging
-from typing import Annotated, Any
+from typing import Any
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, HTTPException, status
 from sqlalchemy.exc import IntegrityError
 
-from app.dependencies import SessionDep, UserServiceDep, get_current_user
+from app.dependencies import CurrentUser, SessionDep, UserServiceDep
 from app.dto import Token, UserCreate, UserLogin, UserOut
 from app.exceptions import NotFound
-from app.models import User
 
 LOG = logging.getLogger(__file__)
 
@@ -35,7 +34,7 @@ def create_user(
 
 
 @route.get("/me", response_model=UserOut)
-def get_user(user: Annotated[User, Depends(get_current_user)]) -> Any:
+def get_user(user: CurrentUser) -> Any:
     return user
 
 
@@ -1,21 +1,84 @@
+import asyncio
+import logging
 import threading
+import time
 import uuid
+from collections import Counter
+from datetime import date, datetime
+from typing import Iterator, Literal, Optional
 
 from hashids import Hashids
-from sqlmodel import select, update
+from redis.exceptions import LockError
+from sqlalchemy import and_, func, or_, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import delete, select, update
 
-from app.cache import RedisCache
-from app.db import CurrentSessionContext
-from app.dto import ClickCount, Token, URLIn, UserCreate, UserLogin
+from app.bloom import BloomFilter
+from app.cache import (
+    AsyncRedisCache,
+    CacheInvalidator,
+    CacheRecord,
+    LocalCache,
+    RedisCache,
+)
+from app.clicks import ClickBuffer, PendingClicks
+from app.db import CurrentAsyncSessionContext, CurrentSessionContext, new_session
+from app.dto import (
+    ClickBucketCount,
+    ClickCount,
+    ClickSeriesPoint,
+    ClickStats,
+    ClickStatsCursor,
+    CountryClicks,
+    DailyVisitors,
+    Token,
+    UniqueVisitorStats,
+    URLCursor,
+    URLIn,
+    UserCreate,
+    UserLogin,
+    UserPrincipal,
+)
 from app.exceptions import NotFound
-from app.models import URL, IDCounter, URLClickCount, User
+from app.models import (
+    URL,
+    IDCounter,
+    URLArchive,
+    URLClickCount,
+    URLClickDaily,
+    URLClickHourly,
+    URLClickSummary,
+    User,
+)
+from app.partitions import daily_click_partitions, hourly_click_partitions
 from app.security import hash_password, validate_password
+from app.singleflight import AsyncSingleFlight, SingleFlight
+from app.visitors import UniqueVisitors
+
+LOG = logging.getLogger(__name__)
 
 
 class UserService:
-    def __init__(self, *, context: CurrentSessionContext):
+    def __init__(
+        self,
+        *,
+        context: CurrentSessionContext,
+        principal_cache: Optional[LocalCache] = None,
+        invalidator: Optional[CacheInvalidator] = None,
+        invalidation_channel: Optional[str] = None,
+    ):
         self.ctx = context
 
+        # authenticated requests resolve their user from here, changes to a
+        # user are fanned out to every worker through the invalidation channel.
+        self.principal_cache = principal_cache
+        self._invalidator = invalidator
+        self._invalidation_channel = invalidation_channel
+        if self.principal_cache and self._invalidator and self._invalidation_channel:
+            self._invalidator.subscribe(
+                self._invalidation_channel, self.principal_cache.pop
+            )
+
     def create_user(self, *, user_data: UserCreate) -> User:
         user = User(
             username=user_data.username,
@@ -41,6 +104,15 @@ class UserService:
         else:
             raise NotFound("Invalid username or password.")
 
+    def get_user_by_username(self, *, username: str) -> User:
+        user = self.ctx.session.exec(
+            select(User).where(User.username == username)
+        ).one_or_none()
+        if user:
+            return user
+        else:
+            raise NotFound(f"User with username: {username} not found.")
+
     def get_user(self, *, user_id: uuid.UUID) -> User:
         user = self.ctx.session.exec(
             select(User).where(User.id == user_id)
@@ -50,43 +122,282 @@ class UserService:
         else:
             raise NotFound(f"User with id: {user_id} not found.")
 
+    def get_principal(self, *, user_id: str) -> UserPrincipal:
+        """Cached view of the user, only a miss reaches postgres."""
+        if self.principal_cache and (principal := self.principal_cache.get(user_id)):
+            return principal
+
+        principal = UserPrincipal.model_validate(self.get_user(user_id=user_id))
+        if self.principal_cache:
+            self.principal_cache.set(user_id, principal)
+
+        return principal
+
+    def set_active(self, *, user_id: uuid.UUID, is_active: bool) -> None:
+        self.ctx.session.exec(
+            update(User)
+            .where(User.id == user_id)
+            .values(is_active=is_active, updated_at=datetime.now())
+        )
+
+        # cached principals must not outlive the commit.
+        self.ctx.on_commit(lambda: self._invalidate_principal(str(user_id)))
+
+    def _invalidate_principal(self, user_id: str) -> None:
+        if self.principal_cache:
+            self.principal_cache.pop(user_id)
+        if self._invalidator and self._invalidation_channel:
+            self._invalidator.publish(self._invalidation_channel, user_id)
+
 
 class CounterService:
+    """Hands out unique ids from blocks reserved in the idcounter table.
+
+    Ids come from an in-memory block, the lock only guards the pointer bump.
+    Once a block is `prefetch_ratio` used, the next one is reserved in the
+    background on its own session, sized so that it lasts roughly
+    `target_block_seconds` at the observed allocation rate.
+    """
+
     def __init__(
-        self, *, key: str, batch_size: int = 1000, context: CurrentSessionContext
+        self,
+        *,
+        key: str,
+        batch_size: int = 1000,
+        max_batch_size: int = 100000,
+        prefetch_ratio: float = 0.8,
+        target_block_seconds: int = 30,
     ):
         self.key: str = key
         self.batch_size: int = batch_size
-        self.ctx = context
+        self.max_batch_size: int = max(max_batch_size, batch_size)
+        self.prefetch_ratio = prefetch_ratio
+        self.target_block_seconds = target_block_seconds
 
-        self._lock = threading.RLock()
+        self._cond = threading.Condition()
+        self._block_start = 0
+        self._block_size = 0
+        self._block_activated_at: float | None = None
         self._max_id = -1
-        self._next_id = None
+        self._next_id = 0
+
+        self._prefetched: tuple[int, int] | None = None
+        self._fetching = False
+
+        # counters, exported through the metrics endpoint.
+        self.prefetches = 0
+        self.blocking_fetches = 0
 
     def get_next_id(self) -> int:
-        with self._lock:
-            if self._next_id is None or self._next_id > self._max_id:
-                self._refill()
+        with self._cond:
+            while self._next_id > self._max_id:
+                self._switch_block()
 
             current_id = self._next_id
             self._next_id += 1
 
+            self._maybe_prefetch()
+
             return current_id
 
-    def _refill(self):
+    def _switch_block(self):
+        # called with the lock held.
+        if self._prefetched is not None:
+            self._activate(*self._prefetched)
+            self._prefetched = None
+            return
+
+        if self._fetching:
+            self._cond.wait()
+            return
+
+        # nothing in flight, fetch on the caller's thread but without the lock.
+        self._fetching = True
+        self.blocking_fetches += 1
+        size = self._next_block_size()
+        self._cond.release()
+        try:
+            block = self._fetch_block(size)
+        finally:
+            self._cond.acquire()
+            self._fetching = False
+            self._cond.notify_all()
+
+        self._prefetched = block
+
+    def _maybe_prefetch(self):
+        # called with the lock held.
+        if self._fetching or self._prefetched is not None:
+            return
+
+        used = self._next_id - self._block_start
+        if used < self.prefetch_ratio * self._block_size:
+            return
+
+        self._fetching = True
+        self.prefetches += 1
+        threading.Thread(
+            target=self._prefetch,
+            args=(self._next_block_size(),),
+            name="id-counter-prefetch",
+            daemon=True,
+        ).start()
+
+    def _prefetch(self, size: int):
+        block = None
+        try:
+            block = self._fetch_block(size)
+        except Exception:
+            # callers fall back to a blocking fetch once the block runs out.
+            LOG.exception("failed to prefetch id block.")
+
+        with self._cond:
+            self._fetching = False
+            self._prefetched = block
+            self._cond.notify_all()
+
+    def _activate(self, start_id: int, max_id: int):
+        self._block_start = start_id
+        self._block_size = max_id - start_id + 1
+        self._block_activated_at = time.monotonic()
+        self._next_id = start_id
+        self._max_id = max_id
+
+    def _next_block_size(self) -> int:
+        if self._block_activated_at is None:
+            return self.batch_size
+
+        elapsed = time.monotonic() - self._block_activated_at
+        used = self._next_id - self._block_start
+        if elapsed <= 0 or used <= 0:
+            return self.batch_size
+
+        size = int(used / elapsed * self.target_block_seconds)
+        return max(self.batch_size, min(size, self.max_batch_size))
+
+    def reserve_ids(self, count: int) -> range:
+        """Reserves a dedicated block of `count` ids in one round trip."""
+        if count <= 0:
+            return range(0)
+
+        start_id, max_id = self._fetch_block(count)
+        return range(start_id, max_id + 1)
+
+    def _fetch_block(self, size: int) -> tuple[int, int]:
         stmt = (
             update(IDCounter)
             .where(IDCounter.key == self.key)
-            .values(next_id=IDCounter.next_id + self.batch_size)
+            .values(next_id=IDCounter.next_id + size)
             .returning(IDCounter.next_id)
         )
-        result = self.ctx.session.exec(stmt).one_or_none()
+
+        # reserved on a session of its own, so the block stays reserved even if
+        # the caller's transaction rolls back.
+        with new_session() as session, session.begin():
+            result = session.exec(stmt).one()
 
         new_next_id = result.next_id
-        start_id = new_next_id - self.batch_size
+        return new_next_id - size, new_next_id - 1
 
-        self._next_id = start_id
-        self._max_id = new_next_id - 1
+    def stats(self) -> dict:
+        return {
+            "block_size": self._block_size,
+            "remaining": max(self._max_id - self._next_id + 1, 0),
+            "prefetches": self.prefetches,
+            "blocking_fetches": self.blocking_fetches,
+        }
+
+
+class CacheWarmer:
+    """Puts redirect mappings into redis before the first request asks for them.
+
+    Covers write-through of newly created urls and preloading the most clicked
+    urls at startup or from the cli.
+    """
+
+    def __init__(
+        self,
+        *,
+        context: CurrentSessionContext,
+        redis_cache: RedisCache,
+        batch_size: int = 1000,
+        cache_ttl_seconds: int = 86400,
+    ):
+        self.ctx = context
+        self.cache = redis_cache
+        self.batch_size = batch_size
+        self.cache_ttl_seconds = cache_ttl_seconds
+
+        # counters, exported through the metrics endpoint.
+        self.write_through_keys = 0
+        self.write_through_seconds = 0.0
+        self.warmup_keys = 0
+        self.warmup_seconds = 0.0
+
+    def write_through(self, records: dict[str, CacheRecord]) -> None:
+        start = time.monotonic()
+        written = self.cache.set_many(records, self.cache_ttl_seconds)
+
+        self.write_through_keys += written
+        self.write_through_seconds += time.monotonic() - start
+
+    def warm_top_urls(self, top_n: int) -> int:
+        """Loads the `top_n` most clicked urls into redis, returns the count."""
+        start = time.monotonic()
+        totals = (
+            select(
+                URLClickCount.short_url,
+                func.sum(URLClickCount.counts).label("total"),
+            )
+            .group_by(URLClickCount.short_url)
+            .order_by(func.sum(URLClickCount.counts).desc())
+            .limit(top_n)
+            .subquery()
+        )
+        loaded = self._warm(
+            self._live_urls().join(totals, totals.c.short_url == URL.short_url)
+        )
+
+        self.warmup_keys = loaded
+        self.warmup_seconds = time.monotonic() - start
+        LOG.info(f"cache warmed with {loaded} urls in {self.warmup_seconds:.2f}s.")
+        return loaded
+
+    def warm_urls(self, short_urls: list[str]) -> int:
+        """Loads the given urls into redis, returns the count."""
+        return self._warm(self._live_urls().where(URL.short_url.in_(short_urls)))
+
+    def _live_urls(self):
+        return (
+            select(URL.short_url, URL.original_url, URL.expires_at, URL.created_by)
+            .where(URL.is_active)
+            .where(or_(URL.expires_at.is_(None), URL.expires_at > datetime.now()))
+            .execution_options(yield_per=self.batch_size)
+        )
+
+    def _warm(self, stmt) -> int:
+        loaded = 0
+        for rows in self.ctx.session.exec(stmt).partitions():
+            # one pipelined round trip per partition.
+            loaded += self.cache.set_many(
+                {
+                    short_url: CacheRecord.of(
+                        original_url, expires_at=expires_at, owner_id=created_by
+                    )
+                    for short_url, original_url, expires_at, created_by in rows
+                },
+                self.cache_ttl_seconds,
+            )
+
+        return loaded
+
+    def stats(self) -> dict:
+        return {
+            "write_through_keys": self.write_through_keys,
+            "write_through_seconds": round(self.write_through_seconds, 3),
+            "warmup_keys": self.warmup_keys,
+            "warmup_seconds": round(self.warmup_seconds, 3),
+        }
 
 
 class URLService:
@@ -98,7 +409,18 @@ class URLService:
         min_hash_len: int = 6,
         context: CurrentSessionContext,
         redis_cache: RedisCache,
-        clicks_topic: str,
+        click_buffer: ClickBuffer,
+        negative_cache: Optional[LocalCache] = None,
+        bloom_filter: Optional[BloomFilter] = None,
+        async_cache: Optional[AsyncRedisCache] = None,
+        async_context: Optional[CurrentAsyncSessionContext] = None,
+        cache_warmer: Optional[CacheWarmer] = None,
+        single_flight: Optional[SingleFlight] = None,
+        async_single_flight: Optional[AsyncSingleFlight] = None,
+        fill_lock_timeout_ms: Optional[int] = None,
+        fill_lock_wait_ms: int = 200,
+        cache_ttl_seconds: int = 86400,
+        click_counts: Optional["URLClickCountService"] = None,
     ):
         self.counter_service = counter_service
         self.hash_id_secret = hash_id_secret
@@ -106,8 +428,32 @@ class URLService:
         self.ctx = context
 
         # for tracking redirect counts.
-        self.clicks_topic = clicks_topic
+        self.click_buffer = click_buffer
         self.cache: RedisCache = redis_cache
+        self.cache_warmer = cache_warmer
+        self.cache_ttl_seconds = cache_ttl_seconds
+        # forgets the clicks of a reused code when it is created again.
+        self.click_counts = click_counts
+
+        # only set when the redirect path runs in async mode.
+        self.async_cache = async_cache
+        self.async_ctx = async_context
+
+        # remembers unknown short codes so that scanners and typos don't reach
+        # postgres. both are per process and kept in sync through invalidations.
+        self.negative_cache = negative_cache
+        self.bloom_filter = bloom_filter
+        self.cache.add_invalidation_handler(self._on_short_url_changed)
+
+        # coalesces concurrent cache misses of the same code into one lookup,
+        # within the process and, with the fill lock, across workers.
+        self.single_flight = single_flight
+        self.async_single_flight = async_single_flight
+        self.fill_lock_timeout_ms = fill_lock_timeout_ms
+        self.fill_lock_wait_ms = fill_lock_wait_ms
+        self.fill_lock_acquired = 0
+        self.fill_lock_waits = 0
+        self.fill_lock_wait_hits = 0
 
         self.hashids = Hashids(
             salt=self.hash_id_secret,
@@ -115,11 +461,59 @@ class URLService:
             alphabet="abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789",
         )
 
-    def list_urls(self, *, user: User) -> list[URL]:
-        urls = self.ctx.session.exec(select(URL).where(URL.created_by == user.id))
-        return urls
+    def list_urls(
+        self, *, user: UserPrincipal, limit: int, cursor: Optional[URLCursor] = None
+    ) -> tuple[list[URL], Optional[URLCursor]]:
+        """Returns a page of the user's urls, newest first, and the next cursor."""
+        query = select(URL).where(URL.created_by == user.id)
+        if cursor:
+            # row comparison, so postgres can seek straight into the index.
+            query = query.where(
+                tuple_(URL.created_at, URL.id) < tuple_(cursor.created_at, cursor.id)
+            )
+
+        # one extra row tells whether there is a next page.
+        urls = list(
+            self.ctx.session.exec(
+                query.order_by(URL.created_at.desc(), URL.id.desc()).limit(limit + 1)
+            )
+        )
+        if len(urls) <= limit:
+            return urls, None
+
+        urls = urls[:limit]
+        return urls, URLCursor(created_at=urls[-1].created_at, id=urls[-1].id)
+
+    def iter_urls(
+        self, *, user_id: uuid.UUID, batch_size: int = 1000
+    ) -> Iterator[tuple[str, str, Optional[datetime]]]:
+        """Streams (short_url, original_url, expires_at) of all the user's urls.
+
+        Rows come from a server-side cursor `batch_size` at a time. The stream
+        outlives the request's session, so it runs on a session of its own.
+        """
+        query = (
+            select(URL.short_url, URL.original_url, URL.expires_at)
+            .where(URL.created_by == user_id)
+            .order_by(URL.created_at.desc(), URL.id.desc())
+            .execution_options(yield_per=batch_size)
+        )
+        with new_session() as session:
+            yield from session.exec(query)
+
+    def owned_short_urls(
+        self, short_urls: list[str], *, user_id: uuid.UUID
+    ) -> set[str]:
+        """Returns the short urls among `short_urls` the user created."""
+        if not short_urls:
+            return set()
+
+        stmt = select(URL.short_url).where(
+            URL.short_url.in_(short_urls), URL.created_by == user_id
+        )
+        return set(self.ctx.session.exec(stmt))
 
-    def shorten_url(self, *, url_data: URLIn, user: User) -> str:
+    def shorten_url(self, *, url_data: URLIn, user: UserPrincipal) -> str:
         if url_data.alias:
             short_url = url_data.alias
         else:
@@ -136,30 +530,268 @@ class URLService:
 
         # flush is done to quickly identify any integrity error.
         self.ctx.session.flush()
+        if self.click_counts:
+            self.click_counts.reset_click_history([short_url])
+
+        # only cache and announce the code once it is visible to other
+        # transactions, otherwise a concurrent lookup could cache it as missing.
+        created = {short_url: self._cache_record(url)}
+        self.ctx.on_commit(lambda: self._publish_created(created))
 
         return short_url
 
-    def un_shorten(self, short_url: str) -> str:
-        # if the short code is cached, return it from there.
-        if original_url := self.cache.get(key=short_url):
-            return original_url
+    def shorten_urls(
+        self, *, url_data: list[URLIn], user: UserPrincipal
+    ) -> list[str | None]:
+        """Creates many short urls with a single INSERT.
+
+        Returns the short url of every item in input order, None for items whose
+        short url already exists (or repeats an alias earlier in the batch).
+        """
+        # one id block for the whole batch instead of one counter call per item.
+        ids = iter(
+            self.counter_service.reserve_ids(
+                sum(1 for item in url_data if not item.alias)
+            )
+        )
+
+        short_urls: list[str | None] = []
+        rows = []
+        seen = set()
+        for item in url_data:
+            short_url = item.alias or self.hashids.encode(next(ids))
+            if short_url in seen:
+                short_urls.append(None)
+                continue
+
+            seen.add(short_url)
+            short_urls.append(short_url)
+            url = URL(
+                original_url=item.original_url,
+                short_url=short_url,
+                created_by=user.id,
+                expires_at=item.expires_in,
+            )
+            rows.append(url)
+
+        stmt = (
+            insert(URL)
+            .values([row.model_dump() for row in rows])
+            .on_conflict_do_nothing(index_elements=[URL.short_url])
+            .returning(URL.short_url)
+        )
+        created = set(self.ctx.session.exec(stmt).scalars())
+        if self.click_counts:
+            self.click_counts.reset_click_history(sorted(created))
+
+        # warm the redirect cache and announce the codes once they are visible.
+        records = {
+            row.short_url: self._cache_record(row)
+            for row in rows
+            if row.short_url in created
+        }
+        self.ctx.on_commit(lambda: self._publish_created(records))
+
+        return [short_url if short_url in created else None for short_url in short_urls]
+
+    def _publish_created(self, records: dict[str, CacheRecord]) -> None:
+        # write-through, so the first redirect of a new url is a cache hit.
+        if self.cache_warmer:
+            self.cache_warmer.write_through(records)
+        else:
+            self.cache.set_many(records, self.cache_ttl_seconds)
+        self.cache.invalidate_many(list(records))
+
+    @staticmethod
+    def _cache_record(url: URL) -> CacheRecord:
+        return CacheRecord.of(
+            url.original_url,
+            expires_at=url.expires_at,
+            is_active=url.is_active,
+            owner_id=url.created_by,
+        )
+
+    def un_shorten(self, short_url: str) -> CacheRecord:
+        self._reject_known_missing(short_url)
+
+        # if the short code is cached, the record alone decides the redirect.
+        if record := self.cache.get(key=short_url):
+            return self._check_live(short_url, record)
+
+        self._reject_never_created(short_url)
+
+        if self.single_flight:
+            return self.single_flight.do(short_url, lambda: self._fill(short_url))
+        return self._fill(short_url)
 
+    def _fill(self, short_url: str) -> CacheRecord:
+        if not self.fill_lock_timeout_ms:
+            return self._load(short_url)
+
+        lock = self.cache.fill_lock(short_url, self.fill_lock_timeout_ms / 1000)
+        if not lock.acquire():
+            # another worker is loading it, its result lands in redis shortly.
+            self.fill_lock_waits += 1
+            deadline = time.monotonic() + self.fill_lock_wait_ms / 1000
+            while time.monotonic() < deadline:
+                time.sleep(0.01)
+                if record := self.cache.get(key=short_url):
+                    self.fill_lock_wait_hits += 1
+                    return self._check_live(short_url, record)
+
+            return self._load(short_url)
+
+        self.fill_lock_acquired += 1
+        try:
+            return self._load(short_url)
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                # expired while loading, someone else may hold it by now.
+                pass
+
+    def _load(self, short_url: str) -> CacheRecord:
         urls = self.ctx.session.exec(select(URL).where(URL.short_url == short_url))
 
         try:
             (url,) = urls
+        except ValueError:
+            self._remember_missing(short_url)
+            raise NotFound(f"Invalid short-url: {short_url}")
+
+        # cached only until the url expires, expired or inactive urls not at all.
+        record = self._cache_record(url)
+        if not (ttl := record.ttl(self.cache_ttl_seconds)):
+            self._remember_missing(short_url)
+            raise NotFound(f"Invalid short-url: {short_url}")
+
+        self.cache.set(key=short_url, record=record, expire_seconds=ttl)
+        return record
+
+    async def un_shorten_async(self, short_url: str) -> CacheRecord:
+        """Same as un_shorten, but on the async redis client and db session."""
+        self._reject_known_missing(short_url)
+
+        if record := await self.async_cache.get(key=short_url):
+            return self._check_live(short_url, record)
+
+        self._reject_never_created(short_url)
+
+        if self.async_single_flight:
+            return await self.async_single_flight.do(
+                short_url, lambda: self._fill_async(short_url)
+            )
+        return await self._fill_async(short_url)
+
+    async def _fill_async(self, short_url: str) -> CacheRecord:
+        if not self.fill_lock_timeout_ms:
+            return await self._load_async(short_url)
+
+        lock = self.async_cache.fill_lock(short_url, self.fill_lock_timeout_ms / 1000)
+        if not await lock.acquire():
+            self.fill_lock_waits += 1
+            deadline = time.monotonic() + self.fill_lock_wait_ms / 1000
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+                if record := await self.async_cache.get(key=short_url):
+                    self.fill_lock_wait_hits += 1
+                    return self._check_live(short_url, record)
+
+            return await self._load_async(short_url)
 
-            # cache the mapping for future use.
-            self.cache.set(key=short_url, value=url.original_url)
+        self.fill_lock_acquired += 1
+        try:
+            return await self._load_async(short_url)
+        finally:
+            try:
+                await lock.release()
+            except LockError:
+                pass
+
+    async def _load_async(self, short_url: str) -> CacheRecord:
+        urls = await self.async_ctx.session.exec(
+            select(URL).where(URL.short_url == short_url)
+        )
 
-            return url.original_url
+        try:
+            (url,) = urls
         except ValueError:
+            self._remember_missing(short_url)
+            raise NotFound(f"Invalid short-url: {short_url}")
+
+        record = self._cache_record(url)
+        if not (ttl := record.ttl(self.cache_ttl_seconds)):
+            self._remember_missing(short_url)
+            raise NotFound(f"Invalid short-url: {short_url}")
+
+        await self.async_cache.set(key=short_url, record=record, expire_seconds=ttl)
+        return record
+
+    def _check_live(self, short_url: str, record: CacheRecord) -> CacheRecord:
+        # the local tier can outlive a record's expiry by up to its own TTL.
+        if not record.is_live():
             raise NotFound(f"Invalid short-url: {short_url}")
+        return record
+
+    def cache_fill_stats(self) -> dict:
+        stats = {
+            "fill_lock_acquired": self.fill_lock_acquired,
+            "fill_lock_waits": self.fill_lock_waits,
+            "fill_lock_wait_hits": self.fill_lock_wait_hits,
+        }
+        for name, single_flight in (
+            ("single_flight", self.single_flight),
+            ("async_single_flight", self.async_single_flight),
+        ):
+            if single_flight:
+                stats[name] = single_flight.stats()
+
+        return stats
+
+    def _reject_known_missing(self, short_url: str) -> None:
+        # codes that recently missed are rejected without touching redis/postgres.
+        if self.negative_cache and self.negative_cache.get(short_url):
+            raise NotFound(f"Invalid short-url: {short_url}")
+
+    def _reject_never_created(self, short_url: str) -> None:
+        # a bloom filter miss proves the code was never created.
+        if self.bloom_filter is not None and short_url not in self.bloom_filter:
+            self._remember_missing(short_url)
+            raise NotFound(f"Invalid short-url: {short_url}")
+
+    def load_bloom_filter(self) -> int:
+        """(Re)builds the bloom filter from every existing short code.
+
+        Returns the number of codes loaded. Codes announced meanwhile are kept.
+        """
+        if self.bloom_filter is None:
+            return 0
+
+        start = time.monotonic()
+        stmt = select(URL.short_url).execution_options(yield_per=10000)
+        loaded = self.bloom_filter.rebuild(self.ctx.session.exec(stmt))
+
+        LOG.info(
+            f"bloom filter loaded with {loaded} short urls "
+            f"in {time.monotonic() - start:.2f}s."
+        )
+        return loaded
+
+    def _remember_missing(self, short_url: str) -> None:
+        if self.negative_cache:
+            self.negative_cache.set(short_url, True)
+
+    def _on_short_url_changed(self, short_url: str) -> None:
+        if self.negative_cache:
+            self.negative_cache.pop(short_url)
+        if self.bloom_filter is not None:
+            self.bloom_filter.add(short_url)
 
     def record_click(self, short_url, request_ip: str):
-        self.cache.produce_to_topic(
-            self.clicks_topic,
-            message={
+        # never blocks, the buffer is flushed to the stream in the background.
+        self.click_buffer.put(
+            {
                 "short_url": short_url,
                 "request_ip": request_ip,
             },
@@ -167,38 +799,326 @@ class URLService:
 
 
 class URLClickCountService:
-    def __init__(self, *, context: CurrentSessionContext):
+    def __init__(
+        self,
+        *,
+        context: CurrentSessionContext,
+        unique_visitors: Optional[UniqueVisitors] = None,
+        pending_clicks: Optional[PendingClicks] = None,
+    ):
         self.ctx = context
+        self.unique_visitors = unique_visitors
+        self.pending_clicks = pending_clicks
+
+    def settle_pending_clicks(self, counts: dict[tuple[str, str], int]) -> None:
+        """Takes committed clicks out of the real-time deltas."""
+        if self.pending_clicks:
+            self.pending_clicks.settle(counts)
+
+    def add_unique_visitors(self, visitors: dict[tuple[str, date], set[str]]) -> None:
+        if self.unique_visitors:
+            self.unique_visitors.add_many(visitors)
+
+    def get_unique_visitors(
+        self, short_url: str, *, start: date, end: date
+    ) -> UniqueVisitorStats:
+        """Approximate unique visitors over the utc days [start, end]."""
+        if not self.unique_visitors:
+            raise NotFound("unique visitor counts are not enabled.")
+
+        return UniqueVisitorStats(
+            short_url=short_url,
+            start=start,
+            end=end,
+            unique_visitors=self.unique_visitors.count(short_url, start=start, end=end),
+            days=[
+                DailyVisitors(day=day, unique_visitors=count)
+                for day, count in self.unique_visitors.count_per_day(
+                    short_url, start=start, end=end
+                )
+            ],
+        )
 
     def increment_counts(self, records: list[ClickCount]) -> None:
+        if not records:
+            return
+
+        # one multi-row upsert per batch. records must be unique per
+        # (short_url, country_code), which _aggregate_records guarantees.
+        stmt = insert(URLClickCount).values(
+            [record.model_dump() for record in records],
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[URLClickCount.short_url, URLClickCount.country_code],
+            set_={"counts": URLClickCount.counts + stmt.excluded.counts},
+        )
+        self.ctx.session.exec(stmt)
+
+        totals = Counter()
         for record in records:
-            stmt = select(URLClickCount).where(
-                URLClickCount.short_url == record.short_url,
-                URLClickCount.country_code == URLClickCount.country_code,
+            totals[record.short_url] += record.counts
+
+        # sorted, so concurrent consumers lock the summary rows in one order.
+        stmt = insert(URLClickSummary).values(
+            [
+                {
+                    "short_url": short_url,
+                    "total_clicks": totals[short_url],
+                    "last_clicked_at": func.now(),
+                }
+                for short_url in sorted(totals)
+            ],
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[URLClickSummary.short_url],
+            set_={
+                "total_clicks": URLClickSummary.total_clicks
+                + stmt.excluded.total_clicks,
+                "last_clicked_at": stmt.excluded.last_clicked_at,
+            },
+        )
+        self.ctx.session.exec(stmt)
+
+    def increment_buckets(
+        self, *, hourly: list[ClickBucketCount], daily: list[ClickBucketCount]
+    ) -> None:
+        # partitions first, creating one inside this transaction would hold the
+        # parent's lock until commit.
+        hourly_click_partitions.ensure(record.bucket_start for record in hourly)
+        daily_click_partitions.ensure(record.bucket_start for record in daily)
+
+        for model, records in ((URLClickHourly, hourly), (URLClickDaily, daily)):
+            if not records:
+                continue
+
+            stmt = insert(model).values([record.model_dump() for record in records])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[
+                    model.short_url,
+                    model.bucket_start,
+                    model.country_code,
+                ],
+                set_={"counts": model.counts + stmt.excluded.counts},
+            )
+            self.ctx.session.exec(stmt)
+
+    def ensure_owner(self, short_url: str, *, user_id: uuid.UUID) -> None:
+        """Raises NotFound unless the user owns the short url.
+
+        The live url decides. Without one, the latest archived url does, its
+        click history is kept after reaping.
+        """
+        owner = self.ctx.session.exec(
+            select(URL.created_by).where(URL.short_url == short_url)
+        ).first()
+        if owner is None:
+            owner = self.ctx.session.exec(
+                select(URLArchive.created_by)
+                .where(URLArchive.short_url == short_url)
+                .order_by(URLArchive.archived_at.desc())
+                .limit(1)
+            ).first()
+
+        if owner != user_id:
+            raise NotFound(f"short url: {short_url} not found.")
+
+    def reset_click_history(self, short_urls: list[str]) -> list[str]:
+        """Forgets the clicks of re-created short urls, returns the ones reset.
+
+        Click rows are keyed by the short url alone and outlive reaped urls, a
+        re-created code would otherwise inherit the clicks of its predecessor.
+        Every committed click batch writes the summary row, so codes without
+        one have nothing to forget.
+        """
+        if not short_urls:
+            return []
+
+        reset = list(
+            self.ctx.session.exec(
+                delete(URLClickSummary)
+                .where(URLClickSummary.short_url.in_(short_urls))
+                .returning(URLClickSummary.short_url)
+            ).scalars()
+        )
+        if not reset:
+            return []
+
+        for model in (URLClickCount, URLClickHourly, URLClickDaily):
+            self.ctx.session.exec(delete(model).where(model.short_url.in_(reset)))
+
+        self.ctx.on_commit(lambda: self._reset_redis_counts(reset))
+        return reset
+
+    def _reset_redis_counts(self, short_urls: list[str]) -> None:
+        if self.pending_clicks:
+            self.pending_clicks.clear(short_urls)
+        if self.unique_visitors:
+            self.unique_visitors.clear(short_urls)
+
+    def get_stats(
+        self,
+        short_url: str,
+        *,
+        limit: int,
+        cursor: Optional[ClickStatsCursor] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        granularity: Literal["hour", "day"] = "hour",
+    ) -> tuple[ClickStats, Optional[ClickStatsCursor]]:
+        """Total clicks and a page of countries, most clicked first.
+
+        Lifetime stats read the summary row and the (short_url, counts) index,
+        and include the clicks still on their way through the stream when
+        pending clicks are tracked. Range stats sum the [start, end) buckets.
+        """
+        pending = {}
+        if start is None and end is None:
+            total, counts = self._lifetime_counts(short_url, limit + 1, cursor)
+            if self.pending_clicks:
+                pending = self.pending_clicks.get(short_url)
+                total += sum(pending.values())
+        else:
+            total, counts = self._range_counts(
+                short_url, limit + 1, cursor, _bucket_model(granularity), start, end
+            )
+
+        if pending and len(counts) <= limit:
+            # past the last committed row, pending only countries follow as
+            # rows of 0 committed clicks.
+            counts += self._pending_only(short_url, pending, cursor)
+
+        next_cursor = None
+        if len(counts) > limit:
+            counts = counts[:limit]
+            next_cursor = ClickStatsCursor(
+                counts=counts[-1][1], country_code=counts[-1][0]
+            )
+
+        # deltas are added to the page, its order is the committed one.
+        countries = [
+            CountryClicks(
+                country_code=country_code,
+                counts=count + pending.get(country_code, 0),
             )
-            row = self.ctx.session.exec(stmt).one_or_none()
-            if row:
-                row.counts += record.counts
-            else:
-                row = URLClickCount(
-                    short_url=record.short_url,
-                    country_code=record.country_code,
-                    counts=record.counts,
+            for country_code, count in counts
+        ]
+
+        stats = ClickStats(short_url=short_url, total=total, countries=countries)
+        return stats, next_cursor
+
+    def _pending_only(
+        self,
+        short_url: str,
+        pending: dict[str, int],
+        cursor: Optional[ClickStatsCursor],
+    ) -> list[tuple[str, int]]:
+        committed = set(
+            self.ctx.session.exec(
+                select(URLClickCount.country_code).where(
+                    URLClickCount.short_url == short_url,
+                    URLClickCount.country_code.in_(list(pending)),
                 )
-            self.ctx.session.add(row)
+            )
+        )
+        return [
+            (country_code, 0)
+            for country_code in sorted(pending)
+            if country_code not in committed
+            and (
+                cursor is None
+                or cursor.counts > 0
+                or country_code > cursor.country_code
+            )
+        ]
+
+    def _lifetime_counts(
+        self, short_url: str, limit: int, cursor: Optional[ClickStatsCursor]
+    ) -> tuple[int, list[tuple[str, int]]]:
+        summary = self.ctx.session.get(URLClickSummary, short_url)
 
-    def get_stats(self, short_url: str, offset: int, limit: int) -> list[ClickCount]:
         stmt = (
-            select(URLClickCount)
+            select(URLClickCount.country_code, URLClickCount.counts)
             .where(URLClickCount.short_url == short_url)
-            .offset(offset)
+            .order_by(URLClickCount.counts.desc(), URLClickCount.country_code)
             .limit(limit)
         )
+        if cursor:
+            stmt = stmt.where(
+                _after(URLClickCount.counts, URLClickCount.country_code, cursor)
+            )
+
+        total = summary.total_clicks if summary else 0
+        return total, list(self.ctx.session.exec(stmt).all())
+
+    def _range_counts(
+        self,
+        short_url: str,
+        limit: int,
+        cursor: Optional[ClickStatsCursor],
+        model: type[URLClickHourly] | type[URLClickDaily],
+        start: Optional[datetime],
+        end: Optional[datetime],
+    ) -> tuple[int, list[tuple[str, int]]]:
+        conditions = _bucket_range(model, short_url, start, end)
+        counts = func.sum(model.counts)
+        stmt = (
+            select(model.country_code, counts)
+            .where(*conditions)
+            .group_by(model.country_code)
+            .order_by(counts.desc(), model.country_code)
+            .limit(limit)
+        )
+        if cursor:
+            stmt = stmt.having(_after(counts, model.country_code, cursor))
+
+        total = self.ctx.session.exec(
+            select(func.coalesce(func.sum(model.counts), 0)).where(*conditions)
+        ).one()
+        return int(total), [
+            (country_code, int(count))
+            for country_code, count in self.ctx.session.exec(stmt)
+        ]
+
+    def get_series(
+        self,
+        short_url: str,
+        *,
+        start: datetime,
+        end: datetime,
+        granularity: Literal["hour", "day"] = "hour",
+    ) -> list[ClickSeriesPoint]:
+        """Clicks per hour or day within [start, end), all countries summed."""
+        model = _bucket_model(granularity)
+        stmt = (
+            select(model.bucket_start, func.sum(model.counts))
+            .where(*_bucket_range(model, short_url, start, end))
+            .group_by(model.bucket_start)
+            .order_by(model.bucket_start)
+        )
+
+        return [
+            ClickSeriesPoint(bucket_start=bucket_start, counts=counts)
+            for bucket_start, counts in self.ctx.session.exec(stmt)
+        ]
+
+
+def _after(counts, country_code, cursor: ClickStatsCursor):
+    # keyset condition for (counts desc, country_code asc) order.
+    return or_(
+        counts < cursor.counts,
+        and_(counts == cursor.counts, country_code > cursor.country_code),
+    )
+
 
-        results = self.ctx.session.exec(stmt).fetchall()
+def _bucket_model(granularity: str) -> type[URLClickHourly] | type[URLClickDaily]:
+    return URLClickHourly if granularity == "hour" else URLClickDaily
 
-        return_value = []
-        for result in results:
-            return_value.append(ClickCount(**result.model_dump()))
 
-        return return_value
+def _bucket_range(model, short_url, start, end) -> list:
+    # bounds on bucket_start, the partition key, prune the other partitions.
+    conditions = [model.short_url == short_url]
+    if start is not None:
+        conditions.append(model.bucket_start >= start)
+    if end is not None:
+        conditions.append(model.bucket_start < end)
+    return conditions
@@ -0,0 +1,211 @@
+import heapq
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Iterable, Optional
+
+import redis
+
+from app.cache import RedisCache
+from app.config import Settings
+from app.db import SessionContext
+from app.service import CacheWarmer
+
+LOG = logging.getLogger(__name__)
+
+
+class SpaceSaving:
+    """Heavy hitters of a stream in at most `capacity` counters.
+
+    Every key seen more than total / capacity times is guaranteed to be kept.
+    A new key replaces the smallest counter and inherits its count, so counts
+    overestimate by at most that minimum.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.total = 0
+
+        self._counts: dict[str, int] = {}
+        # lazy min-heap, entries whose count is outdated are skipped on pop.
+        self._heap: list[tuple[int, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def offer(self, key: str, count: int = 1) -> None:
+        self.total += count
+        if key in self._counts:
+            self._counts[key] += count
+        elif len(self._counts) < self.capacity:
+            self._counts[key] = count
+        else:
+            self._counts[key] = self._evict_min() + count
+
+        heapq.heappush(self._heap, (self._counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, key) for key, count in self._counts.items()]
+            heapq.heapify(self._heap)
+
+    def _evict_min(self) -> int:
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self._counts.get(key) == count:
+                del self._counts[key]
+                return count
+
+    def top(self, k: Optional[int] = None) -> list[tuple[str, int]]:
+        items = sorted(self._counts.items(), key=lambda item: item[1], reverse=True)
+        return items if k is None else items[:k]
+
+
+class TrendingLinks:
+    """Sliding window top-K of clicked short codes, shared through redis.
+
+    Each click consumer counts its clicks in a SpaceSaving sketch and every
+    `flush_seconds` adds the sketch to the sorted set of the current
+    `slot_seconds` slot. Readers merge the slots of the last `window_seconds`,
+    so memory is bounded by consumers x capacity per slot.
+    """
+
+    PREFIX = "trending:"
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        *,
+        capacity: int = 1000,
+        slot_seconds: int = 60,
+        window_seconds: int = 900,
+        flush_seconds: int = 10,
+    ):
+        self.client = client
+        self.capacity = capacity
+        self.slot_seconds = slot_seconds
+        self.window_seconds = window_seconds
+        self.flush_seconds = flush_seconds
+
+        self._sketch = SpaceSaving(capacity)
+        self._last_flush = time.monotonic()
+
+    @classmethod
+    def from_settings(cls, client: redis.Redis, settings: Settings) -> "TrendingLinks":
+        return cls(
+            client,
+            capacity=settings.trending_capacity,
+            slot_seconds=settings.trending_slot_seconds,
+            window_seconds=settings.trending_window_seconds,
+            flush_seconds=settings.trending_flush_seconds,
+        )
+
+    def record(self, short_urls: Iterable[str]) -> None:
+        # counted per batch first, a code clicked n times is one offer.
+        for short_url, count in Counter(short_urls).items():
+            self._sketch.offer(short_url, count)
+
+    def flush(self, force: bool = False) -> int:
+        """Publishes the sketch once `flush_seconds` have passed."""
+        if not force and time.monotonic() - self._last_flush < self.flush_seconds:
+            return 0
+
+        sketch, self._sketch = self._sketch, SpaceSaving(self.capacity)
+        self._last_flush = time.monotonic()
+        if not len(sketch):
+            return 0
+
+        key = self._slot_key(int(time.time()) // self.slot_seconds)
+        pipeline = self.client.pipeline(transaction=False)
+        for short_url, count in sketch.top():
+            pipeline.zincrby(key, count, short_url)
+        pipeline.expire(key, self.window_seconds + self.slot_seconds)
+        pipeline.execute()
+
+        return len(sketch)
+
+    def top(self, limit: int) -> list[tuple[str, int]]:
+        """Most clicked codes of the window, with their approximate clicks."""
+        slot = int(time.time()) // self.slot_seconds
+        keys = [
+            self._slot_key(slot - offset)
+            for offset in range(-(-self.window_seconds // self.slot_seconds))
+        ]
+
+        merged = self.client.zunion(keys, withscores=True)
+        # zunion is ordered by ascending score.
+        return [(short_url, int(score)) for short_url, score in merged[::-1][:limit]]
+
+    def _slot_key(self, slot: int) -> str:
+        return f"{self.PREFIX}{slot}"
+
+
+class HotKeyRefresher:
+    """Keeps the trending codes in redis and in this worker's local tier.
+
+    Every `interval_seconds` the top `top_n` codes are read from redis into
+    the local tier, codes missing from redis are loaded by the cache warmer.
+    The interval should stay below the local tier's ttl.
+    """
+
+    def __init__(
+        self,
+        *,
+        trending: TrendingLinks,
+        redis_cache: RedisCache,
+        cache_warmer: CacheWarmer,
+        top_n: int = 100,
+        interval_seconds: float = 30,
+    ):
+        self.trending = trending
+        self.cache = redis_cache
+        self.cache_warmer = cache_warmer
+        self.top_n = top_n
+        self.interval_seconds = interval_seconds
+
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        # counters, exported through the metrics endpoint.
+        self.runs = 0
+        self.failed = 0
+        self.prefetched = 0
+        self.warmed = 0
+
+    def refresh(self) -> int:
+        short_urls = [short_url for short_url, _ in self.trending.top(self.top_n)]
+        missing = self.cache.prefetch(short_urls)
+        if missing:
+            with SessionContext(with_transaction=False):
+                self.warmed += self.cache_warmer.warm_urls(missing)
+
+        self.runs += 1
+        self.prefetched += len(short_urls) - len(missing)
+        return len(short_urls)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="hot-key-refresher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.interval_seconds):
+            try:
+                self.refresh()
+            except Exception:
+                self.failed += 1
+                LOG.exception("hot key refresh failed.")
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "failed": self.failed,
+            "prefetched": self.prefetched,
+            "warmed": self.warmed,
+        }
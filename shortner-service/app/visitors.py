@@ -0,0 +1,66 @@
+from datetime import date, datetime, timedelta, timezone
+
+import redis
+
+
+class UniqueVisitors:
+    """Approximate unique visitors per link and utc day, as redis HyperLogLogs.
+
+    Every (link, day) sketch takes at most 12kB however many visitors it has
+    seen, with a standard error of 0.81%. Adding an ip twice is a no-op, so a
+    re-delivered batch doesn't inflate the counts. Sketches expire after
+    `retention_days`.
+    """
+
+    PREFIX = "uv:"
+
+    def __init__(self, client: redis.Redis, *, retention_days: int = 90):
+        self.client = client
+        self.retention_days = retention_days
+
+    def key(self, short_url: str, day: date) -> str:
+        return f"{self.PREFIX}{short_url}:{day:%Y%m%d}"
+
+    def add_many(self, visitors: dict[tuple[str, date], set[str]]) -> None:
+        if not visitors:
+            return
+
+        ttl = timedelta(days=self.retention_days + 1)
+        pipeline = self.client.pipeline(transaction=False)
+        for (short_url, day), ips in visitors.items():
+            key = self.key(short_url, day)
+            pipeline.pfadd(key, *ips)
+            pipeline.expire(key, ttl)
+        pipeline.execute()
+
+    def clear(self, short_urls: list[str]) -> None:
+        """Deletes every sketch of the short urls still within retention."""
+        if not short_urls:
+            return
+
+        today = datetime.now(timezone.utc).date()
+        days = _days(today - timedelta(days=self.retention_days + 1), today)
+        self.client.delete(
+            *[self.key(short_url, day) for short_url in short_urls for day in days]
+        )
+
+    def count(self, short_url: str, *, start: date, end: date) -> int:
+        """Unique visitors over the days [start, end], each counted once."""
+        # pfcount of several keys counts their union.
+        return self.client.pfcount(
+            *[self.key(short_url, day) for day in _days(start, end)]
+        )
+
+    def count_per_day(
+        self, short_url: str, *, start: date, end: date
+    ) -> list[tuple[date, int]]:
+        days = _days(start, end)
+        pipeline = self.client.pipeline(transaction=False)
+        for day in days:
+            pipeline.pfcount(self.key(short_url, day))
+
+        return list(zip(days, pipeline.execute()))
+
+
+def _days(start: date, end: date) -> list[date]:
+    return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
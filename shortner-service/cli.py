@@ -0,0 +1,293 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import redis
+
+from app.benchmarks import cache_layout_benchmark, cache_record_benchmark
+from app.cache import (
+    BucketLayout,
+    CacheInvalidator,
+    RedisCache,
+    migrate_cache_layout,
+    setup_redis,
+)
+from app.clicks import PendingClicks
+from app.config import settings
+from app.db import SessionContext, current_ctx, setup_postgresql
+from app.dto import URLImportError
+from app.exceptions import NotFound
+from app.importer import URLImporter
+from app.log import setup_logging
+from app.reaper import URLReaper
+from app.rollup import ClickRollup
+from app.service import CacheWarmer, URLClickCountService, UserService
+from app.visitors import UniqueVisitors
+
+
+def _redis_cache(redis_client: redis.Redis) -> RedisCache:
+    layout = BucketLayout.from_settings(settings)
+    if layout:
+        layout.check_server(redis_client)
+
+    # publishes only, running web workers pick the changes up.
+    return RedisCache(
+        client=redis_client,
+        invalidator=CacheInvalidator(client=redis_client),
+        invalidation_channel=settings.cache_invalidation_channel,
+        layout=layout,
+    )
+
+
+def import_urls(args: argparse.Namespace) -> int:
+    setup_postgresql(settings)
+    redis_client = setup_redis(settings)
+
+    with SessionContext(with_transaction=False):
+        try:
+            user = UserService(context=current_ctx).get_user_by_username(
+                username=args.username
+            )
+        except NotFound as exc:
+            print(exc, file=sys.stderr)
+            return 1
+
+    importer = URLImporter(
+        redis_cache=_redis_cache(redis_client),
+        batch_size=args.batch_size,
+        cache_ttl_seconds=settings.redirect_cache_ttl_seconds,
+        click_counts=URLClickCountService(
+            context=current_ctx,
+            unique_visitors=UniqueVisitors(
+                redis_client, retention_days=settings.unique_visitors_retention_days
+            ),
+            pending_clicks=(
+                PendingClicks(redis_client)
+                if settings.realtime_click_counts_enabled
+                else None
+            ),
+        ),
+    )
+
+    path = Path(args.file)
+    fmt = args.format or ("csv" if path.suffix == ".csv" else "ndjson")
+    with open(path, newline="") as fp, open(args.errors, "w") as errors_fp:
+
+        def on_error(error: URLImportError):
+            errors_fp.write(json.dumps(error.model_dump()) + "\n")
+
+        summary = importer.import_file(
+            fp,
+            fmt=fmt,
+            user_id=user.id,
+            on_error=on_error,
+            warm_cache=args.warm_cache,
+        )
+
+    print(summary.model_dump_json(exclude={"errors"}))
+    return 0
+
+
+def warm_cache(args: argparse.Namespace) -> int:
+    setup_postgresql(settings)
+    redis_client = setup_redis(settings)
+
+    cache_warmer = CacheWarmer(
+        context=current_ctx,
+        redis_cache=_redis_cache(redis_client),
+        batch_size=settings.cache_warmup_batch_size,
+        cache_ttl_seconds=settings.redirect_cache_ttl_seconds,
+    )
+    with SessionContext(with_transaction=False):
+        cache_warmer.warm_top_urls(args.top_n)
+
+    stats = cache_warmer.stats()
+    print(
+        json.dumps({"keys": stats["warmup_keys"], "seconds": stats["warmup_seconds"]})
+    )
+    return 0
+
+
+def reap_urls(args: argparse.Namespace) -> int:
+    setup_postgresql(settings)
+    redis_client = setup_redis(settings)
+
+    url_reaper = URLReaper(
+        redis_cache=_redis_cache(redis_client),
+        mode=args.mode,
+        batch_size=args.batch_size,
+    )
+    print(json.dumps({"reaped": url_reaper.reap()}))
+    return 0
+
+
+def rollup_clicks(args: argparse.Namespace) -> int:
+    setup_postgresql(settings)
+
+    click_rollup = ClickRollup(
+        hourly_retention_days=args.hourly_retention_days,
+        daily_retention_days=args.daily_retention_days,
+        precreate_days=settings.click_partition_precreate_days,
+    )
+    print(json.dumps(click_rollup.run()))
+    return 0
+
+
+def set_user_active(args: argparse.Namespace) -> int:
+    setup_postgresql(settings)
+    redis_client = setup_redis(settings)
+
+    # the commit publishes the change, web workers drop the cached user.
+    user_service = UserService(
+        context=current_ctx,
+        invalidator=CacheInvalidator(client=redis_client),
+        invalidation_channel=settings.user_invalidation_channel,
+    )
+    with SessionContext(with_transaction=True):
+        try:
+            user = user_service.get_user_by_username(username=args.username)
+        except NotFound as exc:
+            print(exc, file=sys.stderr)
+            return 1
+
+        user_service.set_active(user_id=user.id, is_active=not args.inactive)
+
+    return 0
+
+
+def migrate_cache(args: argparse.Namespace) -> int:
+    redis_client = setup_redis(settings)
+
+    layout = None
+    if args.to == "buckets":
+        layout = BucketLayout.from_settings(settings)
+        if layout is None:
+            print("redirect_cache_buckets is not configured.", file=sys.stderr)
+            return 1
+        layout.check_server(redis_client)
+
+    start = time.monotonic()
+    moved = migrate_cache_layout(
+        redis_client,
+        layout=layout,
+        default_ttl=settings.redirect_cache_ttl_seconds,
+        batch_size=args.batch_size,
+    )
+    print(json.dumps({"moved": moved, "seconds": round(time.monotonic() - start, 2)}))
+    return 0
+
+
+def bench_cache_layout(args: argparse.Namespace) -> int:
+    redis_client = setup_redis(settings)
+    print(
+        json.dumps(
+            cache_layout_benchmark(redis_client, keys=args.keys, buckets=args.buckets)
+        )
+    )
+    return 0
+
+
+def bench_cache_record(args: argparse.Namespace) -> int:
+    redis_client = setup_redis(settings)
+    print(json.dumps(cache_record_benchmark(redis_client, keys=args.keys)))
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="shortner-service commands.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    importer = subparsers.add_parser(
+        "import-urls", help="bulk import existing short url mappings."
+    )
+    importer.add_argument("file", help="NDJSON or CSV file of mappings.")
+    importer.add_argument("--username", required=True, help="owner of the links.")
+    importer.add_argument("--format", choices=["ndjson", "csv"], default=None)
+    importer.add_argument(
+        "--errors",
+        default="import-errors.ndjson",
+        help="file that collects rejected rows.",
+    )
+    importer.add_argument(
+        "--batch-size", type=int, default=settings.url_import_batch_size
+    )
+    importer.add_argument(
+        "--warm-cache", action="store_true", help="pre-populate redis."
+    )
+    importer.set_defaults(func=import_urls)
+
+    warmer = subparsers.add_parser(
+        "warm-cache", help="preload the most clicked urls into redis."
+    )
+    warmer.add_argument("--top-n", type=int, default=settings.cache_warmup_top_n)
+    warmer.set_defaults(func=warm_cache)
+
+    reaper = subparsers.add_parser("reap-urls", help="remove expired urls.")
+    reaper.add_argument(
+        "--mode", choices=["archive", "delete"], default=settings.url_reaper_mode
+    )
+    reaper.add_argument(
+        "--batch-size", type=int, default=settings.url_reaper_batch_size
+    )
+    reaper.set_defaults(func=reap_urls)
+
+    rollup = subparsers.add_parser(
+        "rollup-clicks",
+        help="compact hourly click partitions and drop expired ones.",
+    )
+    rollup.add_argument(
+        "--hourly-retention-days",
+        type=int,
+        default=settings.click_hourly_retention_days,
+    )
+    rollup.add_argument(
+        "--daily-retention-days",
+        type=int,
+        default=settings.click_daily_retention_days,
+    )
+    rollup.set_defaults(func=rollup_clicks)
+
+    bench_record = subparsers.add_parser(
+        "bench-cache-record",
+        help="compare memory and decode time of plain and record cache values.",
+    )
+    bench_record.add_argument("--keys", type=int, default=100000)
+    bench_record.set_defaults(func=bench_cache_record)
+
+    user_active = subparsers.add_parser(
+        "set-user-active", help="activate or deactivate a user."
+    )
+    user_active.add_argument("--username", required=True)
+    user_active.add_argument("--inactive", action="store_true")
+    user_active.set_defaults(func=set_user_active)
+
+    migrate = subparsers.add_parser(
+        "migrate-cache", help="move cached redirects between storage layouts."
+    )
+    migrate.add_argument("--to", choices=["buckets", "keys"], required=True)
+    migrate.add_argument("--batch-size", type=int, default=1000)
+    migrate.set_defaults(func=migrate_cache)
+
+    bench_layout = subparsers.add_parser(
+        "bench-cache-layout",
+        help="compare memory per key of top-level keys and hash buckets.",
+    )
+    bench_layout.add_argument("--keys", type=int, default=1000000)
+    bench_layout.add_argument(
+        "--buckets",
+        type=int,
+        default=None,
+        help="defaults to one bucket per 100 keys.",
+    )
+    bench_layout.set_defaults(func=bench_cache_layout)
+
+    args = parser.parse_args()
+    setup_logging()
+
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""added url listing index
+
+Revision ID: 3b1f6c2d9a47
+Revises: edd0d3a6a4ba
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b1f6c2d9a47'
+down_revision: Union[str, Sequence[str], None] = 'edd0d3a6a4ba'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # built concurrently, the url table is too large to lock for the build.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_url_created_by_created_at_id',
+            'url',
+            ['created_by', 'created_at', 'id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_url_created_by_created_at_id',
+            table_name='url',
+            postgresql_concurrently=True,
+        )
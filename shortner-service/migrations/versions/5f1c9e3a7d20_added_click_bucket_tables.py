@@ -0,0 +1,40 @@
+"""added click bucket tables
+
+Revision ID: 5f1c9e3a7d20
+Revises: 8e2a4d71c5b0
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5f1c9e3a7d20'
+down_revision: Union[str, Sequence[str], None] = '8e2a4d71c5b0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # partitions are created on demand by the click consumer and the rollup.
+    for table in ('urlclickhourly', 'urlclickdaily'):
+        op.create_table(table,
+        sa.Column('short_url', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('country_code', sqlmodel.sql.sqltypes.AutoString(length=3), nullable=False),
+        sa.Column('counts', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('short_url', 'bucket_start', 'country_code'),
+        postgresql_partition_by='RANGE (bucket_start)',
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # dropping a partitioned table drops its partitions as well.
+    op.drop_table('urlclickdaily')
+    op.drop_table('urlclickhourly')
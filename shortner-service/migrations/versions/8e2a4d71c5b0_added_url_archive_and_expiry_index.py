@@ -0,0 +1,65 @@
+"""added url archive and expiry index
+
+Revision ID: 8e2a4d71c5b0
+Revises: 3b1f6c2d9a47
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e2a4d71c5b0'
+down_revision: Union[str, Sequence[str], None] = '3b1f6c2d9a47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('urlarchive',
+    sa.Column('id', sa.Uuid(), nullable=False),
+    sa.Column('original_url', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('short_url', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('created_by', sa.Uuid(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_urlarchive_short_url'), 'urlarchive', ['short_url'], unique=False)
+
+    # click history is kept for urls the reaper removes.
+    op.drop_constraint('urlclickcount_short_url_fkey', 'urlclickcount', type_='foreignkey')
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_url_expires_at',
+            'url',
+            ['expires_at'],
+            unique=False,
+            postgresql_where=sa.text('expires_at IS NOT NULL'),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_url_expires_at',
+            table_name='url',
+            postgresql_concurrently=True,
+        )
+
+    op.create_foreign_key(
+        'urlclickcount_short_url_fkey', 'urlclickcount', 'url', ['short_url'], ['short_url']
+    )
+    op.drop_index(op.f('ix_urlarchive_short_url'), table_name='urlarchive')
+    op.drop_table('urlarchive')
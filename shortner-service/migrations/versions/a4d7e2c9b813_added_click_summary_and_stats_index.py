@@ -0,0 +1,56 @@
+"""added click summary and stats index
+
+Revision ID: a4d7e2c9b813
+Revises: 5f1c9e3a7d20
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4d7e2c9b813'
+down_revision: Union[str, Sequence[str], None] = '5f1c9e3a7d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('urlclicksummary',
+    sa.Column('short_url', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('total_clicks', sa.BigInteger(), nullable=False),
+    sa.Column('last_clicked_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('short_url')
+    )
+
+    # existing totals, the consumer keeps them up to date from here on.
+    op.execute(
+        "INSERT INTO urlclicksummary (short_url, total_clicks) "
+        "SELECT short_url, sum(counts) FROM urlclickcount GROUP BY short_url"
+    )
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_urlclickcount_short_url_counts',
+            'urlclickcount',
+            ['short_url', sa.text('counts DESC'), 'country_code'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_urlclickcount_short_url_counts',
+            table_name='urlclickcount',
+            postgresql_concurrently=True,
+        )
+
+    op.drop_table('urlclicksummary')
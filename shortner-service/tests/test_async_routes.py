@@ -0,0 +1,152 @@
+import threading
+from unittest import mock
+
+import fastapi.dependencies.utils
+import fastapi.routing
+import pytest
+from fastapi.testclient import TestClient
+
+from app import cache, db, geoip
+from app.cache import CacheRecord
+from app.config import settings
+from app.main import create_app
+from app.metrics import registry
+
+
+@pytest.fixture(scope="module")
+def async_client():
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        # the redirect route and its clients are picked when the app is created.
+        monkeypatch.setattr(settings, "async_mode", True)
+        monkeypatch.setattr(settings, "cache_fill_lock_enabled", True)
+
+        # the app replaces these module globals on startup, later modules get
+        # theirs back.
+        monkeypatch.setattr(registry, "_collectors", dict(registry._collectors))
+        for module, name in [
+            (db, "_sessionmakers"),
+            (db, "_async_sessionmakers"),
+            (cache, "_redis_client"),
+            (cache, "_async_redis_client"),
+            (geoip, "_resolver"),
+        ]:
+            monkeypatch.setattr(module, name, getattr(module, name))
+
+        with TestClient(create_app()) as client:
+            yield client
+
+
+@pytest.fixture(scope="module")
+def headers(async_client):
+    response = async_client.post(
+        f"{settings.API_V1}/users",
+        json={"username": "async", "password": "test", "display_name": "Async"},
+    )
+    assert response.status_code == 200
+
+    yield {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def _shorten(async_client, headers, alias: str, **extra) -> str:
+    response = async_client.post(
+        f"{settings.API_V1}/urls/shorten",
+        json={
+            "original_url": f"http://localhost:8080/{alias}",
+            "alias": alias,
+            **extra,
+        },
+        headers=headers,
+    )
+    assert response.status_code == 200
+    return response.json()["short_url"]
+
+
+def _metrics(async_client, headers) -> dict:
+    return async_client.get(f"{settings.API_V1}/metrics", headers=headers).json()
+
+
+def test_async_redirect_cache_hit_skips_db_pool(async_client, headers):
+    short_url = _shorten(async_client, headers, "async-hit")
+
+    async_client.get(short_url, follow_redirects=False)
+    checkouts = _metrics(async_client, headers)["async_db_pool"]["checkouts"]
+    for _ in range(3):
+        response = async_client.get(short_url, follow_redirects=False)
+        assert response.status_code == 302
+        assert response.headers["Location"] == "http://localhost:8080/async-hit"
+
+    assert _metrics(async_client, headers)["async_db_pool"]["checkouts"] == checkouts
+
+
+def test_async_redirect_skips_threadpool(async_client, headers):
+    short_url = _shorten(async_client, headers, "async-loop")
+    async_client.get(short_url, follow_redirects=False)
+
+    # neither the route nor any of its dependencies is run in a thread.
+    patch_dependencies = mock.patch.object(
+        fastapi.dependencies.utils,
+        "run_in_threadpool",
+        wraps=fastapi.dependencies.utils.run_in_threadpool,
+    )
+    patch_routing = mock.patch.object(
+        fastapi.routing, "run_in_threadpool", wraps=fastapi.routing.run_in_threadpool
+    )
+    with patch_dependencies as dependencies, patch_routing as routing:
+        response = async_client.get(short_url, follow_redirects=False)
+
+    assert response.status_code == 302
+    assert not dependencies.called
+    assert not routing.called
+
+
+def test_async_redirect_cache_miss_loads_from_db(async_client, headers):
+    short_url = _shorten(async_client, headers, "async-miss")
+    # evicted from redis and the local tier, the next redirect reads postgres.
+    async_client.app.state.url_service.cache.delete("async-miss")
+    checkouts = _metrics(async_client, headers)["async_db_pool"]["checkouts"]
+
+    response = async_client.get(short_url, follow_redirects=False)
+    assert response.headers["Location"] == "http://localhost:8080/async-miss"
+    assert (
+        _metrics(async_client, headers)["async_db_pool"]["checkouts"] == checkouts + 1
+    )
+
+    # and refilled the cache on the way.
+    assert async_client.app.state.url_service.cache.get("async-miss") is not None
+
+
+def test_async_redirect_unknown_and_expired(async_client, headers):
+    response = async_client.get("/async-unknown", follow_redirects=False)
+    assert response.status_code == 404
+
+    short_url = _shorten(
+        async_client, headers, "async-expired", expires_in="2000-01-01T00:00:00"
+    )
+    response = async_client.get(short_url, follow_redirects=False)
+    assert response.status_code == 404
+
+
+def test_async_redirect_fill_lock_follower(async_client, headers):
+    url_service = async_client.app.state.url_service
+    short_url = _shorten(async_client, headers, "async-follow")
+    url_service.cache.delete("async-follow")
+
+    # another worker holds the fill lock and fills the cache shortly.
+    lock = url_service.cache.fill_lock("async-follow", 5)
+    assert lock.acquire()
+    record = CacheRecord.of("http://localhost:8080/async-follow")
+    filler = threading.Timer(
+        0.05, lambda: url_service.cache.set("async-follow", record, 60)
+    )
+    before = _metrics(async_client, headers)["cache_fill"]
+    filler.start()
+    try:
+        response = async_client.get(short_url, follow_redirects=False)
+    finally:
+        filler.join()
+        lock.release()
+
+    assert response.headers["Location"] == "http://localhost:8080/async-follow"
+    after = _metrics(async_client, headers)["cache_fill"]
+    assert after["fill_lock_waits"] == before["fill_lock_waits"] + 1
+    assert after["fill_lock_wait_hits"] == before["fill_lock_wait_hits"] + 1
@@ -0,0 +1,180 @@
+import time
+import uuid
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+
+from app.bloom import BloomFilter, BloomFilterRefresher
+from app.cache import (
+    BucketLayout,
+    CacheRecord,
+    LocalCache,
+    _write_record,
+    migrate_cache_layout,
+)
+
+
+def test_local_cache_lru_eviction():
+    cache = LocalCache(max_size=2, ttl_seconds=60)
+    cache.set("a", "1")
+    cache.set("b", "2")
+
+    # touching "a" makes "b" the least recently used entry.
+    assert cache.get("a") == "1"
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_local_cache_ttl_expiry():
+    cache = LocalCache(max_size=10, ttl_seconds=60)
+    cache.set("a", "1", ttl_seconds=0.01)
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert stats["expirations"] == 1
+    assert stats["misses"] == 1
+    assert stats["size"] == 0
+
+
+def test_local_cache_pop():
+    cache = LocalCache(max_size=10, ttl_seconds=60)
+    cache.set("a", "1")
+    cache.pop("a")
+    cache.pop("missing")
+
+    assert cache.get("a") is None
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    keys = [f"code-{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+
+    assert all(key in bloom for key in keys)
+
+    # the false positive rate should stay close to the configured one.
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_bloom_filter_rebuild_keeps_concurrent_adds():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    bloom.add("stale")
+
+    def keys():
+        yield "loaded"
+        # announced by an invalidation while the rebuild is reading postgres.
+        bloom.add("announced")
+        assert "loaded" not in bloom
+        yield "other"
+
+    assert bloom.rebuild(keys()) == 2
+    assert all(key in bloom for key in ["loaded", "announced", "other"])
+    assert "stale" not in bloom
+    assert len(bloom) == 3
+
+
+def test_bloom_filter_refresher_rebuilds_on_request():
+    loads = []
+    refresher = BloomFilterRefresher(
+        load=lambda: loads.append(1) or 0, interval_seconds=60, settle_seconds=0.01
+    )
+    refresher.start()
+    try:
+        refresher.request()
+        deadline = time.monotonic() + 2
+        while not loads and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        refresher.stop()
+
+    assert loads == [1]
+    assert refresher.stats() == {"runs": 1, "requested": 1, "failed": 0}
+
+
+def test_cache_record_round_trip():
+    record = CacheRecord.of(
+        "http://localhost/a\x1fb",
+        expires_at=datetime.now() + timedelta(minutes=5),
+        owner_id=uuid.uuid4(),
+    )
+
+    assert CacheRecord.decode(record.encode()) == record
+    assert record.is_live()
+    # plain urls written by older releases still decode.
+    assert CacheRecord.decode("http://localhost/a") == CacheRecord("http://localhost/a")
+
+
+def test_cache_record_ttl_capped_by_expiry():
+    assert CacheRecord("http://localhost").ttl(3600) == 3600
+    assert CacheRecord("http://localhost", is_active=False).ttl(3600) == 0
+
+    soon = CacheRecord.of(
+        "http://localhost", expires_at=datetime.now() + timedelta(seconds=60)
+    )
+    assert 0 < soon.ttl(3600) <= 60
+
+    expired = CacheRecord.of(
+        "http://localhost", expires_at=datetime.now() - timedelta(seconds=1)
+    )
+    assert expired.ttl(3600) == 0
+    assert not expired.is_live()
+
+
+def test_bucket_layout_spreads_codes():
+    layout = BucketLayout(buckets=16)
+    buckets = {layout.bucket(f"code{index}") for index in range(1000)}
+
+    assert layout.bucket("abc123") == layout.bucket("abc123")
+    assert len(buckets) == 16
+    assert all(bucket.startswith(BucketLayout.PREFIX) for bucket in buckets)
+
+
+def test_bucket_ttls_need_a_server_that_expires_fields():
+    client = mock.MagicMock()
+    client.info.return_value = {"redis_version": "7.2.4"}
+
+    with pytest.raises(RuntimeError):
+        BucketLayout(buckets=16).check_server(client)
+    BucketLayout(buckets=16, field_ttl=False).check_server(client)
+
+    client.info.return_value = {"redis_version": "7.4.0"}
+    BucketLayout(buckets=16).check_server(client)
+
+
+def test_bucket_writes_without_field_ttl_expire_the_bucket():
+    pipeline = mock.MagicMock()
+    layout = BucketLayout(buckets=16, field_ttl=False)
+    _write_record(pipeline, layout, "abc123", "http://localhost", 60)
+
+    bucket = layout.bucket("abc123")
+    pipeline.hset.assert_called_once_with(bucket, "abc123", "http://localhost")
+    assert pipeline.expire.call_args_list == [
+        mock.call(bucket, 60, nx=True),
+        mock.call(bucket, 60, gt=True),
+    ]
+    pipeline.hexpire.assert_not_called()
+
+
+def test_migration_to_buckets_moves_only_redirect_keys():
+    client = mock.MagicMock()
+    client.scan_iter.return_value = iter(["abc123", "my-alias", "fill-lock:abc123"])
+    client.mget.side_effect = lambda keys: ["http://localhost"] * len(keys)
+
+    layout = BucketLayout(buckets=16)
+    moved = migrate_cache_layout(client, layout=layout, default_ttl=60)
+
+    assert moved == 2
+    client.mget.assert_called_once_with(["abc123", "my-alias"])
+    pipeline = client.pipeline.return_value
+    assert pipeline.delete.call_args_list == [
+        mock.call("abc123"),
+        mock.call("my-alias"),
+    ]
@@ -0,0 +1,124 @@
+from unittest import mock
+
+import redis
+
+from app.clicks import ClickBuffer, PendingClicks
+from app.geoip import GeoIPResolver
+
+
+def test_click_buffer_drops_when_full():
+    buffer = ClickBuffer(client=mock.MagicMock(), topic="clicks", max_size=2)
+
+    assert buffer.put({"short_url": "a"})
+    assert buffer.put({"short_url": "b"})
+    assert buffer.put({"short_url": "c"}) is False
+
+    stats = buffer.stats()
+    assert stats["queued"] == 2
+    assert stats["dropped"] == 1
+
+
+def test_click_buffer_flushes_in_pipelined_batches():
+    client = mock.MagicMock()
+    buffer = ClickBuffer(client=client, topic="clicks", flush_batch_size=2)
+    for i in range(5):
+        buffer.put({"short_url": f"code-{i}"})
+
+    assert buffer.flush() == 5
+
+    # 5 messages in batches of 2 -> 3 round trips.
+    assert client.pipeline.call_count == 3
+    pipeline = client.pipeline.return_value
+    assert pipeline.xadd.call_count == 5
+    assert buffer.stats()["queued"] == 0
+
+
+def test_click_buffer_retries_failed_batches_with_backoff():
+    client = mock.MagicMock()
+    pipeline = client.pipeline.return_value
+    pipeline.execute.side_effect = [redis.ConnectionError("down"), None]
+    buffer = ClickBuffer(client=client, topic="clicks", flush_interval_ms=60000)
+    for short_url in ["a", "b"]:
+        buffer.put({"short_url": short_url})
+
+    assert buffer.flush() == 0
+    assert buffer.stats()["queued"] == 2
+    assert buffer.stats()["failed"] == 2
+
+    # nothing is written before the backoff has passed.
+    assert buffer.flush() == 0
+    assert pipeline.execute.call_count == 1
+
+    assert buffer.flush(force=True) == 2
+    assert buffer.stats()["dropped"] == 0
+    client.pipeline.assert_called_with(transaction=True)
+
+
+def test_click_buffer_drops_retries_that_no_longer_fit():
+    client = mock.MagicMock()
+    buffer = ClickBuffer(client=client, topic="clicks", max_size=2)
+
+    def fail_after_new_clicks():
+        # the buffer fills up again while the batch is in flight.
+        buffer.put({"short_url": "c"})
+        buffer.put({"short_url": "d"})
+        raise redis.ConnectionError("down")
+
+    client.pipeline.return_value.execute.side_effect = fail_after_new_clicks
+    buffer.put({"short_url": "a"})
+    buffer.put({"short_url": "b"})
+
+    assert buffer.flush() == 0
+    assert buffer.stats()["queued"] == 2
+    assert buffer.stats()["dropped"] == 2
+
+
+def test_click_buffer_drains_on_stop():
+    client = mock.MagicMock()
+    buffer = ClickBuffer(client=client, topic="clicks", flush_interval_ms=60000)
+    buffer.start()
+    buffer.put({"short_url": "a"})
+    buffer.stop()
+
+    assert buffer.stats()["flushed"] == 1
+
+
+def test_click_buffer_counts_pending_clicks_with_the_stream_write():
+    client = mock.MagicMock()
+    buffer = ClickBuffer(
+        client=client,
+        topic="clicks",
+        geoip=GeoIPResolver(),
+        pending_clicks=PendingClicks(client),
+    )
+    for short_url in ["a", "a", "b"]:
+        buffer.put({"short_url": short_url, "request_ip": "127.0.0.1"})
+
+    assert buffer.flush() == 3
+
+    # one round trip, the increments ride along with the XADDs.
+    assert client.pipeline.call_count == 1
+    pipeline = client.pipeline.return_value
+    assert {call.args for call in pipeline.hincrby.call_args_list} == {
+        ("clicks-pending:a", "ZZ", 2),
+        ("clicks-pending:b", "ZZ", 1),
+    }
+    messages = [call.kwargs["fields"] for call in pipeline.xadd.call_args_list]
+    assert all(message["country_code"] == "ZZ" for message in messages)
+    # the ttl is set when a hash is created, clicks don't keep sliding it.
+    assert all(call.kwargs == {"nx": True} for call in pipeline.expire.call_args_list)
+
+
+def test_pending_clicks_settle_per_code_without_going_negative():
+    client = mock.MagicMock()
+    pending_clicks = PendingClicks(client)
+    pending_clicks.settle({("a", "IN"): 2, ("a", "US"): 1, ("b", "IN"): 1})
+
+    # one clamping script call per hash, all in one round trip.
+    settle = client.register_script.return_value
+    pipeline = client.pipeline.return_value
+    assert settle.call_args_list == [
+        mock.call(keys=["clicks-pending:a"], args=["IN", 2, "US", 1], client=pipeline),
+        mock.call(keys=["clicks-pending:b"], args=["IN", 1], client=pipeline),
+    ]
+    pipeline.execute.assert_called_once()
@@ -0,0 +1,239 @@
+from datetime import date, datetime
+from unittest import mock
+
+import pytest
+from sqlalchemy import exc
+
+from app.config import settings
+from app.consumer import (
+    ConsumerStats,
+    _aggregate_records,
+    _next_batch_count,
+    _to_messages,
+    _trim_acknowledged,
+    _write_aggregates,
+)
+from app.dto import ClickStreamMessage
+from app.partitions import hourly_click_partitions
+
+
+def test_batch_count_grows_with_backlog_and_shrinks_when_idle():
+    minimum = settings.click_analytics_batch_count
+    maximum = settings.click_analytics_max_batch_count
+
+    batch_count = minimum
+    while batch_count < maximum:
+        batch_count = _next_batch_count(batch_count, batch_count)
+    assert batch_count == maximum
+
+    while batch_count > minimum:
+        batch_count = _next_batch_count(batch_count, 0)
+    assert batch_count == minimum
+
+
+def test_batch_count_steps_per_read():
+    minimum = settings.click_analytics_batch_count
+    maximum = settings.click_analytics_max_batch_count
+
+    # full reads double, up to the ceiling.
+    assert _next_batch_count(minimum, minimum) == minimum * 2
+    assert _next_batch_count(maximum * 3 // 4, maximum * 3 // 4) == maximum
+    assert _next_batch_count(maximum, maximum) == maximum
+
+    # partial reads keep the size, mostly empty ones halve it, to the floor.
+    assert _next_batch_count(minimum * 4, minimum * 2) == minimum * 4
+    assert _next_batch_count(minimum * 4, minimum) == minimum * 4
+    assert _next_batch_count(minimum * 4, minimum - 1) == minimum * 2
+    assert _next_batch_count(minimum * 4, 0) == minimum * 2
+    assert _next_batch_count(minimum * 3 // 2, 0) == minimum
+    assert _next_batch_count(minimum, 0) == minimum
+
+
+def test_consumer_stats_report_rate_and_latency_per_window():
+    clock = mock.Mock(return_value=100.0)
+    with mock.patch("app.consumer.time.monotonic", clock):
+        stats = ConsumerStats(interval_seconds=10)
+        stats.record(300, 0.2)
+        stats.record(100, 0.4)
+        # empty reads count towards neither rate nor latency.
+        stats.record(0, 5.0)
+
+        clock.return_value = 109.0
+        assert not stats.report_due()
+        clock.return_value = 110.0
+        assert stats.report_due()
+
+        snapshot = stats.snapshot(batch_count=200, lag=7)
+        assert snapshot["throughput_per_second"] == 40.0
+        assert snapshot["ingested_total"] == 400
+        assert snapshot["batch_latency_ms_avg"] == 300.0
+        assert snapshot["batch_latency_ms_max"] == 400.0
+        assert (snapshot["batch_count"], snapshot["lag"]) == (200, 7)
+
+        # the next window starts from zero, the total carries over.
+        stats.record(50)
+        clock.return_value = 115.0
+        snapshot = stats.snapshot(batch_count=100, lag=None)
+        assert snapshot["throughput_per_second"] == 10.0
+        assert snapshot["ingested_total"] == 450
+        assert snapshot["batch_latency_ms_max"] == 0.0
+        assert not stats.report_due()
+
+
+def test_malformed_messages_are_acked_and_skipped():
+    redis_client = mock.MagicMock()
+    messages = _to_messages(
+        redis_client,
+        [
+            ("1-0", {"short_url": "abc", "request_ip": "127.0.0.1"}),
+            ("2-0", {"short_url": "abc"}),
+            ("3-0", None),
+            ("4-0", {"short_url": "abc", "country_code": "IN"}),
+        ],
+    )
+
+    assert [message.message_id for message in messages] == ["1-0"]
+    redis_client.xack.assert_called_once_with(
+        settings.click_analytics_topic,
+        settings.click_analytics_consumer_group,
+        "2-0",
+        "3-0",
+        "4-0",
+    )
+    # the pending click the producer counted for the dropped entry is settled.
+    settle = redis_client.register_script.return_value
+    settle.assert_called_once_with(
+        keys=["clicks-pending:abc"],
+        args=["IN", 1],
+        client=redis_client.pipeline.return_value,
+    )
+
+
+def test_aggregate_records_buckets_by_stream_time():
+    # 2026-10-18 10:59:59.999 and 11:00:00 utc.
+    records = [
+        ClickStreamMessage(message_id=f"{millis}-0", short_url="abc", request_ip=ip)
+        for millis, ip in [
+            (1792321199999, "127.0.0.1"),
+            (1792321200000, "127.0.0.1"),
+            (1792321200000, "127.0.0.2"),
+        ]
+    ]
+
+    # tagged by the producer, its country is trusted and counted as pending.
+    records.append(
+        ClickStreamMessage(
+            message_id="1792321200000-1",
+            short_url="abc",
+            request_ip="127.0.0.3",
+            country_code="IN",
+        )
+    )
+
+    totals, hourly, daily, visitors, pending = _aggregate_records(records)
+
+    assert {total.country_code: total.counts for total in totals} == {
+        "ZZ": 3,
+        "IN": 1,
+    }
+    assert {
+        (bucket.bucket_start, bucket.country_code): bucket.counts for bucket in hourly
+    } == {
+        (datetime(2026, 10, 18, 10), "ZZ"): 1,
+        (datetime(2026, 10, 18, 11), "ZZ"): 2,
+        (datetime(2026, 10, 18, 11), "IN"): 1,
+    }
+    assert sum(bucket.counts for bucket in daily) == 4
+    assert visitors == {
+        ("abc", date(2026, 10, 18)): {"127.0.0.1", "127.0.0.2", "127.0.0.3"}
+    }
+    assert pending == {("abc", "IN"): 1}
+
+
+def test_aggregate_records_counts_late_clicks_only_per_day():
+    records = [
+        ClickStreamMessage(message_id=f"{millis}-0", short_url="abc", request_ip=ip)
+        for millis, ip in [(1792321199999, "127.0.0.1"), (1792321200000, "127.0.0.2")]
+    ]
+
+    _, hourly, daily, _, _ = _aggregate_records(
+        records, hourly_since=datetime(2026, 10, 18, 11)
+    )
+
+    assert [bucket.bucket_start for bucket in hourly] == [datetime(2026, 10, 18, 11)]
+    assert [(bucket.bucket_start, bucket.counts) for bucket in daily] == [
+        (datetime(2026, 10, 18), 2)
+    ]
+
+
+def _db_error(pgcode: str) -> exc.IntegrityError:
+    return exc.IntegrityError("INSERT", {}, mock.Mock(pgcode=pgcode))
+
+
+def test_write_aggregates_retries_once_a_partition_dropped_elsewhere():
+    aggregates = _aggregate_records([])
+    url_count_service = mock.Mock()
+    url_count_service.increment_buckets.side_effect = [_db_error("23514"), None]
+    hourly_click_partitions._known.add(datetime(2026, 10, 1))
+
+    with mock.patch("app.consumer.SessionContext"):
+        _write_aggregates(url_count_service, aggregates)
+
+    assert url_count_service.increment_buckets.call_count == 2
+    assert not hourly_click_partitions._known
+
+    # other errors, or a second miss, are raised.
+    url_count_service.increment_buckets.side_effect = [_db_error("23505")]
+    with mock.patch("app.consumer.SessionContext"), pytest.raises(exc.IntegrityError):
+        _write_aggregates(url_count_service, aggregates)
+
+    url_count_service.increment_buckets.side_effect = [_db_error("42P01")] * 2
+    with mock.patch("app.consumer.SessionContext"), pytest.raises(exc.IntegrityError):
+        _write_aggregates(url_count_service, aggregates)
+
+
+class _DeliveringStream:
+    """Fake group that delivers entries 6-0..8-0 right after the first read."""
+
+    def __init__(self):
+        self.last_delivered = "5-0"
+        self.pending: list[str] = []
+        self.reads = 0
+        self.xtrim = mock.Mock(return_value=0)
+
+    def _delivered_after_read(self, value):
+        self.reads += 1
+        if self.reads == 1:
+            self.last_delivered = "8-0"
+            self.pending = ["6-0", "7-0", "8-0"]
+        return value
+
+    def xinfo_groups(self, name):
+        group = {
+            "name": settings.click_analytics_consumer_group,
+            "last-delivered-id": self.last_delivered,
+        }
+        return self._delivered_after_read([group])
+
+    def xpending(self, name, groupname):
+        pending = {
+            "pending": len(self.pending),
+            "min": self.pending[0] if self.pending else None,
+        }
+        return self._delivered_after_read(pending)
+
+
+def test_trim_keeps_entries_delivered_between_reads():
+    redis_client = _DeliveringStream()
+    _trim_acknowledged(redis_client)
+
+    redis_client.xtrim.assert_called_once_with(
+        settings.click_analytics_topic, minid="5-0", approximate=True
+    )
+
+    # older entries still pending win, compared as ids rather than strings.
+    redis_client = _DeliveringStream()
+    redis_client.reads = 1
+    redis_client.last_delivered, redis_client.pending = "10-0", ["9-0"]
+    _trim_acknowledged(redis_client)
+    assert redis_client.xtrim.call_args.kwargs["minid"] == "9-0"
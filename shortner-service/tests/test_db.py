@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+import pytest
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import Session
+
+from app import db
+from app.db import InstrumentedQueuePool, PoolStats, SessionContext, current_ctx
+
+
+def test_pool_stats_count_overflow_and_timeouts():
+    engine = create_engine(
+        "sqlite://",
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=1,
+        pool_timeout=0.05,
+    )
+    stats = PoolStats()
+    stats.attach(engine)
+
+    first = engine.connect()
+    # the second connection is beyond pool_size, the third has to wait.
+    second = engine.connect()
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+
+    assert stats.stats()["checked_out"] == 2
+    second.close()
+    first.close()
+
+    # a recreated pool keeps reporting into the same stats.
+    engine.dispose()
+    engine.connect().close()
+
+    result = stats.stats()
+    assert result["checkouts"] == 3
+    assert result["checked_out"] == 0
+    assert result["max_checked_out"] == 2
+    assert result["overflows"] == 1
+    assert result["timeouts"] == 1
+    assert result["max_wait_ms"] >= 50
+
+
+def test_async_session_context_commits_off_the_event_loop(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False})
+    sessionmakers = sessionmaker(bind=engine, class_=Session)
+    event.listen(sessionmakers, "after_commit", db._run_after_commit_callbacks)
+    monkeypatch.setattr(db, "_sessionmakers", sessionmakers)
+    threads = []
+
+    async def request():
+        async with SessionContext(with_transaction=True, lazy=True):
+            current_ctx.session.exec(text("SELECT 1"))
+            current_ctx.on_commit(lambda: threads.append(threading.get_ident()))
+
+        # a context that never opened a session has nothing to hand off.
+        async with SessionContext(with_transaction=True, lazy=True):
+            pass
+
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(request())
+    assert len(threads) == 1
+    assert threads[0] != loop_thread
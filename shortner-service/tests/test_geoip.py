@@ -0,0 +1,60 @@
+from app.geoip import UNKNOWN_COUNTRY, GeoIPResolver
+
+
+def test_resolve_ipv4_and_ipv6(tmp_path):
+    database = tmp_path / "ranges.csv"
+    database.write_text(
+        "network,country_code\n1.0.0.0/24,AU\n2.16.0.0/13,fr\n2001:db8::/32,DE\n"
+    )
+    resolver = GeoIPResolver()
+    resolver.load_csv(database)
+
+    assert resolver.resolve("1.0.0.1") == "AU"
+    assert resolver.resolve("2.23.255.255") == "FR"
+    assert resolver.resolve("2001:db8::1") == "DE"
+    # ipv4 mapped ipv6 addresses resolve through the ipv4 table.
+    assert resolver.resolve("::ffff:1.0.0.7") == "AU"
+
+    assert resolver.resolve("1.0.1.0") == UNKNOWN_COUNTRY
+    assert resolver.resolve("2001:db9::1") == UNKNOWN_COUNTRY
+    assert resolver.resolve("not-an-ip") == UNKNOWN_COUNTRY
+
+
+def test_resolve_many_matches_single_lookups(tmp_path):
+    database = tmp_path / "ranges.csv"
+    database.write_text(
+        "start_ip,end_ip,country_code\n"
+        "1.0.0.0,1.0.0.255,AU\n"
+        "8.8.8.0,8.8.8.255,US\n"
+        "2001:db8::,2001:db8::ffff,DE\n"
+    )
+    resolver = GeoIPResolver()
+    resolver.load_csv(database)
+
+    ips = ["8.8.8.8", "1.0.0.1", "9.9.9.9", "2001:db8::1", "8.8.8.8", "bad"]
+    assert resolver.resolve_many(ips) == [resolver.resolve(ip) for ip in ips]
+    assert resolver.resolve_many(ips) == ["US", "AU", "ZZ", "DE", "US", "ZZ"]
+
+
+def test_resolve_many_goes_through_the_memo(tmp_path):
+    database = tmp_path / "ranges.csv"
+    database.write_text("network,country_code\n1.0.0.0/24,AU\n")
+    resolver = GeoIPResolver(memo_size=2)
+    resolver.load_csv(database)
+
+    assert resolver.resolve_many(["1.0.0.1", "1.0.0.1", "9.9.9.9"]) == [
+        "AU",
+        "AU",
+        "ZZ",
+    ]
+    assert (resolver.memo_hits, resolver.memo_misses) == (0, 2)
+
+    assert resolver.resolve_many(["1.0.0.1", "1.0.0.2"]) == ["AU", "AU"]
+    assert resolver.resolve("9.9.9.9") == "ZZ"
+    # 1.0.0.2 pushed the least recently used 9.9.9.9 out of the memo.
+    assert (resolver.memo_hits, resolver.memo_misses) == (1, 4)
+    assert resolver.stats()["memo_size"] == 2
+
+    # a reload starts from an empty memo.
+    resolver.load_csv(database)
+    assert resolver.stats()["memo_size"] == 0
@@ -0,0 +1,50 @@
+import io
+from datetime import datetime
+
+from app.dto import URLImportError, URLImportRow
+from app.importer import _utc, read_rows, validate_rows
+
+
+def test_validate_ndjson_rows():
+    fp = io.StringIO(
+        '{"short_url": "promo-1", "original_url": "https://example.com/a"}\n'
+        "\n"
+        "{not json\n"
+        '{"short_url": "bad alias!", "original_url": "https://example.com/b"}\n'
+        '{"short_url": "promo-2"}\n'
+    )
+
+    rows = list(validate_rows(read_rows(fp, "ndjson")))
+
+    assert [line_no for line_no, _ in rows] == [1, 3, 4, 5]
+    assert isinstance(rows[0][1], URLImportRow)
+    assert rows[1][1].error == "unparsable row."
+    assert rows[2][1].error == "invalid alias."
+    assert isinstance(rows[3][1], URLImportError)
+
+
+def test_validate_csv_rows():
+    fp = io.StringIO(
+        "short_url,original_url,expires_at\n"
+        "promo-1,https://example.com/a,\n"
+        "promo-2,https://example.com/b,2030-01-01T00:00:00\n"
+    )
+
+    rows = list(validate_rows(read_rows(fp, "csv")))
+
+    assert [line_no for line_no, _ in rows] == [2, 3]
+    assert rows[0][1].expires_at is None
+    assert rows[1][1].expires_at.year == 2030
+
+
+def test_expiry_is_stored_as_naive_utc():
+    fp = io.StringIO(
+        "short_url,original_url,expires_at\n"
+        "promo-1,https://example.com/a,2030-01-01T05:30:00+05:30\n"
+        "promo-2,https://example.com/b,2030-01-01T00:00:00\n"
+    )
+
+    (_, aware), (_, naive) = validate_rows(read_rows(fp, "csv"))
+
+    assert _utc(aware.expires_at) == datetime(2030, 1, 1)
+    assert _utc(naive.expires_at) == datetime(2030, 1, 1)
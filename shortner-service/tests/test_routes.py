@@ -1,6 +1,11 @@
+import json
+
 import pytest
 
 from app.config import settings
+from app.db import SessionContext
+from app.dto import ClickCount
+from app.reaper import URLReaper
 
 
 @pytest.fixture(scope="module")
@@ -68,6 +73,47 @@ def test_redirect_short_url(fast_api_client, user_token):
     )
 
 
+def test_cached_redirect_skips_db_pool(fast_api_client, user_token):
+    response = fast_api_client.post(
+        f"{settings.API_V1}/urls/shorten",
+        json={"original_url": "http://localhost:8080/cached", "alias": "cached"},
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    short_url = response.json()["short_url"]
+
+    # the first redirect may fill the cache, the following ones are hits.
+    fast_api_client.get(short_url, follow_redirects=False)
+    checkouts = _pool_checkouts(fast_api_client, user_token)
+    for _ in range(5):
+        response = fast_api_client.get(short_url, follow_redirects=False)
+        assert response.headers["Location"] == "http://localhost:8080/cached"
+
+    assert _pool_checkouts(fast_api_client, user_token) == checkouts
+
+
+def _pool_checkouts(fast_api_client, user_token) -> int:
+    response = fast_api_client.get(
+        f"{settings.API_V1}/metrics",
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    return response.json()["db_pool"]["checkouts"]
+
+
+def test_metrics_need_an_admin(fast_api_client):
+    response = fast_api_client.get(f"{settings.API_V1}/metrics")
+    assert response.status_code == 401
+
+    response = fast_api_client.post(
+        f"{settings.API_V1}/users",
+        json={"username": "viewer", "password": "test", "display_name": "Viewer"},
+    )
+    token = response.json()["access_token"]
+    response = fast_api_client.get(
+        f"{settings.API_V1}/metrics", headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 403
+
+
 def test_redirect_short_url_with_alias(fast_api_client, user_token):
     # shorten the url.
     response = fast_api_client.post(
@@ -90,6 +136,15 @@ def test_redirect_short_url_with_alias(fast_api_client, user_token):
     )
 
 
+def test_alias_without_key_separators(fast_api_client, user_token):
+    response = fast_api_client.post(
+        f"{settings.API_V1}/urls/shorten",
+        json={"original_url": "http://localhost:8080/colon", "alias": "a:b"},
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 422
+
+
 def test_list_shorten_urls(fast_api_client, user_token):
     response = fast_api_client.get(
         f"{settings.API_V1}/urls",
@@ -99,7 +154,175 @@ def test_list_shorten_urls(fast_api_client, user_token):
     assert len(response.json()) >= 1
 
 
+def test_list_shorten_urls_pages(fast_api_client, user_token):
+    headers = {"Authorization": f"Bearer {user_token}"}
+    for index in range(3):
+        fast_api_client.post(
+            f"{settings.API_V1}/urls/shorten",
+            json={"original_url": f"http://localhost:8080/page-{index}"},
+            headers=headers,
+        )
+
+    response = fast_api_client.get(
+        f"{settings.API_V1}/urls?stream=true", headers=headers
+    )
+    assert response.status_code == 200
+    streamed = [line for line in response.text.splitlines() if line]
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = fast_api_client.get(
+            f"{settings.API_V1}/urls", params=params, headers=headers
+        )
+        assert response.status_code == 200
+        assert len(response.json()) <= 2
+        seen.extend(item["short_url"] for item in response.json())
+
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    # pages don't overlap and match the streamed listing, newest first.
+    assert len(seen) == len(set(seen))
+    assert seen == [json.loads(line)["short_url"] for line in streamed]
+
+    response = fast_api_client.get(
+        f"{settings.API_V1}/urls", params={"cursor": "garbage"}, headers=headers
+    )
+    assert response.status_code == 400
+
+
+def test_shorten_urls_batch(fast_api_client, user_token):
+    response = fast_api_client.post(
+        f"{settings.API_V1}/urls/shorten/batch",
+        json={
+            "items": [
+                {"original_url": "http://localhost:8080/batch-1"},
+                {"original_url": "http://localhost:8080/batch-2", "alias": "batch"},
+                {"original_url": "http://localhost:8080/batch-3", "alias": "batch"},
+                {"original_url": "http://localhost:8080/batch-4"},
+            ]
+        },
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 200
+
+    results = response.json()["results"]
+    assert len(results) == 4
+    assert results[1]["short_url"].split("/")[-1] == "batch"
+    # the repeated alias is reported as a conflict, in input order.
+    assert results[2]["short_url"] is None
+    assert "batch" in results[2]["error"]
+
+    for result, index in [(results[0], 1), (results[3], 4)]:
+        response = fast_api_client.get(result["short_url"], follow_redirects=False)
+        assert response.headers["Location"] == f"http://localhost:8080/batch-{index}"
+
+
 # error scenarios.
+def test_redirect_expired_url_error(fast_api_client, user_token):
+    response = fast_api_client.post(
+        f"{settings.API_V1}/urls/shorten",
+        json={
+            "original_url": "http://localhost:8080/expired",
+            "alias": "expired",
+            "expires_in": "2000-01-01T00:00:00",
+        },
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status_code == 200
+
+    response = fast_api_client.get(response.json()["short_url"], follow_redirects=False)
+    assert response.status_code == 404
+
+
+def test_reused_alias_does_not_share_click_stats(fast_api_client, user_token):
+    first = {"Authorization": f"Bearer {user_token}"}
+    response = fast_api_client.post(
+        f"{settings.API_V1}/urls/shorten",
+        json={
+            "original_url": "http://localhost:8080/reused-1",
+            "alias": "reused",
+            "expires_in": "2000-01-01T00:00:00",
+        },
+        headers=first,
+    )
+    assert response.status_code == 200
+
+    state = fast_api_client.app.state
+    with SessionContext(with_transaction=True):
+        state.url_click_count_service.increment_counts(
+            [ClickCount(short_url="reused", country_code="IN", counts=3)]
+        )
+    URLReaper(redis_cache=state.url_service.cache, mode="archive").reap()
+
+    # the archived url still belongs to its creator.
+    response = fast_api_client.get(
+        f"{settings.API_V1}/urls/stats/reused", headers=first
+    )
+    assert response.json()["total"] == 3
+
+    response = fast_api_client.post(
+        f"{settings.API_V1}/users",
+        json={"username": "reuser", "password": "test", "display_name": "Re"},
+    )
+    second = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = fast_api_client.post(
+        f"{settings.API_V1}/urls/shorten",
+        json={"original_url": "http://localhost:8080/reused-2", "alias": "reused"},
+        headers=second,
+    )
+    assert response.status_code == 200
+
+    response = fast_api_client.get(
+        f"{settings.API_V1}/urls/stats/reused", headers=second
+    )
+    assert response.status_code == 200
+    assert response.json() == {"short_url": "reused", "total": 0, "countries": []}
+
+    for path in [
+        "",
+        "/visitors",
+        "/series?start=2026-01-01T00:00:00&end=2026-01-02T00:00:00",
+    ]:
+        response = fast_api_client.get(
+            f"{settings.API_V1}/urls/stats/reused{path}", headers=first
+        )
+        assert response.status_code == 404
+
+
+def test_trending_lists_only_own_links(fast_api_client, user_token):
+    mine = {"Authorization": f"Bearer {user_token}"}
+    response = fast_api_client.post(
+        f"{settings.API_V1}/users",
+        json={"username": "trender", "password": "test", "display_name": "Tr"},
+    )
+    theirs = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    for alias, headers in [("trend-mine", mine), ("trend-theirs", theirs)]:
+        fast_api_client.post(
+            f"{settings.API_V1}/urls/shorten",
+            json={"original_url": f"http://localhost:8080/{alias}", "alias": alias},
+            headers=headers,
+        )
+
+    trending = fast_api_client.app.state.trending
+    trending.record(["trend-theirs"] * 5 + ["trend-mine"] * 2)
+    trending.flush(force=True)
+
+    for headers, own, other in [
+        (mine, "trend-mine", "trend-theirs"),
+        (theirs, "trend-theirs", "trend-mine"),
+    ]:
+        response = fast_api_client.get(
+            f"{settings.API_V1}/urls/trending", headers=headers
+        )
+        short_urls = [item["short_url"] for item in response.json()]
+        assert own in short_urls
+        assert other not in short_urls
+
+
 def test_shorten_url_with_same_alias_error(fast_api_client, user_token):
     for alias, status_code in [("test-1", 200), ("test-1", 409)]:
         response = fast_api_client.post(
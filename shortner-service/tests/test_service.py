@@ -1,8 +1,22 @@
+import uuid
 from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from unittest import mock
 
+import pytest
+
+from app.cache import CacheRecord, LocalCache
 from app.config import settings
 from app.db import SessionContext, current_ctx
-from app.service import CounterService
+from app.dto import ClickBucketCount, ClickCount, UserCreate
+from app.exceptions import NotFound
+from app.models import URL
+from app.service import (
+    CacheWarmer,
+    CounterService,
+    URLClickCountService,
+    UserService,
+)
 
 
 def test_get_next_id_conflict_free():
@@ -10,23 +24,15 @@ def test_get_next_id_conflict_free():
     counter_service = CounterService(
         key=settings.id_counter_key,
         batch_size=batch_size,
-        context=current_ctx,
     )
 
     num_threads = 10
     ids_per_thread = 1000
 
     def worker():
-        return_values = []
-        for _ in range(ids_per_thread):
-            # we need to create session for each call, otherwise it will end up
-            # in deadlock. Because each session won't commit until it has exhausted
-            # the whole ids_per_thread. Since batch_size is just 10, two threads
-            # would end up update the same row and hence getting stuck forever.
-            with SessionContext(atomic=True):
-                return_values.append(counter_service.get_next_id())
-
-        return return_values
+        # blocks are reserved on the counter's own session, callers don't need
+        # a session in context.
+        return [counter_service.get_next_id() for _ in range(ids_per_thread)]
 
     with ThreadPoolExecutor(max_workers=num_threads) as pool:
         futures = [
@@ -43,3 +49,185 @@ def test_get_next_id_conflict_free():
     total = num_threads * ids_per_thread
     assert len(all_ids) == total
     assert len(set(all_ids)) == total
+
+
+def test_increment_counts_upserts_per_country():
+    with SessionContext(with_transaction=True) as session:
+        user = UserService(context=current_ctx).create_user(
+            user_data=UserCreate(
+                username="click-counter", password="test", display_name="Test"
+            ),
+        )
+        session.add(
+            URL(original_url="http://localhost", short_url="clicks", created_by=user.id)
+        )
+
+    url_click_count_service = URLClickCountService(context=current_ctx)
+    for _ in range(2):
+        with SessionContext(with_transaction=True):
+            url_click_count_service.increment_counts(
+                [
+                    ClickCount(short_url="clicks", country_code="IN", counts=2),
+                    ClickCount(short_url="clicks", country_code="US", counts=1),
+                ]
+            )
+
+    with SessionContext(with_transaction=False):
+        url_click_count_service.ensure_owner("clicks", user_id=user.id)
+        stats, next_cursor = url_click_count_service.get_stats(
+            short_url="clicks", limit=10
+        )
+        first, cursor = url_click_count_service.get_stats(short_url="clicks", limit=1)
+        second, _ = url_click_count_service.get_stats(
+            short_url="clicks", limit=1, cursor=cursor
+        )
+        with pytest.raises(NotFound):
+            url_click_count_service.ensure_owner("clicks", user_id=uuid.uuid4())
+
+    assert stats.total == 6
+    assert next_cursor is None
+    assert [(stat.country_code, stat.counts) for stat in stats.countries] == [
+        ("IN", 4),
+        ("US", 2),
+    ]
+    assert [stat.country_code for stat in first.countries + second.countries] == [
+        "IN",
+        "US",
+    ]
+
+
+def test_stats_include_pending_only_countries():
+    pending_clicks = mock.Mock()
+    pending_clicks.get.return_value = {"IN": 1, "BR": 2, "AR": 1}
+    url_click_count_service = URLClickCountService(
+        context=current_ctx, pending_clicks=pending_clicks
+    )
+    with SessionContext(with_transaction=True):
+        url_click_count_service.increment_counts(
+            [ClickCount(short_url="pending", country_code="IN", counts=5)]
+        )
+
+    pages = []
+    cursor = None
+    with SessionContext(with_transaction=False):
+        while True:
+            stats, cursor = url_click_count_service.get_stats(
+                short_url="pending", limit=2, cursor=cursor
+            )
+            pages.append([(row.country_code, row.counts) for row in stats.countries])
+            if cursor is None:
+                break
+
+    # committed order first, then the countries only pending so far.
+    assert pages == [[("IN", 6), ("AR", 1)], [("BR", 2)]]
+    assert stats.total == 9
+
+
+def test_click_buckets_answer_time_range_stats():
+    url_click_count_service = URLClickCountService(context=current_ctx)
+    day = datetime(2026, 10, 18)
+    buckets = [
+        ClickBucketCount(
+            short_url="buckets",
+            country_code=country_code,
+            bucket_start=day + timedelta(hours=hour),
+            counts=counts,
+        )
+        for hour, country_code, counts in [(1, "IN", 2), (1, "US", 1), (5, "IN", 3)]
+    ]
+    with SessionContext(with_transaction=True):
+        url_click_count_service.increment_buckets(
+            hourly=buckets,
+            daily=[
+                bucket.model_copy(update={"bucket_start": day}) for bucket in buckets
+            ],
+        )
+
+    with SessionContext(with_transaction=False):
+        stats, _ = url_click_count_service.get_stats(
+            short_url="buckets",
+            limit=10,
+            start=day,
+            end=day + timedelta(hours=2),
+        )
+        series = url_click_count_service.get_series(
+            short_url="buckets", start=day, end=day + timedelta(days=1)
+        )
+        daily = url_click_count_service.get_series(
+            short_url="buckets",
+            start=day,
+            end=day + timedelta(days=1),
+            granularity="day",
+        )
+
+    assert stats.total == 3
+    assert [(stat.country_code, stat.counts) for stat in stats.countries] == [
+        ("IN", 2),
+        ("US", 1),
+    ]
+    assert [(point.bucket_start.hour, point.counts) for point in series] == [
+        (1, 3),
+        (5, 3),
+    ]
+    assert [point.counts for point in daily] == [6]
+
+
+def test_warm_top_urls_loads_most_clicked():
+    with SessionContext(with_transaction=True) as session:
+        user = UserService(context=current_ctx).create_user(
+            user_data=UserCreate(username="warmer", password="test", display_name="W"),
+        )
+        for short_url in ["warm-hot", "warm-cold"]:
+            session.add(
+                URL(
+                    original_url=f"http://localhost/{short_url}",
+                    short_url=short_url,
+                    created_by=user.id,
+                )
+            )
+        session.flush()
+
+        URLClickCountService(context=current_ctx).increment_counts(
+            [
+                ClickCount(short_url="warm-hot", country_code="IN", counts=10**6),
+                ClickCount(short_url="warm-hot", country_code="US", counts=10**6),
+                ClickCount(short_url="warm-cold", country_code="IN", counts=1),
+            ]
+        )
+
+    redis_cache = mock.Mock()
+    redis_cache.set_many.return_value = 1
+    cache_warmer = CacheWarmer(context=current_ctx, redis_cache=redis_cache)
+    with SessionContext(with_transaction=False):
+        assert cache_warmer.warm_top_urls(1) == 1
+
+    redis_cache.set_many.assert_called_once_with(
+        {"warm-hot": CacheRecord.of("http://localhost/warm-hot", owner_id=user.id)},
+        cache_warmer.cache_ttl_seconds,
+    )
+    assert cache_warmer.stats()["warmup_keys"] == 1
+
+
+def test_principal_cached_until_user_changes():
+    principal_cache = LocalCache(max_size=10, ttl_seconds=60)
+    user_service = UserService(context=current_ctx, principal_cache=principal_cache)
+    with SessionContext(with_transaction=True):
+        user = user_service.create_user(
+            user_data=UserCreate(
+                username="principal", password="test", display_name="P"
+            ),
+        )
+    user_id = str(user.id)
+
+    with SessionContext(with_transaction=False):
+        assert user_service.get_principal(user_id=user_id).is_active
+
+    # served from the cache, no session in context.
+    assert user_service.get_principal(user_id=user_id).username == "principal"
+
+    with SessionContext(with_transaction=True):
+        user_service.set_active(user_id=user.id, is_active=False)
+
+    assert principal_cache.get(user_id) is None
+    with SessionContext(with_transaction=False):
+        assert not user_service.get_principal(user_id=user_id).is_active
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.singleflight import AsyncSingleFlight, SingleFlight
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def lookup():
+        calls.append(1)
+        release.wait(timeout=5)
+        return "http://localhost"
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(single_flight.do, "code", lookup) for _ in range(8)]
+        # let every caller join the in-flight lookup before it completes.
+        while single_flight.coalesced < 7:
+            time.sleep(0.001)
+        release.set()
+
+    assert [future.result() for future in futures] == ["http://localhost"] * 8
+    assert len(calls) == 1
+    assert single_flight.stats() == {"in_flight": 0, "executions": 1, "coalesced": 7}
+
+
+def test_single_flight_shares_errors():
+    single_flight = SingleFlight()
+
+    def lookup():
+        raise KeyError("code")
+
+    with pytest.raises(KeyError):
+        single_flight.do("code", lookup)
+
+    # a finished call is forgotten, the next one runs again.
+    assert single_flight.do("code", lambda: "retry") == "retry"
+
+
+def test_async_single_flight_coalesces_concurrent_calls():
+    single_flight = AsyncSingleFlight()
+    calls = []
+
+    async def lookup():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "http://localhost"
+
+    async def run():
+        return await asyncio.gather(
+            *[single_flight.do("code", lookup) for _ in range(5)]
+        )
+
+    assert asyncio.run(run()) == ["http://localhost"] * 5
+    assert len(calls) == 1
+    assert single_flight.stats()["coalesced"] == 4
+
+
+def test_async_single_flight_survives_a_cancelled_leader():
+    single_flight = AsyncSingleFlight()
+    release = asyncio.Event()
+
+    async def lookup():
+        await release.wait()
+        return "http://localhost"
+
+    async def run():
+        leader = asyncio.ensure_future(single_flight.do("code", lookup))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(single_flight.do("code", lookup))
+        await asyncio.sleep(0)
+
+        # the leader's request goes away while the follower still waits.
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "http://localhost"
+    assert single_flight.stats() == {"in_flight": 0, "executions": 1, "coalesced": 1}
@@ -0,0 +1,42 @@
+import random
+from unittest import mock
+
+from app.trending import SpaceSaving, TrendingLinks
+
+
+def test_space_saving_keeps_heavy_hitters():
+    stream = ["hot"] * 500 + ["warm"] * 200 + [f"cold-{i}" for i in range(2000)]
+    random.Random(7).shuffle(stream)
+
+    sketch = SpaceSaving(capacity=50)
+    for key in stream:
+        sketch.offer(key)
+
+    assert len(sketch) == 50
+    top = sketch.top(2)
+    assert [key for key, _ in top] == ["hot", "warm"]
+    # counts only ever overestimate, by at most total / capacity.
+    assert 500 <= top[0][1] <= 500 + len(stream) // 50
+    assert 200 <= top[1][1] <= 200 + len(stream) // 50
+
+
+def test_trending_flushes_sketch_into_current_slot():
+    client = mock.MagicMock()
+    trending = TrendingLinks(client, slot_seconds=60, window_seconds=300)
+    trending.record(["a", "b", "a"])
+
+    assert trending.flush() == 0
+    assert trending.flush(force=True) == 2
+
+    pipeline = client.pipeline.return_value
+    key = pipeline.zincrby.call_args_list[0].args[0]
+    assert key.startswith(TrendingLinks.PREFIX)
+    assert {call.args[1:] for call in pipeline.zincrby.call_args_list} == {
+        (2, "a"),
+        (1, "b"),
+    }
+    pipeline.expire.assert_called_once_with(key, 360)
+
+    client.zunion.return_value = [("b", 1.0), ("a", 5.0)]
+    assert trending.top(1) == [("a", 5)]
+    assert len(client.zunion.call_args.args[0]) == 5
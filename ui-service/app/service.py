@@ -43,10 +43,21 @@ class ShortenerService:
         return User(**resp.json())
 
     async def list_urls(self) -> List[URLItem]:
-        resp = await self.client.get("/api/v1/urls", headers=self._headers())
-        if resp.status_code != 200:
-            raise APIError(resp.status_code, resp.json())
-        return [URLItem(**it) for it in resp.json()]
+        # the api returns a page at a time, follow X-Next-Cursor to the last one.
+        items: List[URLItem] = []
+        params: Dict[str, Any] = {}
+        while True:
+            resp = await self.client.get(
+                "/api/v1/urls", params=params, headers=self._headers()
+            )
+            if resp.status_code != 200:
+                raise APIError(resp.status_code, resp.json())
+            items.extend(URLItem(**it) for it in resp.json())
+
+            cursor = resp.headers.get("X-Next-Cursor")
+            if not cursor:
+                return items
+            params = {"cursor": cursor}
 
     async def shorten(self, payload: ShortenRequest) -> URLItem:
         resp = await self.client.post(